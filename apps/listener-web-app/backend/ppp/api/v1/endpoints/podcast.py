@@ -13,15 +13,18 @@
 # limitations under the License.
 
 import os
+import re
 from datetime import datetime, timedelta
 from typing import Optional
+from urllib.parse import quote
 
 import google.auth
 import google.auth.transport.requests
 from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import RedirectResponse, Response
 
-from ppp.models.listener_program import PublishSetting
+from ppp.models.listener_program import ListenerProgram, PublishSetting
+from ppp.models.program_broadcast_history import ProgramBroadcastHistory
 from ppp.services.chat import ChatAPI, get_chat_api
 from ppp.services.listener_program import ListenerProgramService, get_listener_program_service
 from ppp.services.program_broadcast_history import ProgramBroadcastHistoryService, get_program_broadcast_history_service
@@ -168,6 +171,7 @@ async def get_podcast_audio(
     program_id: str,
     broadcast_history_id: str,
     private_key: Optional[str] = Query(None, description="Private key for limited access"),
+    rendition: Optional[str] = Query(None, description="Rendition name such as opus_64k or aac_128k. Defaults to the program audio"),
     listener_program_service: ListenerProgramService = Depends(get_listener_program_service),
     broadcast_history_service: ProgramBroadcastHistoryService = Depends(get_program_broadcast_history_service),
     chat_api: ChatAPI = Depends(get_chat_api),
@@ -182,30 +186,80 @@ async def get_podcast_audio(
         program_id: The ID of the program.
         broadcast_history_id: The ID of the broadcast history.
         private_key: The private key for limited access (optional).
+        rendition: The name of the rendition to serve (optional).
 
     Returns:
         Audio file response or redirect to signed URL.
 
     Raises:
         HTTPException:
-            - 404 if program or broadcast history not found
+            - 404 if program, broadcast history or rendition not found
             - 400 if program is private or invalid private key for limited access
     """
     try:
-        # 1. Get ListenerProgram by program_id
-        program = await listener_program_service.get_by_id(program_id)
-        if not program:
-            raise HTTPException(status_code=404, detail="Program not found")
+        # 1. Get the ListenerProgram and check its publish_setting
+        program = await _get_accessible_program(program_id, private_key, listener_program_service)
 
-        # 2. Check publish_setting (same logic as RSS endpoint)
-        if program.publish_setting == PublishSetting.PRIVATE:
-            raise HTTPException(status_code=400, detail="Program is private")
+        # 2. Get the broadcast history
+        broadcast_history = await broadcast_history_service.get_broadcast_history_by_id(program_id, broadcast_history_id)
+        if broadcast_history is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Broadcast history with ID {broadcast_history_id} not found",
+            )
 
-        if program.publish_setting == PublishSetting.LIMITED:
-            if not private_key or private_key != program.private_key:
-                raise HTTPException(status_code=400, detail="Invalid private key")
+        # 3. Select the rendition (the program audio by default)
+        artifact_id = broadcast_history.artifact_id
+        if rendition is not None:
+            selected = broadcast_history.rendition(rendition)
+            if selected is None:
+                raise HTTPException(status_code=404, detail=f"Rendition {rendition} not found")
+            artifact_id = selected.artifact_id
+
+        # 4. Serve the artifact
+        return await _serve_artifact(program.listener_id, broadcast_history, artifact_id, chat_api)
+
+    except HTTPException:
+        # Re-raise HTTPExceptions
+        raise
+    except Exception as e:
+        # Handle any other unexpected errors
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.get("/waveform/{program_id}/{broadcast_history_id}")
+async def get_podcast_waveform(
+    program_id: str,
+    broadcast_history_id: str,
+    private_key: Optional[str] = Query(None, description="Private key for limited access"),
+    listener_program_service: ListenerProgramService = Depends(get_listener_program_service),
+    broadcast_history_service: ProgramBroadcastHistoryService = Depends(get_program_broadcast_history_service),
+    chat_api: ChatAPI = Depends(get_chat_api),
+) -> Response:
+    """
+    Get the precomputed waveform of a podcast episode.
+
+    The mastering agent stores min/max peaks at several resolutions together with the exact duration and loudness,
+    so clients can draw the waveform without downloading the audio and the server never decodes it.
+
+    Args:
+        program_id: The ID of the program.
+        broadcast_history_id: The ID of the broadcast history.
+        private_key: The private key for limited access (optional).
+
+    Returns:
+        Waveform JSON response or redirect to signed URL.
+
+    Raises:
+        HTTPException:
+            - 404 if program, broadcast history or waveform not found
+            - 400 if program is private or invalid private key for limited access
+    """
+    try:
+        # 1. Get the ListenerProgram and check its publish_setting
+        program = await _get_accessible_program(program_id, private_key, listener_program_service)
 
-        # 3. Get the broadcast history
+        # 2. Get the broadcast history
         broadcast_history = await broadcast_history_service.get_broadcast_history_by_id(program_id, broadcast_history_id)
         if broadcast_history is None:
             raise HTTPException(
@@ -213,54 +267,81 @@ async def get_podcast_audio(
                 detail=f"Broadcast history with ID {broadcast_history_id} not found",
             )
 
-        # 4. Check if K_SERVICE is in environment (Cloud Run environment)
-        if "K_SERVICE" in os.environ and GCS_AVAILABLE:
-            # Use GCS signed URL approach
-            try:
-                credentials, _ = google.auth.default()
-                credentials.refresh(google.auth.transport.requests.Request())
+        # 3. Episodes mastered before waveforms were introduced do not have one
+        if not broadcast_history.waveform_artifact_id:
+            raise HTTPException(status_code=404, detail="Waveform not found")
 
-                # Get GCS URI from broadcast history
-                gcs_uri = broadcast_history.gcs_uri()
+        # 4. Serve the artifact
+        return await _serve_artifact(program.listener_id, broadcast_history, broadcast_history.waveform_artifact_id, chat_api)
 
-                # Parse GCS URI (gs://bucket/path)
-                if not gcs_uri.startswith("gs://"):
-                    raise HTTPException(status_code=500, detail="Invalid GCS URI format")
+    except HTTPException:
+        # Re-raise HTTPExceptions
+        raise
+    except Exception as e:
+        # Handle any other unexpected errors
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-                # Extract bucket and blob path
-                gcs_path = gcs_uri[5:]  # Remove 'gs://' prefix
-                bucket_name, blob_path = gcs_path.split("/", 1)
 
-                # Create GCS client and get signed URL
-                client = storage.Client()
-                bucket = client.bucket(bucket_name)
-                blob = bucket.blob(blob_path)
+@router.get("/hls/{program_id}/{broadcast_history_id}/{filename}")
+async def get_podcast_hls(
+    program_id: str,
+    broadcast_history_id: str,
+    filename: str,
+    private_key: Optional[str] = Query(None, description="Private key for limited access"),
+    listener_program_service: ListenerProgramService = Depends(get_listener_program_service),
+    broadcast_history_service: ProgramBroadcastHistoryService = Depends(get_program_broadcast_history_service),
+    chat_api: ChatAPI = Depends(get_chat_api),
+) -> Response:
+    """
+    Get the HLS playlist or one of its fMP4 segments for a podcast episode.
 
-                # Generate signed URL with 10 minutes expiration
-                signed_url = blob.generate_signed_url(
-                    version="v4",
-                    expiration=datetime.now() + timedelta(minutes=10),
-                    method="GET",
-                    service_account_email=credentials.service_account_email,
-                    access_token=credentials.token
-                )
+    The playlist refers to its segments by relative file names, so they are served from the same path.
+    For limited programs the private key is appended to every segment URI of the playlist.
 
-                # Redirect to signed URL
-                return RedirectResponse(url=signed_url, status_code=302)
+    Args:
+        program_id: The ID of the program.
+        broadcast_history_id: The ID of the broadcast history.
+        filename: The playlist file name or a segment file name.
+        private_key: The private key for limited access (optional).
 
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Failed to generate signed URL: {str(e)}")
-        else:
-            # Use direct artifact serving (same as existing get_program_broadcast_history_audio)
-            artifact = await chat_api.load_artifact(program.listener_id, broadcast_history.session_id, broadcast_history.artifact_id)
+    Returns:
+        Playlist response, segment response or redirect to signed URL.
 
-            if artifact is None:
-                raise HTTPException(
-                    status_code=404,
-                    detail="Artifact not found",
-                )
+    Raises:
+        HTTPException:
+            - 404 if program, broadcast history, HLS playlist or segment not found
+            - 400 if program is private or invalid private key for limited access
+    """
+    try:
+        # 1. Get the ListenerProgram and check its publish_setting
+        program = await _get_accessible_program(program_id, private_key, listener_program_service)
+
+        # 2. Get the broadcast history
+        broadcast_history = await broadcast_history_service.get_broadcast_history_by_id(program_id, broadcast_history_id)
+        if broadcast_history is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Broadcast history with ID {broadcast_history_id} not found",
+            )
+
+        # 3. Only the playlist, its init segment and its media segments can be served
+        playlist = broadcast_history.hls_playlist_artifact_id
+        if not playlist or not _is_hls_file(filename, playlist):
+            raise HTTPException(status_code=404, detail="HLS playlist not found")
+
+        if filename != playlist:
+            return await _serve_artifact(program.listener_id, broadcast_history, filename, chat_api)
+
+        # 4. Serve the playlist directly so that the private key can be added to the segment URIs
+        artifact = await chat_api.load_artifact(program.listener_id, broadcast_history.session_id, playlist)
+        if artifact is None:
+            raise HTTPException(status_code=404, detail="Artifact not found")
 
-            return Response(status_code=200, content=artifact.inline_data.data, media_type=artifact.inline_data.mime_type)
+        content = artifact.inline_data.data.decode()
+        if private_key:
+            content = "\n".join(_with_private_key(line, private_key) for line in content.split("\n"))
+
+        return Response(status_code=200, content=content, media_type="application/vnd.apple.mpegurl")
 
     except HTTPException:
         # Re-raise HTTPExceptions
@@ -268,3 +349,102 @@ async def get_podcast_audio(
     except Exception as e:
         # Handle any other unexpected errors
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+def _is_hls_file(filename: str, playlist: str) -> bool:
+    """
+    Whether the file name is the playlist or one of the files written with it (<name>_init.mp4 and <name>_00000.m4s).
+    """
+    prefix = re.escape(playlist.rsplit(".", 1)[0])
+    return filename == playlist or re.fullmatch(rf"{prefix}_(init\.mp4|\d+\.m4s)", filename) is not None
+
+
+def _with_private_key(line: str, private_key: str) -> str:
+    """
+    Append the private key to a URI line of an HLS playlist, including the URI attribute of EXT-X-MAP.
+    """
+    query = f"?private_key={quote(private_key)}"
+    if line.startswith("#EXT-X-MAP:"):
+        return re.sub(r'URI="([^"]+)"', lambda m: f'URI="{m.group(1)}{query}"', line)
+    if not line.strip() or line.startswith("#"):
+        return line
+    return f"{line}{query}"
+
+
+async def _get_accessible_program(program_id: str, private_key: Optional[str], listener_program_service: ListenerProgramService) -> ListenerProgram:
+    """
+    Get the program whose episodes are requested, checking that they can be served with the private key.
+
+    Raises:
+        HTTPException:
+            - 404 if program not found
+            - 400 if program is private or invalid private key for limited access
+    """
+    program = await listener_program_service.get_by_id(program_id)
+    if not program:
+        raise HTTPException(status_code=404, detail="Program not found")
+
+    if program.publish_setting == PublishSetting.PRIVATE:
+        raise HTTPException(status_code=400, detail="Program is private")
+
+    if program.publish_setting == PublishSetting.LIMITED:
+        if not private_key or private_key != program.private_key:
+            raise HTTPException(status_code=400, detail="Invalid private key")
+
+    return program
+
+
+async def _serve_artifact(listener_id: str, broadcast_history: ProgramBroadcastHistory, artifact_id: str, chat_api: ChatAPI) -> Response:
+    """
+    Serve an artifact of the broadcast session.
+
+    On Cloud Run the client is redirected to a GCS signed URL, otherwise the artifact is loaded and returned directly.
+    """
+    # Check if K_SERVICE is in environment (Cloud Run environment)
+    if "K_SERVICE" in os.environ and GCS_AVAILABLE:
+        # Use GCS signed URL approach
+        try:
+            credentials, _ = google.auth.default()
+            credentials.refresh(google.auth.transport.requests.Request())
+
+            # Get GCS URI from broadcast history
+            gcs_uri = broadcast_history.gcs_uri(artifact_id=artifact_id)
+
+            # Parse GCS URI (gs://bucket/path)
+            if not gcs_uri.startswith("gs://"):
+                raise HTTPException(status_code=500, detail="Invalid GCS URI format")
+
+            # Extract bucket and blob path
+            gcs_path = gcs_uri[5:]  # Remove 'gs://' prefix
+            bucket_name, blob_path = gcs_path.split("/", 1)
+
+            # Create GCS client and get signed URL
+            client = storage.Client()
+            bucket = client.bucket(bucket_name)
+            blob = bucket.blob(blob_path)
+
+            # Generate signed URL with 10 minutes expiration
+            signed_url = blob.generate_signed_url(
+                version="v4",
+                expiration=datetime.now() + timedelta(minutes=10),
+                method="GET",
+                service_account_email=credentials.service_account_email,
+                access_token=credentials.token
+            )
+
+            # Redirect to signed URL
+            return RedirectResponse(url=signed_url, status_code=302)
+
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to generate signed URL: {str(e)}")
+    else:
+        # Use direct artifact serving (same as existing get_program_broadcast_history_audio)
+        artifact = await chat_api.load_artifact(listener_id, broadcast_history.session_id, artifact_id)
+
+        if artifact is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Artifact not found",
+            )
+
+        return Response(status_code=200, content=artifact.inline_data.data, media_type=artifact.inline_data.mime_type)
@@ -15,7 +15,8 @@
 from enum import Enum
 
 from firedantic import AsyncSubCollection
-from pydantic import Field
+from pydantic import BaseModel, ConfigDict, Field
+from pydantic.alias_generators import to_camel
 
 from ppp.models.base import BaseSubModel
 from ppp.settings import get_settings
@@ -28,6 +29,21 @@ class ProgramBroadcastHistoryStatus(str, Enum):
     FAILURE = "failure"
 
 
+class BroadcastRendition(BaseModel):
+    """
+    An encoded variant of the broadcast audio (e.g. MP3 96k, AAC 128k, Opus 64k).
+    """
+
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True)
+
+    name: str = Field(description="rendition name, e.g. mp3_96k")
+    codec: str = Field(description="audio codec (mp3, aac or opus)")
+    bitrate: str = Field(description="encoder bitrate, e.g. 96k")
+    artifact_id: str = Field(description="artifact id")
+    mime_type: str = Field(description="mime type of the artifact")
+    size: int = Field(description="file size in bytes")
+
+
 class ProgramBroadcastHistory(BaseSubModel):
     no: int = Field(description="number of broadcast", min=0)
     app_name: str = Field(description="app name")
@@ -40,10 +56,18 @@ class ProgramBroadcastHistory(BaseSubModel):
     status: ProgramBroadcastHistoryStatus = Field(default=ProgramBroadcastHistoryStatus.PREPARE, description="status")
     dry_run: bool = Field(description="dry run", default=False)
     size: int | None = Field(description="audio file size in bytes", default=None)
+    renditions: list[BroadcastRendition] = Field(description="encoded renditions of the audio. The first one is artifact_id", default_factory=list)
+    hls_playlist_artifact_id: str | None = Field(description="artifact id of the HLS playlist", default=None)
+    waveform_artifact_id: str | None = Field(description="artifact id of the waveform peaks (JSON)", default=None)
+    duration_seconds: float | None = Field(description="exact duration of the audio in seconds", default=None)
+    integrated_loudness: float | None = Field(description="integrated loudness of the audio in LUFS", default=None)
+
+    def rendition(self, name: str) -> BroadcastRendition | None:
+        return next((rendition for rendition in self.renditions if rendition.name == name), None)
 
-    def gcs_uri(self, version="0"):
+    def gcs_uri(self, version="0", artifact_id: str | None = None):
         settings = get_settings()
-        return f"gs://{settings.ARTIFACT_BUCKET}/{self.app_name}/{self.listener_id}/{self.session_id}/{self.artifact_id}/{version}"
+        return f"gs://{settings.ARTIFACT_BUCKET}/{self.app_name}/{self.listener_id}/{self.session_id}/{artifact_id or self.artifact_id}/{version}"
 
     class Collection(AsyncSubCollection):
         __collection_tpl__ = "listener_programs/{id}/broadcast_history"
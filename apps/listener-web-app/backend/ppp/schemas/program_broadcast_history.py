@@ -16,7 +16,7 @@ from typing import Optional
 
 from pydantic import Field
 
-from ppp.models.program_broadcast_history import ProgramBroadcastHistoryStatus
+from ppp.models.program_broadcast_history import BroadcastRendition, ProgramBroadcastHistoryStatus
 from ppp.schemas.base import BaseCreateSchema, BaseSchema, BaseUpdateSchema
 
 
@@ -34,6 +34,11 @@ class ProgramBroadcastHistorySchema(BaseSchema):
     news_letter_contents: str | None
     talk_script: str | None
     dry_run: bool = False
+    renditions: list[BroadcastRendition] = []
+    hls_playlist_artifact_id: str | None = None
+    waveform_artifact_id: str | None = None
+    duration_seconds: float | None = None
+    integrated_loudness: float | None = None
 
     def gcs_uri(self, version="0"):
         """
@@ -24,7 +24,7 @@ from pydantic_core._pydantic_core import ValidationError
 
 from ppp.models.listener_program import ListenerProgram, ProgramStatus
 from ppp.models.listener_program_segment import ListenerProgramSegment
-from ppp.models.program_broadcast_history import ProgramBroadcastHistory, ProgramBroadcastHistoryStatus
+from ppp.models.program_broadcast_history import BroadcastRendition, ProgramBroadcastHistory, ProgramBroadcastHistoryStatus
 from ppp.services.chat import ChatAPI, get_chat_api
 from ppp.services.listener import ListenerService, get_listener_service
 from ppp.services.listener_program import ListenerProgramService, get_listener_program_service
@@ -214,9 +214,22 @@ class RadioService:
             await history.reload()
             history.status = ProgramBroadcastHistoryStatus.SUCCESS
             if not dry_run:
-                history.artifact_id = "audio.mp3"
-                artifact = await self.chat_api.load_artifact(user_id=listener_id, session_id=new_session.id, artifact_id=history.artifact_id)
-                history.size = len(artifact.inline_data.data)
+                # Renditions encoded by the mastering agent. The first one is the program audio, so its size is known without downloading it
+                history.renditions = renditions_from_state(new_session.state)
+                history.hls_playlist_artifact_id = new_session.state.get("mastering__hls_playlist")
+                # Waveform summary computed by the mastering agent, so the exact duration is known without decoding the audio
+                waveform = new_session.state.get("mastering__waveform")
+                if waveform:
+                    history.waveform_artifact_id = waveform["artifact_key"]
+                    history.duration_seconds = waveform["duration_seconds"]
+                    history.integrated_loudness = waveform.get("integrated_loudness")
+                if history.renditions:
+                    history.artifact_id = history.renditions[0].artifact_id
+                    history.size = history.renditions[0].size
+                else:
+                    history.artifact_id = "audio.mp3"
+                    artifact = await self.chat_api.load_artifact(user_id=listener_id, session_id=new_session.id, artifact_id=history.artifact_id)
+                    history.size = len(artifact.inline_data.data)
 
             history.news_letter_contents = new_session.state.get("news_letter_writer__contents")
             history.talk_script = new_session.state.get("talk_script")
@@ -262,6 +275,25 @@ class RadioService:
             return
 
 
+def renditions_from_state(state: dict) -> list[BroadcastRendition]:
+    """
+    Read the renditions recorded by the mastering agent in the session state.
+
+    Sessions mastered before renditions were introduced have none.
+    """
+    return [
+        BroadcastRendition(
+            name=rendition["name"],
+            codec=rendition["codec"],
+            bitrate=rendition["bitrate"],
+            artifact_id=rendition["artifact_key"],
+            mime_type=rendition["mime_type"],
+            size=rendition["size"],
+        )
+        for rendition in state.get("mastering__renditions") or []
+    ]
+
+
 def get_radio_service(
     listener_service: ListenerService = Depends(get_listener_service),
     listener_program_service: ListenerProgramService = Depends(get_listener_program_service),
@@ -197,10 +197,23 @@ class RSSService:
         fe.enclosure(enclosure_url, str(file_size), "audio/mp3")
 
         # iTunes episode specific tags
-        fe.podcast.itunes_duration(f"{program.program_minutes}:00")  # Duration in MM:SS format
+        fe.podcast.itunes_duration(_itunes_duration(history, program))
         fe.podcast.itunes_explicit("no")  # Use "no" instead of False
 
 
+def _itunes_duration(history: ProgramBroadcastHistory, program: ListenerProgram) -> str:
+    """
+    Duration of the episode for the itunes:duration tag in HH:MM:SS format.
+
+    Uses the exact duration measured by the mastering agent, falling back to the planned program length for older episodes.
+    """
+    if history.duration_seconds is None:
+        return f"{program.program_minutes}:00"
+    minutes, seconds = divmod(round(history.duration_seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
 def get_rss_service(
     listener_service=Depends(get_listener_service),
     listener_program_service=Depends(get_listener_program_service),
@@ -27,9 +27,13 @@ sys.path.insert(0, "/")
 
 from datetime import datetime
 
-from ppp.api.v1.endpoints.podcast import get_podcast_audio
+import pytest
+from fastapi import HTTPException
+
+from ppp.api.v1.endpoints.podcast import get_podcast_audio, get_podcast_hls
 from ppp.models.listener_program import ListenerProgram, PublishSetting
-from ppp.models.program_broadcast_history import ProgramBroadcastHistory, ProgramBroadcastHistoryStatus
+from ppp.models.program_broadcast_history import BroadcastRendition, ProgramBroadcastHistory, ProgramBroadcastHistoryStatus
+from ppp.services.radio import renditions_from_state
 
 
 async def test_podcast_audio_endpoint():
@@ -275,5 +279,208 @@ async def test_podcast_audio_endpoint():
     print("\n=== All tests completed ===")
 
 
+PRIVATE_KEY = "test_private_key_12345678901234567890"
+PLAYLIST = "#EXTM3U\n#EXT-X-MAP:URI=\"audio_hls_init.mp4\"\n#EXTINF:6.0,\naudio_hls_00000.m4s\n#EXTINF:4.0,\naudio_hls_00001.m4s\n#EXT-X-ENDLIST\n"
+
+
+def make_program(publish_setting: PublishSetting = PublishSetting.PUBLISH) -> ListenerProgram:
+    return ListenerProgram(
+        id="test_program_123", title="Test Program", description="This is a test program", listener_id="listener_123", publish_setting=publish_setting, private_key=PRIVATE_KEY
+    )
+
+
+def make_history(**kwargs) -> ProgramBroadcastHistory:
+    return ProgramBroadcastHistory(
+        id="history_123",
+        no=1,
+        app_name="test_app",
+        listener_id="listener_123",
+        session_id="session_123",
+        artifact_id="audio.mp3",
+        status=ProgramBroadcastHistoryStatus.SUCCESS,
+        size=1024,
+        created_at=datetime.now(),
+        **kwargs,
+    )
+
+
+def make_rendition(name: str, codec: str, artifact_id: str, mime_type: str) -> BroadcastRendition:
+    return BroadcastRendition(name=name, codec=codec, bitrate=name.rsplit("_", 1)[1], artifact_id=artifact_id, mime_type=mime_type, size=100)
+
+
+def make_services(program: ListenerProgram, history: ProgramBroadcastHistory, artifacts: dict[str, tuple[bytes, str]]) -> dict:
+    """
+    Mock services that return the program, the history and the artifacts of the broadcast session.
+    """
+    listener_program_service = AsyncMock()
+    listener_program_service.get_by_id.return_value = program
+    broadcast_history_service = AsyncMock()
+    broadcast_history_service.get_broadcast_history_by_id.return_value = history
+    chat_api = AsyncMock()
+
+    async def load_artifact(listener_id, session_id, artifact_id):
+        if (listener_id, session_id) != (program.listener_id, history.session_id) or artifact_id not in artifacts:
+            return None
+        artifact = MagicMock()
+        artifact.inline_data.data, artifact.inline_data.mime_type = artifacts[artifact_id]
+        return artifact
+
+    chat_api.load_artifact.side_effect = load_artifact
+    return {"listener_program_service": listener_program_service, "broadcast_history_service": broadcast_history_service, "chat_api": chat_api}
+
+
+RENDITIONS = [
+    make_rendition("mp3_96k", "mp3", "audio.mp3", "audio/mpeg"),
+    make_rendition("aac_128k", "aac", "audio.m4a", "audio/mp4"),
+    make_rendition("opus_64k", "opus", "audio.opus", "audio/ogg"),
+]
+ARTIFACTS = {
+    "audio.mp3": (b"mp3", "audio/mpeg"),
+    "audio.m4a": (b"aac", "audio/mp4"),
+    "audio.opus": (b"opus", "audio/ogg"),
+    "audio_hls.m3u8": (PLAYLIST.encode(), "application/vnd.apple.mpegurl"),
+    "audio_hls_init.mp4": (b"init", "audio/mp4"),
+    "audio_hls_00000.m4s": (b"segment", "audio/mp4"),
+}
+
+
+@pytest.fixture
+def direct_serving(monkeypatch):
+    """
+    Serve artifacts directly instead of redirecting to GCS signed URLs.
+    """
+    monkeypatch.delenv("K_SERVICE", raising=False)
+
+
+def get_audio(services: dict, rendition: str | None = None, private_key: str | None = None):
+    return asyncio.run(get_podcast_audio(program_id="test_program_123", broadcast_history_id="history_123", private_key=private_key, rendition=rendition, **services))
+
+
+def get_hls(services: dict, filename: str, private_key: str | None = None):
+    return asyncio.run(get_podcast_hls(program_id="test_program_123", broadcast_history_id="history_123", filename=filename, private_key=private_key, **services))
+
+
+def test_audio_serves_requested_rendition(direct_serving):
+    services = make_services(make_program(), make_history(renditions=RENDITIONS), ARTIFACTS)
+
+    response = get_audio(services, rendition="opus_64k")
+
+    assert response.body == b"opus"
+    assert response.media_type == "audio/ogg"
+
+
+def test_audio_falls_back_to_program_audio(direct_serving):
+    """
+    Without a rendition, and for episodes mastered before renditions were recorded, the program audio is served.
+    """
+    assert get_audio(make_services(make_program(), make_history(renditions=RENDITIONS), ARTIFACTS)).body == b"mp3"
+    assert get_audio(make_services(make_program(), make_history(), ARTIFACTS)).body == b"mp3"
+
+
+def test_audio_rejects_missing_rendition(direct_serving):
+    services = make_services(make_program(), make_history(), ARTIFACTS)
+
+    with pytest.raises(HTTPException) as e:
+        get_audio(services, rendition="opus_64k")
+
+    assert e.value.status_code == 404
+    assert "Rendition opus_64k not found" in e.value.detail
+
+
+@pytest.mark.parametrize(("publish_setting", "private_key"), [(PublishSetting.PRIVATE, PRIVATE_KEY), (PublishSetting.LIMITED, None), (PublishSetting.LIMITED, "wrong_key")])
+def test_audio_rejects_programs_without_access(direct_serving, publish_setting, private_key):
+    services = make_services(make_program(publish_setting), make_history(), ARTIFACTS)
+
+    with pytest.raises(HTTPException) as e:
+        get_audio(services, private_key=private_key)
+
+    assert e.value.status_code == 400
+    services["chat_api"].load_artifact.assert_not_called()
+
+
+def test_episode_files_not_found_without_program(direct_serving):
+    services = make_services(make_program(), make_history(hls_playlist_artifact_id="audio_hls.m3u8"), ARTIFACTS)
+    services["listener_program_service"].get_by_id.return_value = None
+
+    for get in [lambda: get_audio(services), lambda: get_hls(services, "audio_hls.m3u8")]:
+        with pytest.raises(HTTPException) as e:
+            get()
+        assert e.value.status_code == 404
+        assert e.value.detail == "Program not found"
+    services["broadcast_history_service"].get_broadcast_history_by_id.assert_not_called()
+
+
+def test_hls_playlist_adds_private_key_for_limited_programs(direct_serving):
+    services = make_services(make_program(PublishSetting.LIMITED), make_history(hls_playlist_artifact_id="audio_hls.m3u8"), ARTIFACTS)
+
+    response = get_hls(services, "audio_hls.m3u8", private_key=PRIVATE_KEY)
+
+    assert response.media_type == "application/vnd.apple.mpegurl"
+    assert response.body.decode().split("\n") == [
+        "#EXTM3U",
+        f'#EXT-X-MAP:URI="audio_hls_init.mp4?private_key={PRIVATE_KEY}"',
+        "#EXTINF:6.0,",
+        f"audio_hls_00000.m4s?private_key={PRIVATE_KEY}",
+        "#EXTINF:4.0,",
+        f"audio_hls_00001.m4s?private_key={PRIVATE_KEY}",
+        "#EXT-X-ENDLIST",
+        "",
+    ]
+
+
+def test_hls_serves_public_playlist_and_segments(direct_serving):
+    services = make_services(make_program(), make_history(hls_playlist_artifact_id="audio_hls.m3u8"), ARTIFACTS)
+
+    assert get_hls(services, "audio_hls.m3u8").body.decode() == PLAYLIST
+    assert get_hls(services, "audio_hls_init.mp4").body == b"init"
+    assert get_hls(services, "audio_hls_00000.m4s").body == b"segment"
+
+
+@pytest.mark.parametrize("private_key", [None, "wrong_key"])
+def test_hls_rejects_invalid_private_key(direct_serving, private_key):
+    services = make_services(make_program(PublishSetting.LIMITED), make_history(hls_playlist_artifact_id="audio_hls.m3u8"), ARTIFACTS)
+
+    with pytest.raises(HTTPException) as e:
+        get_hls(services, "audio_hls_00000.m4s", private_key=private_key)
+
+    assert e.value.status_code == 400
+    services["chat_api"].load_artifact.assert_not_called()
+
+
+@pytest.mark.parametrize("filename", ["audio.mp3", "audio_hls.m3u8.bak", "audio_hls_x.m4s", "audio_hls_00000.m4s/../audio.mp3"])
+def test_hls_rejects_files_outside_the_playlist(direct_serving, filename):
+    services = make_services(make_program(), make_history(hls_playlist_artifact_id="audio_hls.m3u8"), ARTIFACTS)
+
+    with pytest.raises(HTTPException) as e:
+        get_hls(services, filename)
+
+    assert e.value.status_code == 404
+    services["chat_api"].load_artifact.assert_not_called()
+
+
+def test_hls_rejects_episodes_without_playlist(direct_serving):
+    services = make_services(make_program(), make_history(), ARTIFACTS)
+
+    with pytest.raises(HTTPException) as e:
+        get_hls(services, "audio_hls.m3u8")
+
+    assert e.value.status_code == 404
+
+
+def test_renditions_from_state():
+    state = {
+        "mastering__renditions": [
+            {"name": "mp3_96k", "codec": "mp3", "bitrate": "96k", "artifact_key": "audio.mp3", "mime_type": "audio/mpeg", "size": 100},
+            {"name": "opus_64k", "codec": "opus", "bitrate": "64k", "artifact_key": "audio.opus", "mime_type": "audio/ogg", "size": 50},
+        ]
+    }
+
+    renditions = renditions_from_state(state)
+
+    assert [(r.name, r.artifact_id, r.size) for r in renditions] == [("mp3_96k", "audio.mp3", 100), ("opus_64k", "audio.opus", 50)]
+    assert renditions_from_state({}) == []
+    assert renditions_from_state({"mastering__renditions": None}) == []
+
+
 if __name__ == "__main__":
     asyncio.run(test_podcast_audio_endpoint())
@@ -0,0 +1,82 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+
+# Set required environment variables for testing
+os.environ["GOOGLE_CLOUD_PROJECT"] = "test-project"
+os.environ["GOOGLE_CLOUD_LOCATION"] = "us-central1"
+os.environ["API_URL"] = "https://api.test.com"
+
+import pytest
+from fastapi import HTTPException
+
+from ppp.api.v1.endpoints.podcast import get_podcast_waveform
+from ppp.models.listener_program import PublishSetting
+from tests.test_podcast_audio import PRIVATE_KEY, make_history, make_program, make_services
+
+WAVEFORM = b'{"duration_seconds": 600.0, "levels": []}'
+
+
+@pytest.fixture
+def direct_serving(monkeypatch):
+    """
+    Serve artifacts directly instead of redirecting to GCS signed URLs.
+    """
+    monkeypatch.delenv("K_SERVICE", raising=False)
+
+
+def get_waveform(services: dict, private_key: str | None = None):
+    return asyncio.run(get_podcast_waveform(program_id="test_program_123", broadcast_history_id="history_123", private_key=private_key, **services))
+
+
+def test_waveform_serves_the_waveform_artifact(direct_serving):
+    services = make_services(make_program(PublishSetting.LIMITED), make_history(waveform_artifact_id="audio_waveform.json"), {"audio_waveform.json": (WAVEFORM, "application/json")})
+
+    response = get_waveform(services, private_key=PRIVATE_KEY)
+
+    assert response.body == WAVEFORM
+    assert response.media_type == "application/json"
+
+
+def test_waveform_not_found_for_older_episodes(direct_serving):
+    """Episodes mastered before waveforms were introduced have no waveform artifact."""
+    services = make_services(make_program(), make_history(), {})
+
+    with pytest.raises(HTTPException) as e:
+        get_waveform(services)
+
+    assert e.value.status_code == 404
+    assert e.value.detail == "Waveform not found"
+
+
+def test_waveform_not_found_when_artifact_is_missing(direct_serving):
+    services = make_services(make_program(), make_history(waveform_artifact_id="audio_waveform.json"), {})
+
+    with pytest.raises(HTTPException) as e:
+        get_waveform(services)
+
+    assert e.value.status_code == 404
+
+
+@pytest.mark.parametrize(("publish_setting", "private_key"), [(PublishSetting.PRIVATE, None), (PublishSetting.LIMITED, None), (PublishSetting.LIMITED, "wrong_key")])
+def test_waveform_rejects_programs_without_access(direct_serving, publish_setting, private_key):
+    services = make_services(make_program(publish_setting), make_history(waveform_artifact_id="audio_waveform.json"), {"audio_waveform.json": (WAVEFORM, "application/json")})
+
+    with pytest.raises(HTTPException) as e:
+        get_waveform(services, private_key=private_key)
+
+    assert e.value.status_code == 400
+    services["chat_api"].load_artifact.assert_not_called()
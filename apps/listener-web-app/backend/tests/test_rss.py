@@ -17,8 +17,20 @@
 Simple test script to verify RSS generation functionality.
 """
 
+import os
+from datetime import datetime
+
+# Set required environment variables for testing
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "test-project")
+os.environ.setdefault("GOOGLE_CLOUD_LOCATION", "us-central1")
+
 from feedgen.feed import FeedGenerator
 
+from ppp.models.listener_program import ListenerProgram
+from ppp.models.program_broadcast_history import ProgramBroadcastHistory, ProgramBroadcastHistoryStatus
+from ppp.services.rss import _itunes_duration
+
+
 def test_rss_generation():
     """Test basic RSS generation with feedgen library."""
     try:
@@ -68,5 +80,36 @@ def test_rss_generation():
         print(f"✗ RSS generation test failed: {e}")
         return False
 
+def _duration(duration_seconds: float | None, program_minutes: int = 10) -> str:
+    program = ListenerProgram(id="program", title="Test Program", description="Test program", listener_id="listener", program_minutes=program_minutes)
+    history = ProgramBroadcastHistory(
+        id="history",
+        no=1,
+        app_name="test_app",
+        listener_id="listener",
+        session_id="session",
+        artifact_id="audio.mp3",
+        status=ProgramBroadcastHistoryStatus.SUCCESS,
+        duration_seconds=duration_seconds,
+        created_at=datetime.now(),
+    )
+    return _itunes_duration(history, program)
+
+
+def test_itunes_duration_uses_measured_duration():
+    assert _duration(3725.4) == "01:02:05"
+    assert _duration(599.6) == "00:10:00"
+
+
+def test_itunes_duration_under_a_minute():
+    assert _duration(42.5) == "00:00:42"
+    assert _duration(0.4) == "00:00:00"
+
+
+def test_itunes_duration_falls_back_to_program_minutes():
+    """Episodes mastered before the duration was measured use the planned program length."""
+    assert _duration(None, program_minutes=15) == "15:00"
+
+
 if __name__ == "__main__":
     test_rss_generation()
@@ -222,6 +222,21 @@ class RecorderState:
         return f"{cls._PREFIX}{task_id}__audio.mp3"
 
 
+@final
+class MasteringState:
+    _PREFIX: StateKey = "mastering__"
+    # 保存したレンディションの一覧(EncodedRenditionのdict)。先頭が番組の音声
+    RENDITIONS: StateKey = f"{_PREFIX}renditions"
+    # HLSのプレイリストのアーティファクトのキー。HLSを作らない場合はNone
+    HLS_PLAYLIST: StateKey = f"{_PREFIX}hls_playlist"
+    # 波形のアーティファクトのキーと、番組の正確な長さ・ラウドネス(Waveform.summary())
+    WAVEFORM: StateKey = f"{_PREFIX}waveform"
+
+    @classmethod
+    def stem_artifact_key(cls, digest: str):
+        return f"{cls._PREFIX}stem__{digest}.pcm"
+
+
 @final
 class NewsLetterWriterState:
     _PREFIX: StateKey = "news_letter_writer__"
@@ -13,36 +13,31 @@
 # limitations under the License.
 
 import asyncio
-import io
 import logging
-import math
-import os
+from datetime import timedelta
 from typing import AsyncGenerator, Optional
 
-import websockets
-from google import genai
 from google.adk import Agent
 from google.adk.agents import BaseAgent
 from google.adk.agents.callback_context import CallbackContext
 from google.adk.agents.invocation_context import InvocationContext
-from google.adk.events import Event
+from google.adk.events import Event, EventActions
 from google.adk.models import LlmRequest, LlmResponse
 from google.genai import types
-from google.genai.live_music import AsyncMusicSession
 from pydantic import Field
-from pydub import AudioSegment
 
 from radio_station.constants import GENERIC_MODEL, THINKING_MODEL
 from radio_station.model.music_plan import MusicPlan
 from radio_station.state_keys import ComposerState
+from radio_station.sub_agents.composer.cache import DEFAULT_ROLE_MAX_AGE, MusicCache, music_plan_hash
+from radio_station.sub_agents.composer.library import DEFAULT_MIN_SCORE, LibraryEntry, MusicKind, plan_bpm, plan_scale
+from radio_station.sub_agents.composer.lyria import LYRIA_FRAME_RATE, lyria_sessions
+from radio_station.sub_agents.composer.scheduler import StanzaScheduler
 from radio_station.sub_agents.composer.tools import generate_music_tool
-from radio_station.utils.artifact import list_artifact
-from radio_station.utils.audio import export_wav
-
-API_KEY = os.environ.get("GEMINI_API_KEY")
-
-BUFFER_SECONDS = 1
-MODEL = "models/lyria-realtime-exp"
+from radio_station.utils.artifact import list_artifact, save_artifact
+from radio_station.utils.artifact_stream import PcmArtifactStream
+from radio_station.utils.beat_grid import analyze_beats, trim_to_bars
+from radio_station.utils.loudness import analyze
 
 logger = logging.getLogger(__name__)
 
@@ -247,7 +242,12 @@ class ComposerAgent(BaseAgent):
     task_id: str = Field(description="The unique identifier for the composer task.")
     music_plan: str = Field(description="The music plan")
     seconds: int | float = Field(description="The number of seconds")
-    audio_byte_array: bytearray = bytearray()
+    role: str | None = Field(description="The segment role (e.g. opening) whose recent music can be reused", default=None)
+    role_max_age: timedelta = Field(description="How long the music of the same role can be reused", default=DEFAULT_ROLE_MAX_AGE)
+    use_cache: bool = Field(description="Whether to reuse the cached music of the program", default=True)
+    description: str | None = Field(description="The music description to find similar music in the program library", default=None)
+    kind: MusicKind = Field(description="How the music is used in the program", default=MusicKind.BED)
+    library_min_score: float = Field(description="The minimum similarity to reuse music in the program library", default=DEFAULT_MIN_SCORE)
 
     def __init__(self, task_id: str, music_plan: str, seconds: int | float, **kwargs):
         super().__init__(
@@ -262,93 +262,85 @@ class ComposerAgent(BaseAgent):
         if ComposerState.task_music_artifact_key(task_id=self.task_id) in await list_artifact(ctx):
             yield Event(invocation_id=ctx.invocation_id, content=types.Content(parts=[types.Part(text=f"Already generated music for: {self.task_id}")]), author=self.name)
 
+        cache = MusicCache.of(ctx) if self.use_cache else None
+        # 同じ役割の最近の音楽があれば、プランも作らずにそのまま使う
+        if cache is not None and self.role is not None:
+            hit = await cache.load_role(self.role, self.seconds, self.role_max_age)
+            if hit is not None:
+                music_plan, part = hit
+                yield await self.reuse_music(ctx, part, music_plan)
+                return
+
         agent = MusicPlanningAgent(task_id=self.task_id, music_plan=self.music_plan, seconds=self.seconds)
         async for event in agent.run_async(ctx):
             yield event
 
-        yield Event(invocation_id=ctx.invocation_id, content=await self.generate_music(ctx), author=self.name)
-
-    async def generate_music(self, ctx: InvocationContext) -> types.Content | None:
-        client = genai.Client(vertexai=False, api_key=API_KEY, http_options={"api_version": "v1alpha"})
-
         music_plan = ComposerState.get_music_plan(ctx.session.state, self.task_id)
+        if cache is not None and music_plan is not None:
+            # 同じプランの音楽を生成済みなら、ストリーミングせずに使う
+            part = await cache.load_plan(music_plan)
+            if part is not None:
+                yield await self.reuse_music(ctx, part)
+                return
+
+            # 番組のライブラリに説明文が近く、プランとBPM・スケールの合う音楽があれば、生成せずに使う
+            if self.description:
+                library = await cache.load_library()
+                entry = library.best(self.description, min_score=self.library_min_score, kind=self.kind, seconds=self.seconds, bpm=plan_bpm(music_plan), scale=plan_scale(music_plan))
+                part = await cache.load_audio(entry.plan_hash) if entry is not None else None
+                if part is not None:
+                    logger.info(f"reuse music in the library for {self.task_id}: {entry.description}")
+                    yield await self.reuse_music(ctx, part, entry.music_plan)
+                    return
+
+        yield Event(invocation_id=ctx.invocation_id, content=await self.generate_music(ctx, cache), author=self.name)
+
+    async def reuse_music(self, ctx: InvocationContext, part: types.Part, music_plan: MusicPlan | None = None) -> Event:
+        """キャッシュの音楽をこのタスクの音楽として保存する。music_planがあればこのタスクのプランにする"""
+        artifact_id = ComposerState.task_music_artifact_key(task_id=self.task_id)
+        await save_artifact(ctx, artifact_id, part)
+        return Event(
+            invocation_id=ctx.invocation_id,
+            content=types.Content(parts=[types.Part(text=f"reuse cached music for:{artifact_id}")]),
+            author=self.name,
+            actions=EventActions(state_delta={ComposerState.task_music_plan(self.task_id): music_plan.model_dump()} if music_plan is not None else {}),
+        )
 
-        initial = True
-
-        async def receive_audio(session: AsyncMusicSession):
-            """Example background task to process incoming audio."""
-
-            chunks_count = 0
-            logger.info("start receive music")
-
-            try:
-                async for message in session.receive():
-                    chunks_count += 1
-                    if chunks_count == 1:
-                        # Introduce a delay before starting playback to have a buffer for network jitter.
-                        await asyncio.sleep(BUFFER_SECONDS)
-
-                    if message.server_content:
-                        audio_data = message.server_content.audio_chunks[0].data
-                        self.audio_byte_array.extend(audio_data)
-                    elif message.filtered_prompt:
-                        logger.info(f"Prompt was filtered out: {message.filtered_prompt}")
-                    else:
-                        logger.info(f"Unknown error occured with message: {message}")
-
-                    await asyncio.sleep(10**-12)
-            except websockets.exceptions.ConnectionClosedOK:
-                # nothing to do
-                pass
-            except Exception as e:
-                logger.exception(f"got error {e}")
-
-        prev_config = None
-        async with (
-            asyncio.TaskGroup() as tg,
-            client.aio.live.music.connect(model="models/lyria-realtime-exp") as session,
-        ):
-            # Set up task to receive server messages.
-            tg.create_task(receive_audio(session))
-            for stanza in music_plan.stanzas:
-                logger.info(f"next stanza {stanza}")
-                # Send initial prompts and config
-                await session.set_weighted_prompts(prompts=stanza.to_gemini_prompts())
-                if prev_config != stanza.config:
-                    logger.info(f"set music config {stanza.config}")
-                    await session.set_music_generation_config(config=stanza.to_gemini_config())
-                    await session.reset_context()
-
-                prev_config = stanza.config
-                if initial:
-                    # Start streaming music
-                    logger.info("start session")
-                    await session.play()
-                    initial = False
-                logger.info(f"sleep {stanza.seconds}")
-                await asyncio.sleep(stanza.seconds)
-
-            logger.info("session stop")
-            await session.pause()
-
-        logger.info("save audio")
-        return await self.save_audio(ctx)
-
-    async def save_audio(self, ctx: InvocationContext) -> types.Content:
+    async def generate_music(self, ctx: InvocationContext, cache: MusicCache | None = None) -> types.Content | None:
+        music_plan = ComposerState.get_music_plan(ctx.session.state, self.task_id)
+        artifact_id = ComposerState.task_music_artifact_key(task_id=self.task_id)
+        # 受信した音声はメモリに溜めずにスプールへ追記する。同じプランの生成が途中で落ちていれば、受信済みの位置から続きを生成する
+        async with PcmArtifactStream(ctx, artifact_id, music_plan_hash(music_plan), LYRIA_FRAME_RATE, channels=2) as stream:
+            # スタンザの切り替えと終了は、経過時間ではなく受信した音声のフレーム数で決める
+            scheduler = StanzaScheduler(music_plan.stanzas, LYRIA_FRAME_RATE, received_frames=stream.frames)
+            if not scheduler.finished:
+                # セッションはプロセスで共有する管理から開く。同時に開く数が上限の場合は空くまで待つ
+                metrics = await lyria_sessions().render(music_plan.stanzas, scheduler, stream.write)
+                logger.info(f"music stream of {self.task_id}: {scheduler.frames} frames, first chunk {metrics.time_to_first_chunk}s, {metrics.reconnects} reconnects")
+
+            logger.info("save audio")
+            return await self.save_audio(ctx, stream, cache)
+
+    async def save_audio(self, ctx: InvocationContext, stream: PcmArtifactStream, cache: MusicCache | None = None) -> types.Content:
+        """スプールに受信した (frames, 2) のint16の音声を小節単位で切り出して保存する。cacheがあれば番組のキャッシュにも保存する"""
         music_plan = ComposerState.get_music_plan(ctx.session.state, self.task_id)
         bpm = sum([s.config.bpm for s in music_plan.stanzas]) / len(music_plan.stanzas)
-        audio_segment = AudioSegment.from_raw(io.BytesIO(self.audio_byte_array), sample_width=2, frame_rate=48000, channels=2)
-
-        one_bar_length = 1 * 4 / (bpm / 60) * 1000
-        music_length = len(audio_segment)
-        music_bar_length = math.floor(music_length / one_bar_length)
-
-        # cut
-        audio_segment = audio_segment[: music_bar_length * one_bar_length]
-        part = types.Part.from_bytes(data=export_wav(audio_segment), mime_type="audio/wav")
+        # Lyriaの出力(48kHz・ステレオの16bit PCM)をリサンプルせずにそのまま生PCMとして保存する
+        # 実際の小節の頭を推定し、最初の小節の頭から小節単位で切り出す
+        # スプールはmemmapなので、プロセスプールへ渡してコピーせずにスレッドで解析する
+        samples = stream.samples()
+        grid = await asyncio.to_thread(analyze_beats, samples, LYRIA_FRAME_RATE, bpm)
+        samples, grid = trim_to_bars(samples, grid)
+        logger.info(f"beat grid of {self.task_id}: {grid}")
+        stats = await asyncio.to_thread(analyze, samples, LYRIA_FRAME_RATE)
+        stats.beat_grid = grid
+        await stream.finalize(samples, loudness=stats)
 
         artifact_id = ComposerState.task_music_artifact_key(task_id=self.task_id)
-        await ctx.artifact_service.save_artifact(app_name=ctx.app_name, user_id=ctx.user_id, session_id=ctx.session.id, filename=artifact_id, artifact=part)
+        if cache is not None:
+            await cache.save_stream(music_plan, stream, self.seconds, role=self.role)
+            if self.description:
+                await cache.add_to_library(LibraryEntry.of(music_plan_hash(music_plan), music_plan, self.kind, self.description, len(samples) / LYRIA_FRAME_RATE, loudness=stats))
         return types.Content(parts=[types.Part(text=f"generate music for:{artifact_id}")])
 
 
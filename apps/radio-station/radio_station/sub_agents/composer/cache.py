@@ -0,0 +1,179 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""番組ごとの生成済み音楽のキャッシュ
+
+Lyria RealTimeは実時間で生成するので、同じ音楽を作り直すと毎回その長さ分の時間がかかる。
+生成した音楽を、正規化したMusicPlan(プロンプト・重み・設定・秒数)のハッシュをキーにして、番組ごとに保存しておき、
+同じプランの音楽はストリーミングせずに再利用する。
+また、オープニング・エンディングのように毎回同じ雰囲気を求められる役割は、最近の生成結果をプランを作らずに再利用できる。
+
+アーティファクトは"user:"で始まる名前で保存するので、同じリスナーのセッションをまたいで共有される。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.genai import types
+from pydantic import BaseModel
+
+from radio_station.model.music_plan import MusicPlan, MusicStanza
+from radio_station.state_keys import GlobalState
+from radio_station.sub_agents.composer.library import LibraryEntry, MusicLibrary
+from radio_station.utils.artifact import list_artifact, load_artifact, save_artifact
+from radio_station.utils.artifact_stream import PcmArtifactStream
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "user:composer_cache__"
+LIBRARY_PREFIX = "user:composer_library__"
+ROLE_ENTRY_MIME_TYPE = "application/json"
+LIBRARY_ENTRY_MIME_TYPE = "application/json"
+# 役割ごとの生成結果を再利用する期間
+DEFAULT_ROLE_MAX_AGE = timedelta(days=7)
+# 役割ごとの生成結果を再利用する長さの許容範囲(求める秒数との比)
+ROLE_SECONDS_TOLERANCE = 0.1
+# 重みを比べる精度(小数点以下の桁数)
+_WEIGHT_DIGITS = 4
+
+
+def _normalize_stanza(stanza: MusicStanza) -> dict:
+    """スタンザを比較用のdictにする
+
+    Lyriaはプロンプトの重みを合計で正規化し、プロンプトの順番にも依存しないので、
+    テキストは前後の空白と大文字小文字を無視して並べ替え、重みは合計が1になるように揃える。
+    """
+    weights = [1.0 if p.weight is None else p.weight for p in stanza.prompts]
+    total = sum(weights) or 1.0
+    prompts = sorted(((p.text or "").strip().lower(), round(w / total, _WEIGHT_DIGITS)) for p, w in zip(stanza.prompts, weights, strict=True))
+    return {
+        "prompts": prompts,
+        "config": stanza.config.model_dump(mode="json", exclude_none=True),
+        "seconds": stanza.seconds,
+    }
+
+
+def music_plan_hash(plan: MusicPlan) -> str:
+    """音楽の生成結果に影響する部分だけを正規化したMusicPlanのハッシュ。タイトルは含めない"""
+    canonical = json.dumps([_normalize_stanza(stanza) for stanza in plan.stanzas], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def plan_cache_key(program_id: str, plan_hash: str) -> str:
+    return f"{CACHE_PREFIX}{program_id}__{plan_hash}.pcm"
+
+
+def role_cache_key(program_id: str, role: str) -> str:
+    return f"{CACHE_PREFIX}{program_id}__role__{role}.json"
+
+
+def library_prefix(program_id: str) -> str:
+    return f"{LIBRARY_PREFIX}{program_id}__"
+
+
+def library_entry_key(program_id: str, plan_hash: str) -> str:
+    # エントリごとに別のアーティファクトにするので、並列に生成した音楽を登録しても互いに上書きしない
+    return f"{library_prefix(program_id)}{plan_hash}.json"
+
+
+class RoleEntry(BaseModel):
+    """役割ごとの最新の生成結果。音声は持たず、プランのキャッシュを指す"""
+
+    plan_hash: str
+    music_plan: MusicPlan
+    seconds: float
+    created_at: float
+
+
+class MusicCache:
+    """番組ごとの音楽のキャッシュ
+
+    プランのキャッシュ(plan_cache_key)には生成した音声(生PCM)を保存し、
+    役割のキャッシュ(role_cache_key)には最新のプランのハッシュとプランだけを保存する。
+    ライブラリ(library_entry_key)には、音声を説明文から探すためのメタデータを保存する。
+    """
+
+    def __init__(self, ctx: InvocationContext, program_id: str):
+        self.ctx = ctx
+        self.program_id = program_id
+
+    @classmethod
+    def of(cls, ctx: InvocationContext) -> "MusicCache | None":
+        """セッションの番組のキャッシュ。番組が無い場合やアーティファクトを保存できない場合はNone"""
+        program = GlobalState.get_listener_program(ctx.session.state)
+        if program is None or ctx.artifact_service is None:
+            return None
+        return cls(ctx, program.id)
+
+    async def load_plan(self, plan: MusicPlan) -> types.Part | None:
+        """同じプランの音声。無ければNone"""
+        part = await load_artifact(self.ctx, plan_cache_key(self.program_id, music_plan_hash(plan)))
+        if part is not None:
+            logger.info(f"music cache hit for plan: {plan.title}")
+        return part
+
+    async def load_role(self, role: str, seconds: float, max_age: timedelta = DEFAULT_ROLE_MAX_AGE) -> tuple[MusicPlan, types.Part] | None:
+        """max_age以内に同じ役割で生成した、secondsに近い長さの音声とそのプラン。無ければNone"""
+        entry_part = await load_artifact(self.ctx, role_cache_key(self.program_id, role))
+        if entry_part is None or entry_part.inline_data is None:
+            return None
+        entry = RoleEntry.model_validate_json(entry_part.inline_data.data)
+        if time.time() - entry.created_at > max_age.total_seconds():
+            logger.info(f"music cache for role {role} is expired")
+            return None
+        if abs(entry.seconds - seconds) > seconds * ROLE_SECONDS_TOLERANCE:
+            logger.info(f"music cache for role {role} has different length: {entry.seconds} != {seconds}")
+            return None
+        part = await load_artifact(self.ctx, plan_cache_key(self.program_id, entry.plan_hash))
+        if part is None:
+            return None
+        logger.info(f"music cache hit for role: {role}")
+        return entry.music_plan, part
+
+    async def save(self, plan: MusicPlan, part: types.Part, seconds: float, role: str | None = None) -> None:
+        """生成した音声をプランのキャッシュに保存する。roleがあれば役割の最新の生成結果にする"""
+        plan_hash = music_plan_hash(plan)
+        await save_artifact(self.ctx, plan_cache_key(self.program_id, plan_hash), part)
+        await self._save_role(plan, plan_hash, seconds, role)
+
+    async def save_stream(self, plan: MusicPlan, stream: PcmArtifactStream, seconds: float, role: str | None = None) -> None:
+        """finalizeしたストリームのアーティファクトをコピーしてプランのキャッシュに保存する。音声をメモリに読まない"""
+        plan_hash = music_plan_hash(plan)
+        await stream.copy(plan_cache_key(self.program_id, plan_hash))
+        await self._save_role(plan, plan_hash, seconds, role)
+
+    async def _save_role(self, plan: MusicPlan, plan_hash: str, seconds: float, role: str | None) -> None:
+        if role is not None:
+            entry = RoleEntry(plan_hash=plan_hash, music_plan=plan, seconds=seconds, created_at=time.time())
+            await save_artifact(self.ctx, role_cache_key(self.program_id, role), types.Part.from_bytes(data=entry.model_dump_json().encode(), mime_type=ROLE_ENTRY_MIME_TYPE))
+
+    async def load_audio(self, plan_hash: str) -> types.Part | None:
+        return await load_artifact(self.ctx, plan_cache_key(self.program_id, plan_hash))
+
+    async def add_to_library(self, entry: LibraryEntry) -> None:
+        """音声を保存済みのプランをライブラリに登録する"""
+        part = types.Part.from_bytes(data=entry.model_dump_json().encode(), mime_type=LIBRARY_ENTRY_MIME_TYPE)
+        await save_artifact(self.ctx, library_entry_key(self.program_id, entry.plan_hash), part)
+
+    async def load_library(self) -> MusicLibrary:
+        """番組のライブラリの全エントリを読み込んで索引を作る"""
+        prefix = library_prefix(self.program_id)
+        keys = [key for key in await list_artifact(self.ctx) if key.startswith(prefix)]
+        parts = await asyncio.gather(*[load_artifact(self.ctx, key) for key in keys])
+        return MusicLibrary([LibraryEntry.model_validate_json(part.inline_data.data) for part in parts if part is not None and part.inline_data is not None])
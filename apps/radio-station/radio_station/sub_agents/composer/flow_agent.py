@@ -20,8 +20,10 @@ from google.adk.agents.invocation_context import InvocationContext
 from google.adk.events import Event, EventActions
 from google.genai import types
 
+from radio_station.model.program_plan import SegmentType
 from radio_station.state_keys import ComposerState, ProgramPlannerState
 from radio_station.sub_agents.composer.agent import ComposerAgent
+from radio_station.sub_agents.composer.library import MusicKind
 from radio_station.utils.semaphore_parallel_agent import SemaphoreParallelAgent
 
 logger = logging.getLogger(__name__)
@@ -63,6 +65,8 @@ class ComposerFlowAgent(BaseAgent):
 
             task_id = str(i + 1)  # 簡易的に連番をtask_idとする
             task_ids.append(task_id)
+            # オープニング・エンディングは毎回同じ雰囲気を求められるので、最近の音楽を使い回す
+            role = segment.segment_type.value if segment.segment_type in (SegmentType.OPENING, SegmentType.ENDING) else None
 
             if segment.is_music:
                 music_plan = f"""
@@ -73,13 +77,22 @@ class ComposerFlowAgent(BaseAgent):
                 Title: {segment.title}
                 Description: {segment.description}
                 """
-                agents.append(ComposerAgent(task_id=task_id, music_plan=music_plan, seconds=segment.segment_seconds))
+                agents.append(
+                    ComposerAgent(
+                        task_id=task_id,
+                        music_plan=music_plan,
+                        seconds=segment.segment_seconds,
+                        role=role,
+                        description=f"{segment.title} {segment.description}",
+                        kind=MusicKind.JINGLE,
+                    )
+                )
             else:
                 music_plan = f"""
                 This music use for the background music on podcast talk show.
                 Music Description: {segment.background_music}
                 """
-                agents.append(ComposerAgent(task_id=task_id, music_plan=music_plan, seconds=segment.segment_seconds))
+                agents.append(ComposerAgent(task_id=task_id, music_plan=music_plan, seconds=segment.segment_seconds, role=role, description=segment.background_music))
 
                 # TODO currently(2025/06/18), lyria realtime does not have a pricing.
                 # agents.append(ShortComposerAgent(task_id=task_id, music_plan=music_plan, seconds=segment.segment_seconds))
@@ -0,0 +1,155 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""番組ごとのジングル・BGMのライブラリ
+
+生成した音楽を、説明文・プロンプト・BPM・スケール・長さ・ビートグリッド・ラウドネスと一緒に番組ごとに登録しておき、
+セグメントのBGMの説明文に近い音楽を選べるようにする。
+検索は外部のサービスを使わず、説明文とプロンプトのTF-IDFのコサイン類似度と、BPM・スケール・長さの条件だけで行う。
+音声そのものはMusicCacheのプランのキャッシュに保存し、ライブラリにはメタデータだけを持つ。
+"""
+
+import math
+import re
+import time
+from collections import Counter
+from enum import Enum
+
+from pydantic import BaseModel, Field
+
+from radio_station.model.music_plan import MusicPlan
+from radio_station.utils.loudness import LoudnessStats
+
+# この類似度未満の音楽は選ばない
+DEFAULT_MIN_SCORE = 0.5
+# BPMの差の許容範囲
+BPM_TOLERANCE = 8.0
+# ジングル(そのまま流す音楽)の長さの許容範囲(求める秒数との比)。BGMはミックス時にループするので長さを問わない
+JINGLE_SECONDS_TOLERANCE = 0.1
+
+_WORD = re.compile(r"\w+")
+
+
+class MusicKind(str, Enum):
+    # トークの後ろで流すBGM
+    BED = "bed"
+    # 単体で流す音楽
+    JINGLE = "jingle"
+
+
+def plan_bpm(plan: MusicPlan) -> float:
+    """スタンザのBPMの平均"""
+    return sum(s.config.bpm for s in plan.stanzas) / len(plan.stanzas)
+
+
+def plan_scale(plan: MusicPlan) -> str | None:
+    """全スタンザで共通のスケール。スタンザごとにスケールが変わる音楽は、スケールで絞り込まないのでNone"""
+    scales = {s.config.scale.value for s in plan.stanzas if s.config.scale is not None}
+    return scales.pop() if len(scales) == 1 else None
+
+
+class LibraryEntry(BaseModel):
+    """ライブラリに登録した音楽のメタデータ。音声はplan_hashのプランのキャッシュにある"""
+
+    plan_hash: str
+    music_plan: MusicPlan
+    kind: MusicKind
+    description: str
+    prompts: list[str] = Field(default_factory=list)
+    bpm: float
+    scale: str | None = None
+    seconds: float
+    loudness: LoudnessStats | None = None
+    created_at: float = Field(default_factory=time.time)
+
+    @classmethod
+    def of(cls, plan_hash: str, plan: MusicPlan, kind: MusicKind, description: str, seconds: float, loudness: LoudnessStats | None = None) -> "LibraryEntry":
+        return cls(
+            plan_hash=plan_hash,
+            music_plan=plan,
+            kind=kind,
+            description=description,
+            prompts=list(dict.fromkeys(p.text for s in plan.stanzas for p in s.prompts if p.text)),
+            bpm=plan_bpm(plan),
+            scale=plan_scale(plan),
+            seconds=seconds,
+            loudness=loudness,
+        )
+
+    @property
+    def text(self) -> str:
+        return " ".join([self.description, *self.prompts])
+
+
+def tokenize(text: str) -> list[str]:
+    """英数字は単語ごと、日本語など空白で区切らない文字列は2文字ずつのトークンにする"""
+    tokens = []
+    for word in _WORD.findall(text.lower()):
+        if word.isascii() or len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i : i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+class MusicLibrary:
+    """番組のライブラリの検索用の索引。登録済みの全エントリから作る"""
+
+    def __init__(self, entries: list[LibraryEntry]):
+        self.entries = entries
+        self._counts = [Counter(tokenize(entry.text)) for entry in entries]
+        self._df = Counter(token for counts in self._counts for token in counts)
+        self._vectors = [self._vector(counts) for counts in self._counts]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _idf(self, token: str) -> float:
+        # 平滑化したidf。どのエントリにも無いトークンも同じ式で重みを持つ
+        return math.log((1 + len(self.entries)) / (1 + self._df[token])) + 1
+
+    def _vector(self, counts: Counter) -> dict[str, float]:
+        vector = {token: count * self._idf(token) for token, count in counts.items()}
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        return {token: v / norm for token, v in vector.items()} if norm else {}
+
+    def _matches(self, entry: LibraryEntry, kind: MusicKind | None, seconds: float | None, bpm: float | None, scale: str | None) -> bool:
+        if kind is not None and entry.kind != kind:
+            return False
+        if bpm is not None and abs(entry.bpm - bpm) > BPM_TOLERANCE:
+            return False
+        if scale is not None and entry.scale is not None and entry.scale != scale:
+            return False
+        return seconds is None or entry.kind != MusicKind.JINGLE or abs(entry.seconds - seconds) <= seconds * JINGLE_SECONDS_TOLERANCE
+
+    def search(
+        self, description: str, kind: MusicKind | None = None, seconds: float | None = None, bpm: float | None = None, scale: str | None = None, limit: int = 5
+    ) -> list[tuple[float, LibraryEntry]]:
+        """説明文に近い順に (類似度, エントリ) を返す。kind・BPM・スケール・長さで絞り込む"""
+        query = self._vector(Counter(tokenize(description)))
+        results = []
+        for entry, vector in zip(self.entries, self._vectors, strict=True):
+            if not self._matches(entry, kind, seconds, bpm, scale):
+                continue
+            score = sum(weight * vector.get(token, 0.0) for token, weight in query.items())
+            if score > 0:
+                results.append((score, entry))
+        # 同じ類似度なら新しいものを優先する
+        results.sort(key=lambda result: (result[0], result[1].created_at), reverse=True)
+        return results[:limit]
+
+    def best(self, description: str, min_score: float = DEFAULT_MIN_SCORE, **kwargs) -> LibraryEntry | None:
+        """min_score以上で最も近いエントリ。無ければNone"""
+        results = self.search(description, limit=1, **kwargs)
+        return results[0][1] if results and results[0][0] >= min_score else None
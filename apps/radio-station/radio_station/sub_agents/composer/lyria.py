@@ -0,0 +1,248 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""プロセス全体で共有するLyria RealTimeのセッションの管理
+
+クライアントはプロセスで1つだけ作り、同時に開くセッションの数と、セッションを開く頻度(トークンバケット)を制限する。
+複数の番組が同時に作曲しても、クォータを超えないようにする。
+asyncio.runを繰り返す場合など、イベントループが変わっても同じ管理を使える。同時に開く数はイベントループごと、頻度はプロセス全体で制限する。
+生成の途中で接続が切れたり止まったりした場合は、接続し直して受信済みのフレーム数の位置(スタンザ)から続きを生成する。
+Lyriaには切れたセッションを再開する仕組みが無いので、つなぎ目は新しいセッションの音になる。
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+import websockets
+from google import genai
+from google.genai.live_music import AsyncMusicSession
+from pydantic import BaseModel
+
+from radio_station.model.music_plan import MusicStanza
+from radio_station.sub_agents.composer.scheduler import StanzaScheduler
+
+logger = logging.getLogger(__name__)
+
+API_KEY = os.environ.get("GEMINI_API_KEY")
+
+MODEL = "models/lyria-realtime-exp"
+# Lyriaが返すPCMのフレームレート
+LYRIA_FRAME_RATE = 48000
+
+DEFAULT_MAX_SESSIONS = 3
+DEFAULT_SESSIONS_PER_MINUTE = 6
+DEFAULT_MAX_RECONNECTS = 3
+
+_lock = threading.Lock()
+_manager: "LyriaSessionManager | None" = None
+
+
+class TokenBucket:
+    """rate個/秒で補充され、最大capacity個まで貯まるトークン。acquireはトークンが貯まるまで待つ
+
+    残りのトークンはスレッドのロックで守るので、イベントループに結び付かず、別のイベントループからも同じバケットを使える。
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self) -> float:
+        """トークンがあれば1つ取って0を、無ければ1つ貯まるまでの秒数を返す"""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while (wait := self._take()) > 0:
+            await asyncio.sleep(wait)
+
+
+class SessionMetrics(BaseModel):
+    """1曲の生成の計測値。時間はすべて秒"""
+
+    connects: int = 0
+    reconnects: int = 0
+    # セッションを開く順番を待った時間の合計
+    queued: float = 0.0
+    # 最初に接続し始めてから最初の音声が届くまでの時間
+    time_to_first_chunk: float | None = None
+    received_bytes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.received_bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def _default_client() -> genai.Client:
+    return genai.Client(vertexai=False, api_key=API_KEY, http_options={"api_version": "v1alpha"})
+
+
+class LyriaSessionManager:
+    """共有のクライアントでLyriaのセッションを開き、同時に開く数と開く頻度を制限する"""
+
+    def __init__(
+        self,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        sessions_per_minute: float = DEFAULT_SESSIONS_PER_MINUTE,
+        max_reconnects: int = DEFAULT_MAX_RECONNECTS,
+        client_factory: Callable[[], genai.Client] = _default_client,
+    ):
+        self.max_sessions = max_sessions
+        self.max_reconnects = max_reconnects
+        self._client_factory = client_factory
+        self._client: genai.Client | None = None
+        # asyncio.Semaphoreは最初に待ったイベントループに結び付くので、イベントループごとに作る
+        self._sessions: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+        # 同時に開ける数までは待たずに開ける
+        self._bucket = TokenBucket(sessions_per_minute / 60, capacity=max_sessions)
+
+    @property
+    def client(self) -> genai.Client:
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        """実行中のイベントループで同時に開く数を制限するセマフォ"""
+        loop = asyncio.get_running_loop()
+        if loop not in self._sessions:
+            self._sessions[loop] = asyncio.Semaphore(self.max_sessions)
+        return self._sessions[loop]
+
+    @asynccontextmanager
+    async def connect(self, metrics: SessionMetrics | None = None) -> AsyncIterator[AsyncMusicSession]:
+        """空きとトークンを待ってからセッションを開く"""
+        queued = time.monotonic()
+        async with self._semaphore():
+            await self._bucket.acquire()
+            if metrics is not None:
+                metrics.queued += time.monotonic() - queued
+                metrics.connects += 1
+            async with self.client.aio.live.music.connect(model=MODEL) as session:
+                yield session
+
+    async def render(self, stanzas: list[MusicStanza], scheduler: StanzaScheduler, write: Callable[[bytes], object]) -> SessionMetrics:
+        """スタンザを順に生成し、受信した音声をwriteに渡す。合計の長さに届かずに切れた場合は接続し直して続きを生成する"""
+        metrics = SessionMetrics()
+        started = time.monotonic()
+        while True:
+            try:
+                await self._stream(stanzas, scheduler, write, metrics, started)
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                # 接続できなかった場合も、接続し直す回数の範囲でやり直す
+                logger.warning(f"failed to connect music stream: {e}")
+            if scheduler.finished:
+                break
+            if metrics.reconnects >= self.max_reconnects:
+                logger.warning(f"give up music stream at {scheduler.frames}/{scheduler.target_frames} frames after {metrics.reconnects} reconnects")
+                break
+            metrics.reconnects += 1
+            logger.warning(f"reconnect music stream at {scheduler.frames}/{scheduler.target_frames} frames in stanza {scheduler.stanza_index()}")
+            scheduler.reopen()
+        metrics.elapsed = time.monotonic() - started
+        logger.info(f"music stream finished: {metrics.model_dump()} {metrics.bytes_per_second:.0f} bytes/s")
+        return metrics
+
+    async def _stream(self, stanzas: list[MusicStanza], scheduler: StanzaScheduler, write: Callable[[bytes], object], metrics: SessionMetrics, started: float) -> None:
+        """1つのセッションで、受信済みの位置のスタンザから生成する"""
+
+        async def receive_audio(session: AsyncMusicSession):
+            """受信した音声を合計の長さまで保存する。合計の長さに達したら受信をやめる"""
+            try:
+                async for message in session.receive():
+                    if message.server_content:
+                        if metrics.time_to_first_chunk is None:
+                            metrics.time_to_first_chunk = time.monotonic() - started
+                        data = await scheduler.feed(message.server_content.audio_chunks[0].data)
+                        write(data)
+                        metrics.received_bytes += len(data)
+                        if scheduler.finished:
+                            break
+                    elif message.filtered_prompt:
+                        logger.info(f"Prompt was filtered out: {message.filtered_prompt}")
+                    else:
+                        logger.info(f"Unknown error occured with message: {message}")
+            except websockets.exceptions.ConnectionClosedOK:
+                # nothing to do
+                pass
+            except Exception as e:
+                logger.exception(f"got error {e}")
+            finally:
+                await scheduler.close()
+
+        start = scheduler.stanza_index()
+        prev_config = None
+        async with asyncio.TaskGroup() as tg, self.connect(metrics) as session:
+            tg.create_task(receive_audio(session))
+            try:
+                for i in range(start, len(stanzas)):
+                    stanza = stanzas[i]
+                    logger.info(f"next stanza {stanza}")
+                    await session.set_weighted_prompts(prompts=stanza.to_gemini_prompts())
+                    if prev_config != stanza.config:
+                        logger.info(f"set music config {stanza.config}")
+                        await session.set_music_generation_config(config=stanza.to_gemini_config())
+                        await session.reset_context()
+                    prev_config = stanza.config
+                    if i == start:
+                        logger.info("start session")
+                        await session.play()
+                    if not await scheduler.wait_stanza(i):
+                        logger.warning(f"music stream ended at {scheduler.frames}/{scheduler.target_frames} frames in stanza {i}")
+                        break
+                logger.info(f"session stop: {scheduler.frames} frames")
+                await session.stop()
+            except TimeoutError:
+                logger.warning(f"music stream stalled at {scheduler.frames}/{scheduler.target_frames} frames in stanza {scheduler.stanza_index()}")
+            except websockets.exceptions.ConnectionClosed:
+                logger.warning(f"music stream closed at {scheduler.frames}/{scheduler.target_frames} frames in stanza {scheduler.stanza_index()}")
+
+
+def lyria_sessions() -> LyriaSessionManager:
+    """プロセスで共有するセッションの管理。環境変数 LYRIA_MAX_SESSIONS, LYRIA_SESSIONS_PER_MINUTE, LYRIA_MAX_RECONNECTS で制限を変えられる"""
+    global _manager
+    with _lock:
+        if _manager is None:
+            _manager = LyriaSessionManager(
+                max_sessions=int(os.environ.get("LYRIA_MAX_SESSIONS", DEFAULT_MAX_SESSIONS)),
+                sessions_per_minute=float(os.environ.get("LYRIA_SESSIONS_PER_MINUTE", DEFAULT_SESSIONS_PER_MINUTE)),
+                max_reconnects=int(os.environ.get("LYRIA_MAX_RECONNECTS", DEFAULT_MAX_RECONNECTS)),
+            )
+        return _manager
+
+
+def configure_lyria_sessions(manager: LyriaSessionManager | None) -> None:
+    """共有のセッションの管理を差し替える。Noneで次に使う時に環境変数の値から作り直す"""
+    global _manager
+    with _lock:
+        _manager = manager
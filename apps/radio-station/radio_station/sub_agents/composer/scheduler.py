@@ -0,0 +1,93 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""受信したサンプル数で進めるLyriaのスタンザのスケジューラ
+
+スタンザの切り替えを経過時間(sleep)ではなく、受信した音声のフレーム数で決める。
+ネットワークの揺らぎや受信の遅れに関係なく、各スタンザはちょうど指定の秒数分の音声を受け取り、
+合計の長さに達した時点で受信をやめる。
+"""
+
+import asyncio
+import logging
+from itertools import accumulate
+
+from radio_station.model.music_plan import MusicStanza
+
+logger = logging.getLogger(__name__)
+
+# この秒数のあいだ音声が届かない場合は生成が止まったとみなす
+STALL_TIMEOUT_SECONDS = 30.0
+
+
+class StanzaScheduler:
+    """受信した音声のフレーム数を数え、スタンザの境界と合計の長さに達したことを知らせる
+
+    受信側はfeedで受け取ったbyte列を渡し、返されたbyte列(合計の長さを超えた分は切り捨て済み)だけを保存する。
+    送信側はwait_stanzaでスタンザの終わりまで受信するのを待ってから、次のスタンザのプロンプトや設定を送る。
+    """
+
+    def __init__(self, stanzas: list[MusicStanza], frame_rate: int, channels: int = 2, sample_width: int = 2, received_frames: int = 0):
+        """received_framesは以前の生成で受信済みのフレーム数。その位置のスタンザから続きを受信する"""
+        self.frame_rate = frame_rate
+        self.frame_bytes = channels * sample_width
+        # 各スタンザの終わりのフレーム位置。秒数を足してから丸めるので、丸めの誤差は積み重ならない
+        self.boundaries = [int(round(seconds * frame_rate)) for seconds in accumulate(stanza.seconds for stanza in stanzas)]
+        self.received_bytes = min(received_frames, self.target_frames) * self.frame_bytes
+        self.closed = False
+        self._condition = asyncio.Condition()
+
+    @property
+    def target_frames(self) -> int:
+        return self.boundaries[-1] if self.boundaries else 0
+
+    @property
+    def frames(self) -> int:
+        return self.received_bytes // self.frame_bytes
+
+    @property
+    def finished(self) -> bool:
+        return self.frames >= self.target_frames
+
+    def stanza_index(self) -> int:
+        """受信中のスタンザの番号。すべて受信済みの場合はスタンザの数"""
+        return next((i for i, boundary in enumerate(self.boundaries) if self.frames < boundary), len(self.boundaries))
+
+    async def feed(self, data: bytes) -> bytes:
+        """受信したbyte列を数える。合計の長さまでの部分を返す"""
+        accepted = max(0, min(len(data), self.target_frames * self.frame_bytes - self.received_bytes))
+        async with self._condition:
+            self.received_bytes += accepted
+            self._condition.notify_all()
+        return data[:accepted]
+
+    async def close(self) -> None:
+        """受信が終わった(接続が切れた)ことを知らせ、待っている送信側を起こす"""
+        async with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def reopen(self) -> None:
+        """接続し直して受信を続ける時に、受信の終わりを取り消す"""
+        self.closed = False
+
+    async def wait_stanza(self, index: int, stall_timeout: float = STALL_TIMEOUT_SECONDS) -> bool:
+        """index番目のスタンザの終わりまで受信するのを待つ。受信が先に終わった場合はFalse
+
+        stall_timeout秒のあいだ音声が届かない場合はTimeoutErrorになる。
+        """
+        async with self._condition:
+            while self.frames < self.boundaries[index] and not self.closed:
+                await asyncio.wait_for(self._condition.wait(), stall_timeout)
+            return self.frames >= self.boundaries[index]
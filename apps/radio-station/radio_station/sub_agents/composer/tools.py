@@ -13,20 +13,23 @@
 # limitations under the License.
 
 import base64
-import io
 import logging
 import math
 
 import google.auth
+import numpy as np
 from google.adk.tools import ToolContext
 from google.cloud import aiplatform
 from google.genai import types
 from google.protobuf import json_format
 from google.protobuf.struct_pb2 import Value
-from pydub import AudioSegment
 
 from radio_station.state_keys import ComposerState
-from radio_station.utils.audio import export_wav
+from radio_station.utils.audio import read_wav
+from radio_station.utils.audio_executor import run_audio
+from radio_station.utils.beat_grid import analyze_beats, trim_to_bars
+from radio_station.utils.loudness import analyze
+from radio_station.utils.pcm import PCM_MIME_TYPE, encode_pcm
 
 loggger = logging.getLogger(__name__)
 
@@ -88,13 +91,17 @@ async def generate_music_tool(task_id: str, prompt: str, negative_prompt: str, s
         for pred in predictions:
             bytes_b64 = dict(pred)["bytesBase64Encoded"]
             decoded_audio_data = base64.b64decode(bytes_b64)
-            audio_segment = AudioSegment.from_wav(io.BytesIO(decoded_audio_data))
-
-            if len(audio_segment) < seconds * 1000:
-                audio_segment = audio_segment * math.ceil(seconds * 1000 / len(audio_segment))
-            audio_segment = audio_segment[: seconds * 1000]
-            wav = export_wav(audio_segment)
-            part = types.Part.from_bytes(data=wav, mime_type="audio/wav")
+            samples, frame_rate = read_wav(decoded_audio_data)
+            # 小節単位で切り出してから繰り返し、継ぎ目を小節の頭に合わせる
+            samples, grid = trim_to_bars(samples, await run_audio(analyze_beats, samples, frame_rate))
+
+            length = int(seconds * frame_rate)
+            if len(samples) < length:
+                samples = np.tile(samples, (math.ceil(length / len(samples)), 1))
+            samples = samples[:length]
+            stats = await run_audio(analyze, samples, frame_rate)
+            stats.beat_grid = grid.model_copy(update={"bars": None})
+            part = types.Part.from_bytes(data=encode_pcm(samples, frame_rate, loudness=stats), mime_type=PCM_MIME_TYPE)
             artifact_id = ComposerState.task_music_artifact_key(task_id)
             await tool_context.save_artifact(artifact_id, part)
             mp3_list.append(artifact_id)
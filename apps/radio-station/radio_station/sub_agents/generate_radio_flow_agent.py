@@ -23,7 +23,7 @@ from google.genai import types
 
 from radio_station.state_keys import GlobalState
 from radio_station.sub_agents.composer.flow_agent import ComposerFlowAgent
-from radio_station.sub_agents.mastering.agent import MasteringAgent
+from radio_station.sub_agents.mastering.agent import MasteringAgent, RenderBackend
 from radio_station.sub_agents.news_letter_writer.agent import NewsLetterWriterAgent
 from radio_station.sub_agents.program_planner import ProgramPlannerAgent
 from radio_station.sub_agents.recoder import RecordingFlowAgent
@@ -73,7 +73,7 @@ class GenerateRadioFlowAgent(BaseAgent):
                 writer_recording_composer_agent = ParallelAgent(name="WriterRecordingComposerFlowAgent", sub_agents=[writer_recording_agent, ComposerFlowAgent()])
                 flow_agent = SequentialAgent(
                     name="GenerateRadioFlowSequentialAgent",
-                    sub_agents=[ResearchFlowAgent(), ProgramPlannerAgent(), writer_recording_composer_agent, MasteringAgent()],
+                    sub_agents=[ResearchFlowAgent(), ProgramPlannerAgent(), writer_recording_composer_agent, MasteringAgent(render_backend=RenderBackend.STREAMING)],
                 )
             else:
                 flow_agent = SequentialAgent(
@@ -12,34 +12,88 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import io
+import asyncio
 import logging
 import math
-from typing import AsyncGenerator
+from enum import Enum
+from typing import Any, AsyncGenerator
 
+import numpy as np
 from google.adk.agents import BaseAgent
 from google.adk.agents.invocation_context import InvocationContext
-from google.adk.events import Event
+from google.adk.events import Event, EventActions
 from google.genai import types
-from pydub import AudioSegment
-from pydub.effects import compress_dynamic_range, normalize
-
-from radio_station.model.program_plan import SegmentType
-from radio_station.state_keys import ComposerState, ProgramPlannerState, RecorderState, WriterState
-from radio_station.utils.artifact import list_artifact, load_artifact, save_artifact
-from radio_station.utils.audio import convert_mp3
-from radio_station.utils.env import is_run_on_agent_engine
+from pydantic import Field
+
+from radio_station.model.program_plan import SegmentPlan, SegmentType
+from radio_station.state_keys import ComposerState, MasteringState, ProgramPlannerState, RecorderState, WriterState
+from radio_station.sub_agents.mastering.dsp import MasteringChain
+from radio_station.sub_agents.mastering.encoding import DEFAULT_RENDITIONS, HLS_PREFIX, EncodedRendition, PcmFileWriter, Rendition, encode_renditions, hls_mime_type
+from radio_station.sub_agents.mastering.ffmpeg_graph import render_pcm
+from radio_station.sub_agents.mastering.mixer import Clip, ProgramMixer, Timeline, ms_to_frames
+from radio_station.sub_agents.mastering.scratch import ScratchSpace, scratch_memory_budget
+from radio_station.sub_agents.mastering.stems import encode_stem, overlapping_clips, placeholder, stem_clip, stem_key, stem_ranges
+from radio_station.sub_agents.mastering.streaming import WINDOW_MS, stream_mastering
+from radio_station.sub_agents.mastering.waveform import WAVEFORM_ARTIFACT_KEY, WAVEFORM_MIME_TYPE, analyze_waveform
+from radio_station.utils.artifact import list_artifact, list_versions, load_artifact, save_artifact
+from radio_station.utils.audio import to_float32
+from radio_station.utils.audio_executor import run_audio
+from radio_station.utils.audio_format import master_frame_rate, resample, resampled_length
+from radio_station.utils.loudness import LoudnessMeter, LoudnessStats, analyze, hash_source, loudness_artifact_key, loudness_gain
+from radio_station.utils.pcm import PCM_MIME_TYPE, read_audio
 
 logger = logging.getLogger(__name__)
 
 
+class RenderBackend(str, Enum):
+    # 番組全体をメモリ上でミックス・マスタリングする
+    IN_MEMORY = "in_memory"
+    # 固定長の窓ごとに描画・マスタリングしてエンコーダへ流す
+    STREAMING = "streaming"
+    # タイムラインをffmpegのfilter_complexにして、ミックスからマスタリングまで1プロセスで行う
+    FFMPEG = "ffmpeg"
+
+
 # Agent to mastering the audio track by mixing recorded speech and background music.
 class MasteringAgent(BaseAgent):
-    def __init__(self, name="MasteringAgent", **kwargs):
-        super().__init__(name=name, **kwargs)
+    render_backend: RenderBackend = Field(description="How the mixed timeline is mastered and encoded", default=RenderBackend.IN_MEMORY)
+    concurrency: int = Field(description="Number of artifacts loaded at the same time", default=8)
+    stem_cache: bool = Field(
+        description="Persist per-segment mixed stems as session artifacts and reuse them when their inputs are unchanged. Stems are never deleted. Ignored by the FFMPEG backend",
+        default=False,
+    )
+    frame_rate: int = Field(description="Master frame rate. Every source is resampled to this rate once, right before mixing", default_factory=master_frame_rate)
+    memory_budget: int | None = Field(
+        description="Bytes of decoded sources, stems and render buffers kept in process memory. Buffers beyond the budget are backed by memory-mapped temp files. None keeps everything in memory",
+        default_factory=scratch_memory_budget,
+    )
+    renditions: list[Rendition] = Field(
+        description="Delivery renditions encoded in parallel from the mastered program. The first one is the program audio", default_factory=lambda: list(DEFAULT_RENDITIONS)
+    )
+    hls_segment_seconds: float | None = Field(description="Cut the program into fMP4 HLS segments of this length with a playlist. None disables HLS", default=None)
+
+    def __init__(
+        self,
+        name="MasteringAgent",
+        render_backend: RenderBackend = RenderBackend.IN_MEMORY,
+        concurrency: int = 8,
+        stem_cache: bool = False,
+        frame_rate: int | None = None,
+        memory_budget: int | None = None,
+        **kwargs,
+    ):
+        super().__init__(
+            name=name,
+            render_backend=render_backend,
+            concurrency=concurrency,
+            stem_cache=stem_cache,
+            frame_rate=frame_rate or master_frame_rate(),
+            memory_budget=memory_budget if memory_budget is not None else scratch_memory_budget(),
+            **kwargs,
+        )
 
     async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
-        if "audio.mp3" in await list_artifact(ctx):
+        if self.renditions[0].artifact_key in await list_artifact(ctx):
             yield Event(
                 invocation_id=ctx.invocation_id,
                 author=self.name,
@@ -67,7 +121,18 @@ class MasteringAgent(BaseAgent):
                 ],
             ),
         )
-        mixed = await self.mixing(ctx)
+        # 番組の長さに比例する配列は作業領域に置き、終わったら一時ファイルごと削除する
+        with ScratchSpace(self.memory_budget) as scratch:
+            if self.render_backend != RenderBackend.IN_MEMORY:
+                async for event in self._run_timeline(ctx, task_ids, scratch):
+                    yield event
+                return
+
+            async for event in self._run_in_memory(ctx, task_ids, scratch):
+                yield event
+
+    async def _run_in_memory(self, ctx: InvocationContext, task_ids, scratch: ScratchSpace) -> AsyncGenerator[Event, None]:
+        mixed = await self.mixing(ctx, scratch)
 
         yield Event(
             invocation_id=ctx.invocation_id,
@@ -79,7 +144,7 @@ class MasteringAgent(BaseAgent):
             ),
         )
 
-        track = await self.mastering(mixed)
+        track = await self.mastering(mixed, scratch)
 
         yield Event(
             invocation_id=ctx.invocation_id,
@@ -91,7 +156,9 @@ class MasteringAgent(BaseAgent):
             ),
         )
 
-        await save_artifact(ctx, "audio.mp3", types.Part.from_bytes(data=convert_mp3(track), mime_type="audio/mp3"))
+        pcm_path = scratch.path("master.pcm")
+        await asyncio.to_thread(self._write_pcm, pcm_path, track, self.frame_rate)
+        state_delta = await self.encode(ctx, pcm_path, self.frame_rate, track.shape[1])
 
         yield Event(
             invocation_id=ctx.invocation_id,
@@ -101,9 +168,113 @@ class MasteringAgent(BaseAgent):
                     types.Part(text=f"Generated merged audio for: {task_ids}"),
                 ],
             ),
+            actions=EventActions(state_delta=state_delta),
+        )
+
+    async def _run_timeline(self, ctx: InvocationContext, task_ids, scratch: ScratchSpace) -> AsyncGenerator[Event, None]:
+        # ffmpegのバックエンドは音源のミックスからマスタリングまでを1プロセスで行うので、Pythonで描画したステムは使わない
+        timeline = await self.build_timeline(ctx, scratch, stems=self.render_backend != RenderBackend.FFMPEG)
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            content=types.ModelContent(
+                parts=[
+                    types.Part(text=f"Finished mixing for: {task_ids}, next start mastering"),
+                ],
+            ),
         )
 
-    async def mixing(self, ctx):
+        pcm_path = scratch.path("master.pcm")
+        if self.render_backend == RenderBackend.FFMPEG:
+            await asyncio.to_thread(render_pcm, timeline, pcm_path)
+        else:
+            # タイムラインを窓ごとに描画・マスタリングし、そのままファイルへ書き出す
+            await asyncio.to_thread(self._stream_pcm, timeline, pcm_path)
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            content=types.ModelContent(
+                parts=[
+                    types.Part(text=f"Finished mastering for: {task_ids}, next start convert to mp3"),
+                ],
+            ),
+        )
+
+        state_delta = await self.encode(ctx, pcm_path, timeline.frame_rate, timeline.channels)
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            content=types.ModelContent(
+                parts=[
+                    types.Part(text=f"Generated merged audio for: {task_ids}"),
+                ],
+            ),
+            actions=EventActions(state_delta=state_delta),
+        )
+
+    @staticmethod
+    def _write_pcm(path: str, track: np.ndarray, frame_rate: int) -> None:
+        # 16bitへの変換で番組全体の一時配列を作らないよう、窓ごとに書き出す
+        window = ms_to_frames(WINDOW_MS, frame_rate)
+        with PcmFileWriter(path) as writer:
+            for start in range(0, len(track), window):
+                writer.write(track[start : start + window])
+
+    @staticmethod
+    def _stream_pcm(timeline: Timeline, path: str) -> None:
+        with PcmFileWriter(path) as writer:
+            stream_mastering(timeline, writer)
+
+    async def encode(self, ctx: InvocationContext, pcm_path: str, frame_rate: int, channels: int) -> dict[str, Any]:
+        """マスタリング済みの16bitの生PCMをレンディションごとに並列にエンコードして保存し、stateに記録する内容を返す
+
+        エンコードと並行して同じファイルから波形と長さ・ラウドネスを求め、音声の隣に保存する。
+        """
+        (encoded, hls), waveform = await asyncio.gather(
+            encode_renditions(pcm_path, frame_rate, channels, self.renditions, self.hls_segment_seconds),
+            run_audio(analyze_waveform, pcm_path, frame_rate, channels),
+        )
+        parts = {rendition.artifact_key: types.Part.from_bytes(data=data, mime_type=rendition.mime_type) for rendition, data in zip(self.renditions, encoded, strict=True)}
+        parts |= {name: types.Part.from_bytes(data=data, mime_type=hls_mime_type(name)) for name, data in hls.items()}
+        parts[WAVEFORM_ARTIFACT_KEY] = types.Part.from_bytes(data=waveform.model_dump_json().encode(), mime_type=WAVEFORM_MIME_TYPE)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def save(key: str, part: types.Part) -> None:
+            async with semaphore:
+                await save_artifact(ctx, key, part)
+
+        await asyncio.gather(*[save(key, part) for key, part in parts.items()])
+        renditions = [EncodedRendition(**rendition.model_dump(), size=len(data)) for rendition, data in zip(self.renditions, encoded, strict=True)]
+        logger.info(f"saved renditions: {[(rendition.name, rendition.size) for rendition in renditions]}, hls files: {len(hls)}")
+        return {
+            MasteringState.RENDITIONS: [rendition.model_dump(mode="json") for rendition in renditions],
+            MasteringState.HLS_PLAYLIST: f"{HLS_PREFIX}.m3u8" if hls else None,
+            MasteringState.WAVEFORM: waveform.summary(),
+        }
+
+    async def mixing(self, ctx, scratch: ScratchSpace | None = None) -> np.ndarray:
+        """番組全体をミックスした (frames, channels) のfloat32配列。フレームレートはself.frame_rateで、配列はscratchに置かれる"""
+        scratch = scratch or ScratchSpace()
+        timeline = await self.build_timeline(ctx, scratch)
+        # 描画は作業領域(memmap)の配列を直接読み書きするので、プロセスプールではなくスレッドで行う
+        return await asyncio.to_thread(self._render_mix, timeline, scratch)
+
+    @staticmethod
+    def _render_mix(timeline: Timeline, scratch: ScratchSpace) -> np.ndarray:
+        # マージ。番組全体のバッファは作業領域に確保し、窓ごとに描画して一時配列を窓の大きさに抑える
+        logger.info(f"merge audio: timeline: len({timeline.length})")
+        mixed = scratch.empty((timeline.length, timeline.channels), np.float32)
+        window = ms_to_frames(WINDOW_MS, timeline.frame_rate)
+        for start in range(0, timeline.length, window):
+            timeline.render(start, out=mixed[start : start + window])
+        return mixed
+
+    def _program_sources(self, ctx) -> list[tuple[SegmentPlan, str, str | None]]:
+        """番組の順に (セグメント, トークの音源のキー, 背景音楽の音源のキー) を並べる"""
         composer_task_ids = ctx.session.state.get(ComposerState.TASK_IDS, [])
         task_ids = ctx.session.state.get(RecorderState.TEMP_TASK_IDS)
         talk_script_segments = WriterState.get_talk_script_segments(ctx.session.state)
@@ -111,98 +282,232 @@ class MasteringAgent(BaseAgent):
         program_plan = ProgramPlannerState.get_program_structure(ctx.session.state)
         logger.info(f"mixing composer: {composer_task_ids} recorder: {task_ids}")
 
-        recoding_audios = []
-        background_musics = []
-
-        if is_run_on_agent_engine():
-            AudioSegment.converter = "radio_station/ffmpeg-7.0.2-amd64-static/ffmpeg"
-
+        program = []
         for i, segment in enumerate(program_plan.segments):
             task_id = str(i + 1)
-            tss_list = [tss for tss in talk_script_segments if tss.task_id == task_id]
-            for tss in tss_list:
-                recoding_artifact = await load_artifact(ctx, RecorderState.task_artifact_key(tss.id))
-                logger.info(f"recoding_artifact: {RecorderState.task_artifact_key(tss.id)}({tss.id}) is None?: {recoding_artifact is None}")
-                recoding_audio = AudioSegment.from_wav(io.BytesIO(recoding_artifact.inline_data.data))
-                if task_id not in composer_task_ids:
-                    logger.info(f"this segment does not have background music: {task_id}. {composer_task_ids}")
-                    recoding_audios.append(recoding_audio)
-                    background_musics.append(AudioSegment.silent(duration=len(recoding_audio) + 5000))
-                    continue
-
-                artifact_key = ComposerState.task_music_artifact_key(task_id)
-                artifact = await load_artifact(ctx, artifact_key)
-                music = AudioSegment.from_wav(io.BytesIO(artifact.inline_data.data))
+            music_key = ComposerState.task_music_artifact_key(task_id) if task_id in composer_task_ids else None
+            if music_key is None:
+                logger.info(f"this segment does not have background music: {task_id}. {composer_task_ids}")
+            for tss in [tss for tss in talk_script_segments if tss.task_id == task_id]:
+                program.append((segment, RecorderState.task_artifact_key(tss.id), music_key))
+        return program
+
+    def _layout(self, program: list[tuple[SegmentPlan, str, str | None]], sources: dict[str, tuple[np.ndarray, int, LoudnessStats]]) -> tuple[ProgramMixer, list[Clip], dict[int, str]]:
+        """音源をミキサーに配置する。トークのクリップの一覧と、クリップのidから音源のキーへの対応も返す"""
+        mixer = ProgramMixer(frame_rate=self.frame_rate)
+        decoded = {
+            # 読み込んだ音源はprefetchでマスターのフレームレートに変換済み。仮の音源は補間せずに長さだけ合わせる
+            key: (
+                placeholder(resampled_length(len(samples), frame_rate, mixer.frame_rate), samples.shape[1]) if samples.strides[0] == 0 else resample(samples, frame_rate, mixer.frame_rate),
+                stats,
+            )
+            for key, (samples, frame_rate, stats) in sources.items()
+        }
+        voice_clips: list[Clip] = []
+        clip_keys: dict[int, str] = {}
+
+        for segment, voice_key, music_key in program:
+            recoding_audio, voice_stats = decoded[voice_key]
+            placed = len(mixer.timeline.clips)
+            if music_key is None:
+                mixer.add_voice_only(recoding_audio)
+            else:
+                music, music_stats = decoded[music_key]
+                levels = {"voice_level": voice_stats.rms, "music_level": music_stats.rms}
 
                 if segment.is_music:
-                    origin_length = len(recoding_audio)
-                    recoding_audio = recoding_audio + AudioSegment.silent(duration=100 + len(music))
-                    recoding_audios.append(recoding_audio)
-                    music = AudioSegment.silent(duration=origin_length + 100) + music
-                    background_musics.append(music)
-                    continue
-
-                backend_music = music
-                backend_music_gain = -10
-
-                if segment.segment_type == SegmentType.OPENING:
-                    # opening
-                    opening_music_length = math.floor(4 * 4 / (segment.music_bpm / 60) * 1000) if segment.music_bpm is not None else 10000
-                    recoding_audio = AudioSegment.silent(duration=opening_music_length) + recoding_audio
-                    backend_music = backend_music * (int(math.ceil((len(recoding_audio) / len(backend_music)))) + 1)
-                    backend_music = backend_music[: len(recoding_audio) + 2500].fade(
-                        to_gain=recoding_audio.dBFS + backend_music_gain - backend_music.dBFS, start=opening_music_length - 1000, end=opening_music_length
-                    )
-                    background_musics.append(backend_music)
-                    recoding_audios.append(recoding_audio)
-
+                    mixer.add_music(recoding_audio, music)
+                elif segment.segment_type == SegmentType.OPENING:
+                    mixer.add_opening(recoding_audio, music, intro=self._four_bars(segment, music_stats, mixer.frame_rate), **levels)
                 elif segment.segment_type == SegmentType.ENDING:
-                    # closing
-                    origin_db = backend_music.dBFS
-                    backend_music = backend_music.apply_gain(recoding_audio.dBFS + backend_music_gain - origin_db)
-                    origin_length = len(recoding_audio)
-                    ending_music_length = math.floor(4 * 4 / (segment.music_bpm / 60) * 1000) if segment.music_bpm is not None else 10000
-                    recoding_audio = recoding_audio + AudioSegment.silent(duration=ending_music_length)
-                    backend_music = backend_music * (int(math.ceil((len(recoding_audio) / len(backend_music)))) + 1)
-                    background_musics.append(
-                        backend_music[: len(recoding_audio)].fade(to_gain=origin_db - backend_music.dBFS, start=origin_length, end=origin_length + 10).fade_out(ending_music_length)
-                    )
-                    recoding_audios.append(recoding_audio)
-
+                    mixer.add_ending(recoding_audio, music, outro=self._four_bars(segment, music_stats, mixer.frame_rate), **levels)
+                else:
+                    mixer.add_content(recoding_audio, music, **levels)
+
+            # セグメントごとにトーク、背景音楽の順でクリップが追加される
+            voice_clip, music_clip = mixer.timeline.clips[placed:]
+            voice_clips.append(voice_clip)
+            clip_keys[id(voice_clip)] = voice_key
+            if music_key is not None:
+                clip_keys[id(music_clip)] = music_key
+
+        return mixer, voice_clips, clip_keys
+
+    async def build_timeline(self, ctx, scratch: ScratchSpace | None = None, stems: bool = True) -> Timeline:
+        """番組のタイムラインを作る
+
+        stem_cacheが有効でstemsがTrueの場合は、トークの切れ目で区切った区間ごとにミックス済みのステムを保存し、
+        入力が変わっていない区間は保存済みのステムを使う。全区間のステムがあれば音源は読み込まない。
+        リサンプルした音源とステムはscratchに置くので、予算を超える分はmemmapのファイルから読まれる。
+        """
+        scratch = scratch or ScratchSpace()
+        program = self._program_sources(ctx)
+        if not program:
+            raise ValueError("recorded audio not found.")
+        # 同じタスクの背景音楽は1回だけ読み込む
+        keys = list(dict.fromkeys(key for _, voice_key, music_key in program for key in (voice_key, music_key) if key is not None))
+
+        if not self.stem_cache or not stems:
+            mixer, _, _ = self._layout(program, await self.prefetch(ctx, keys, scratch=scratch))
+            return mixer.timeline
+
+        known = {key: stats for key, stats in (await self._known_stats(ctx, keys)).items() if stats is not None}
+        # 統計の無い音源(初回や録り直した音源)は配置を決めるために先に読み込む
+        sources = await self.prefetch(ctx, [key for key in keys if key not in known], scratch=scratch)
+        layout = {key: (placeholder(stats.frames, stats.channels), stats.frame_rate, stats) for key, stats in known.items()} | sources
+        mixer, voice_clips, clip_keys = self._layout(program, layout)
+
+        timeline = mixer.timeline
+        ranges = stem_ranges(timeline, voice_clips)
+        hashes = {clip_id: layout[key][2].source_hash for clip_id, key in clip_keys.items()}
+        stem_keys = [MasteringState.stem_artifact_key(stem_key(timeline, start, stop, hashes)) for start, stop in ranges]
+        stems = [scratch.store_bytes(stem) if stem is not None else None for stem in await self._load_all(ctx, stem_keys)]
+
+        missing = [i for i, stem in enumerate(stems) if stem is None]
+        needed = list(dict.fromkeys(clip_keys[id(clip)] for i in missing for clip in overlapping_clips(timeline, *ranges[i])))
+        if any(key not in sources for key in needed):
+            # 描き直す区間に重なる音源だけを読み込み、実際の音源で配置し直す
+            sources |= await self.prefetch(ctx, [key for key in needed if key not in sources], known, scratch)
+            mixer, voice_clips, clip_keys = self._layout(program, layout | sources)
+            timeline = mixer.timeline
+
+        for i in missing:
+            start, stop = ranges[i]
+            stem = encode_stem(timeline.render(start, stop - start), timeline.frame_rate)
+            await save_artifact(ctx, stem_keys[i], types.Part.from_bytes(data=stem, mime_type=PCM_MIME_TYPE))
+            stems[i] = scratch.store_bytes(stem)
+        logger.info(f"stems: reused {len(ranges) - len(missing)}, rendered {len(missing)}")
+
+        stem_timeline = Timeline(timeline.frame_rate, timeline.channels)
+        for (start, _), stem in zip(ranges, stems, strict=True):
+            stem_timeline.add(stem_clip(stem, start))
+        return stem_timeline
+
+    async def _load_all(self, ctx: InvocationContext, keys: list[str]) -> list[bytes | None]:
+        """アーティファクトをconcurrency件ずつ並列に読み込む。無いものはNone"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def load(key: str) -> bytes | None:
+            async with semaphore:
+                artifact = await load_artifact(ctx, key)
+            return artifact.inline_data.data if artifact is not None and artifact.inline_data is not None else None
+
+        return list(await asyncio.gather(*[load(key) for key in keys]))
+
+    async def _known_stats(self, ctx: InvocationContext, keys: list[str]) -> dict[str, LoudnessStats | None]:
+        """音源をダウンロードせずに使える統計を集める。統計が音源の最新バージョンのものでなければNone"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def known(key: str) -> LoudnessStats | None:
+            async with semaphore:
+                cached, versions = await asyncio.gather(load_artifact(ctx, loudness_artifact_key(key)), list_versions(ctx, key))
+            if cached is None or cached.inline_data is None or not versions:
+                return None
+            stats = LoudnessStats.model_validate_json(cached.inline_data.data)
+            return stats if stats.source_version == max(versions) and stats.frames is not None else None
+
+        return dict(zip(keys, await asyncio.gather(*[known(key) for key in keys]), strict=True))
+
+    async def prefetch(
+        self, ctx: InvocationContext, keys: list[str], known: dict[str, LoudnessStats] | None = None, scratch: ScratchSpace | None = None
+    ) -> dict[str, tuple[np.ndarray, int, LoudnessStats]]:
+        """音源をconcurrency件ずつ並列に読み込み、読み込めたものから順にスレッドプールでデコードしてマスターのフレームレートにする
+
+        デコード中も次の音源の読み込みを進めるため、セマフォは読み込みの間だけ保持する。
+        knownにある音源は保存済みの統計を使い、無いものは統計を取得・計算する。
+        変換した音源はscratchに置く(予算を超える分はmemmapにコピーし、アーティファクトのbyte列は解放できるようにする)。
+        """
+        known = known or {}
+        scratch = scratch or ScratchSpace()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(key: str) -> tuple[np.ndarray, int, LoudnessStats]:
+            async with semaphore:
+                if key in known:
+                    artifact, cached, versions = await load_artifact(ctx, key), None, []
                 else:
-                    backend_music = backend_music.apply_gain(recoding_audio.dBFS + backend_music_gain - backend_music.dBFS)
-                    backend_music = backend_music * (int(math.ceil((len(recoding_audio) / len(backend_music)))) + 1)
-                    background_musics.append(backend_music[: len(recoding_audio) + 5000])
-                    recoding_audios.append(recoding_audio)
-
-        master_recoding_audio = None
-        for recoding_audio in recoding_audios:
-            if master_recoding_audio is None:
-                master_recoding_audio = recoding_audio
+                    artifact, cached, versions = await asyncio.gather(load_artifact(ctx, key), load_artifact(ctx, loudness_artifact_key(key)), list_versions(ctx, key))
+            if artifact is None or artifact.inline_data is None:
+                raise ValueError(f"audio artifact not found: {key}")
+            # 音源はリサンプルが必要な場合を除いて整数PCMのまま保持する。生PCMの場合はコピーもしない
+            samples, frame_rate, embedded = await asyncio.to_thread(read_audio, artifact.inline_data.data)
+            if key in known:
+                stats = known[key]
             else:
-                master_recoding_audio += recoding_audio
-
-        master_background_music = None
-        for background_music in background_musics:
-            master_background_music = background_music if master_background_music is None else master_background_music.append(background_music, crossfade=2500)
-
-        # マージ
-        logger.info(f"merge audio: master_recoding_audio: len({len(master_recoding_audio)}), master_background_music: len({len(master_background_music)})")
-
-        mixed = AudioSegment.silent(duration=len(master_background_music))
-        return mixed.overlay(master_recoding_audio).overlay(master_background_music)
-
-    async def mastering(self, mixed):
+                version = max(versions) if versions else None
+                stats = await self._loudness_stats(ctx, key, artifact.inline_data.data, cached, version, samples, frame_rate, embedded)
+            # リサンプルはミックスの直前のこの1回だけ
+            resampled = samples if frame_rate == self.frame_rate else await run_audio(resample, samples, frame_rate, self.frame_rate)
+            return await asyncio.to_thread(scratch.store, resampled), self.frame_rate, stats
+
+        results = await asyncio.gather(*[fetch(key) for key in keys])
+        return dict(zip(keys, results, strict=True))
+
+    @staticmethod
+    async def _loudness_stats(
+        ctx: InvocationContext, key: str, data: bytes, cached: types.Part | None, version: int | None, samples: np.ndarray, frame_rate: int, embedded: LoudnessStats | None = None
+    ) -> LoudnessStats:
+        """音源のラウドネス統計を取得する
+
+        保存済みの統計(cached)が同じ音源・バージョンのものであれば再計算しない。生PCMのヘッダに統計(embedded)があればそれを使う。
+        """
+        digest = await asyncio.to_thread(hash_source, data)
+        if cached is not None and cached.inline_data is not None:
+            stats = LoudnessStats.model_validate_json(cached.inline_data.data)
+            if stats.source_hash == digest and stats.source_version == version and stats.frames is not None:
+                return stats
+
+        if embedded is not None and embedded.frames is not None:
+            stats = embedded.model_copy(update={"source_hash": digest})
+        else:
+            stats = await run_audio(analyze, samples, frame_rate, digest)
+        stats.source_version = version
+        logger.info(f"loudness of {key}: {stats}")
+        await save_artifact(ctx, loudness_artifact_key(key), types.Part.from_bytes(data=stats.model_dump_json().encode(), mime_type="application/json"))
+        return stats
+
+    @staticmethod
+    def _four_bars_ms(segment: SegmentPlan) -> int:
+        # 4/4拍子で4小節分の長さ。bpmが無い場合は10秒
+        return math.floor(4 * 4 / (segment.music_bpm / 60) * 1000) if segment.music_bpm is not None else 10000
+
+    @classmethod
+    def _four_bars(cls, segment: SegmentPlan, music_stats: LoudnessStats, frame_rate: int) -> int:
+        """4小節分のフレーム数。音楽のビートグリッドがあれば、計画のbpmではなく実際の小節の長さを使う"""
+        if music_stats.beat_grid is not None:
+            return music_stats.beat_grid.bars_to_frames(4, frame_rate)
+        return ms_to_frames(cls._four_bars_ms(segment), frame_rate)
+
+    async def mastering(self, mixed: np.ndarray, scratch: ScratchSpace | None = None) -> np.ndarray:
+        """self.frame_rateの (frames, channels) の配列をマスタリングしたfloat32配列。配列はscratchに置かれる"""
         # mastering
         logger.info("start mastering")
-        ## Compression
-        logger.info("compression")
-        track = compress_dynamic_range(mixed, threshold=-20, ratio=2.5, attack=5, release=50)
-        ## Limiting, it too slow
-        # logger.info("Limiting")
-        # track = compress_dynamic_range(track, threshold=-1, ratio=20, attack=5, release=50)
-        ## normalize
-        logger.info("normalize")
-        track = normalize(track)
+        return await asyncio.to_thread(self._master, mixed, self.frame_rate, scratch or ScratchSpace())
+
+    @staticmethod
+    def _master(mixed: np.ndarray, frame_rate: int, scratch: ScratchSpace) -> np.ndarray:
+        window = ms_to_frames(WINDOW_MS, frame_rate)
+        ## Compression & Limiting
+        # 窓ごとにfloatへ変換してチェインに通し、作業領域の番組全体のバッファに書き込みながらラウドネスも測る
+        logger.info("compression & limiting")
+        chain = MasteringChain(frame_rate)
+        meter = LoudnessMeter(frame_rate)
+        track = scratch.empty(mixed.shape, np.float32)
+        position = 0
+
+        def write(block: np.ndarray) -> None:
+            nonlocal position
+            track[position : position + len(block)] = block
+            meter.process(block)
+            position += len(block)
+
+        for start in range(0, len(mixed), window):
+            write(chain.process(to_float32(mixed[start : start + window])))
+        write(chain.flush())
+        ## loudness normalization
+        logger.info("loudness normalization")
+        gain = np.float32(loudness_gain(meter.stats()))
+        for start in range(0, len(track), window):
+            track[start : start + window] *= gain
         logger.info("finish mastering")
         return track
@@ -0,0 +1,145 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from scipy.ndimage import maximum_filter1d
+from scipy.signal import lfilter
+
+# log(0)を避けるための最小レベル
+_MIN_DB = -150.0
+
+
+def _to_db(samples: np.ndarray) -> np.ndarray:
+    """(frames, channels) の各フレームの全チャンネル中の最大振幅をdBにする"""
+    peak = np.max(np.abs(samples), axis=1).astype(np.float64)
+    return 20 * np.log10(np.maximum(peak, 10 ** (_MIN_DB / 20)))
+
+
+def _decay_per_frame(ms: float, frame_rate: int) -> float:
+    """時定数msの指数減衰を1フレームあたりのdBにする"""
+    return 20 * np.log10(np.e) / max(ms * frame_rate / 1000, 1.0)
+
+
+def _peak_hold(level_db: np.ndarray, decay_db: float, initial_db: float) -> np.ndarray:
+    """y[n] = max(x[n], y[n-1] - decay) をcummaxで一括計算する
+
+    x[k] + decay * k の累積最大から decay * n を引くと、過去のピークからの減衰との最大になる。
+    """
+    n = np.arange(len(level_db), dtype=np.float64)
+    held = np.maximum.accumulate(level_db + decay_db * n) - decay_db * n
+    return np.maximum(held, initial_db - decay_db * (n + 1))
+
+
+class Compressor:
+    """フィードフォワード型のコンプレッサー
+
+    ピークレベルをリリース時定数で減衰させながら保持し、その超過分をレシオで圧縮したゲインを
+    アタック時定数の1次IIRフィルタで平滑化する。processはブロック単位で呼び出せ、状態は次のブロックへ引き継がれる。
+    """
+
+    def __init__(self, frame_rate: int, threshold: float = -20.0, ratio: float = 4.0, attack: float = 5.0, release: float = 50.0, makeup_gain: float = 0.0):
+        self.threshold = threshold
+        self.ratio = ratio
+        self.makeup_gain = makeup_gain
+        self._release_db = _decay_per_frame(release, frame_rate)
+        self._attack_coef = float(np.exp(-1.0 / max(attack * frame_rate / 1000, 1.0)))
+        self._level_db = _MIN_DB
+        self._zi = np.zeros(1)
+
+    def gain_db(self, samples: np.ndarray) -> np.ndarray:
+        level_db = _peak_hold(_to_db(samples), self._release_db, self._level_db)
+        if len(level_db):
+            self._level_db = float(level_db[-1])
+
+        reduction = np.minimum(0.0, (self.threshold - level_db) * (1 - 1 / self.ratio))
+        a = self._attack_coef
+        smoothed, self._zi = lfilter([1 - a], [1, -a], reduction, zi=self._zi)
+        return smoothed + self.makeup_gain
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if len(samples) == 0:
+            return samples
+        gain = np.power(10.0, self.gain_db(samples) / 20).astype(np.float32)
+        return samples * gain[:, None]
+
+
+class LookaheadLimiter:
+    """先読み型のピークリミッター
+
+    lookaheadフレーム先までのピークから必要なゲイン低下量を求め、先読み区間の移動平均で滑らかに下げる。
+    出力はlookaheadフレームだけ遅れるため、最後にflushで残りを取り出す。
+    """
+
+    def __init__(self, frame_rate: int, ceiling: float = -1.0, lookahead: float = 5.0, release: float = 50.0):
+        self.ceiling = ceiling
+        self.lookahead = max(1, int(round(lookahead * frame_rate / 1000)))
+        self._release_db = _decay_per_frame(release, frame_rate)
+        self._pending: np.ndarray | None = None
+        # 直前までのゲイン低下量(dB)。移動平均のために先読み長分を保持する
+        self._history: np.ndarray | None = None
+        self._reduction_db = 0.0
+
+    def _reduction(self, samples: np.ndarray, final: bool) -> np.ndarray:
+        required = np.maximum(0.0, _to_db(samples) - self.ceiling)
+        if final:
+            required = np.concatenate([required, np.zeros(self.lookahead)])
+        # 先読み: 各フレームで [n, n + lookahead] の最大値を保持する
+        size = self.lookahead + 1
+        held = maximum_filter1d(required, size=size, mode="nearest")[size // 2 : size // 2 + len(required) - self.lookahead]
+        held = _peak_hold(held, self._release_db, self._reduction_db)
+        if len(held):
+            self._reduction_db = float(held[-1])
+
+        if self._history is None:
+            # 先頭より前は先頭のピークを先読みしていたものとして扱う
+            self._history = np.full(self.lookahead - 1, held[0] if len(held) else 0.0)
+
+        # 先読み長の移動平均。各フレームでの平均は必要量を下回らない
+        padded = np.concatenate([self._history, held])
+        cumsum = np.concatenate([[0.0], np.cumsum(padded)])
+        averaged = (cumsum[self.lookahead :] - cumsum[: -self.lookahead]) / self.lookahead
+        self._history = padded[len(padded) - (self.lookahead - 1) :]
+        return averaged
+
+    def process(self, samples: np.ndarray, final: bool = False) -> np.ndarray:
+        if self._pending is not None:
+            samples = np.concatenate([self._pending, samples])
+        if not final and len(samples) <= self.lookahead:
+            self._pending = samples
+            return samples[:0]
+
+        reduction = self._reduction(samples, final)
+        ready = len(reduction)
+        self._pending = None if final else samples[ready:]
+        gain = np.power(10.0, -reduction / 20).astype(np.float32)
+        return samples[:ready] * gain[:, None]
+
+    def flush(self) -> np.ndarray:
+        if self._pending is None:
+            return np.zeros((0, 1), dtype=np.float32)
+        return self.process(self._pending[:0], final=True)
+
+
+class MasteringChain:
+    """コンプレッサー → リミッターの順に処理する番組用のマスタリングチェイン"""
+
+    def __init__(self, frame_rate: int):
+        self.compressor = Compressor(frame_rate, threshold=-20, ratio=2.5, attack=5, release=50)
+        self.limiter = LookaheadLimiter(frame_rate, ceiling=-1, lookahead=5, release=50)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        return self.limiter.process(self.compressor.process(samples))
+
+    def flush(self) -> np.ndarray:
+        return self.limiter.flush()
@@ -0,0 +1,159 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""マスタリング済みの番組を配信用の形式(レンディション)にエンコードする
+
+マスタリングの結果は16bitの生PCMとして一度だけファイルに書き出し、各レンディションとHLSの分割はそのファイルを入力にしたffmpegで並列に行う。
+"""
+
+import asyncio
+import logging
+import os
+import subprocess
+import tempfile
+from enum import Enum
+
+import numpy as np
+from pydantic import BaseModel
+
+from radio_station.utils.audio import ffmpeg_path, to_pcm16
+
+logger = logging.getLogger(__name__)
+
+# HLSのファイル名の接頭辞。プレイリストからは同じ接頭辞のセグメントを相対パスで参照する
+HLS_PREFIX = "audio_hls"
+DEFAULT_HLS_SEGMENT_SECONDS = 6.0
+
+
+class Codec(str, Enum):
+    MP3 = "mp3"
+    AAC = "aac"
+    OPUS = "opus"
+
+    @property
+    def encoder(self) -> str:
+        return {Codec.MP3: "libmp3lame", Codec.AAC: "aac", Codec.OPUS: "libopus"}[self]
+
+    @property
+    def container(self) -> list[str]:
+        """単体のファイルにする場合のffmpegの出力形式"""
+        if self is Codec.AAC:
+            # 再生開始前にファイル全体を読まなくて済むよう、moovを先頭に置く
+            return ["-movflags", "+faststart", "-f", "mp4"]
+        return ["-f", {Codec.MP3: "mp3", Codec.OPUS: "ogg"}[self]]
+
+
+class Rendition(BaseModel):
+    """配信用にエンコードする形式"""
+
+    name: str
+    codec: Codec
+    bitrate: str
+    artifact_key: str
+    mime_type: str
+
+    def codec_args(self) -> list[str]:
+        return ["-c:a", self.codec.encoder, "-b:a", self.bitrate]
+
+
+class EncodedRendition(Rendition):
+    """保存したレンディション。セッションのstateに記録し、配信履歴に引き継ぐ"""
+
+    size: int
+
+
+MP3_96K = Rendition(name="mp3_96k", codec=Codec.MP3, bitrate="96k", artifact_key="audio.mp3", mime_type="audio/mp3")
+AAC_128K = Rendition(name="aac_128k", codec=Codec.AAC, bitrate="128k", artifact_key="audio.m4a", mime_type="audio/mp4")
+OPUS_64K = Rendition(name="opus_64k", codec=Codec.OPUS, bitrate="64k", artifact_key="audio.opus", mime_type="audio/ogg")
+# 先頭のレンディションが番組の音声(これまでのaudio.mp3)になる
+DEFAULT_RENDITIONS = [MP3_96K, AAC_128K, OPUS_64K]
+
+
+def hls_mime_type(name: str) -> str:
+    """HLSのファイルのMIMEタイプ"""
+    return "application/vnd.apple.mpegurl" if name.endswith(".m3u8") else "audio/mp4"
+
+
+class PcmFileWriter:
+    """floatのPCMをブロック単位で16bitの生PCMとしてファイルに書き出す。ストリーミングのマスタリングの出力先に使う"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self) -> "PcmFileWriter":
+        self._file = open(self.path, "wb")
+        return self
+
+    def write(self, samples: np.ndarray) -> None:
+        self._file.write(memoryview(to_pcm16(samples)).cast("B"))
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self._file.close()
+
+
+def _run_ffmpeg(pcm_path: str, frame_rate: int, channels: int, output_args: list[str], description: str) -> None:
+    # fmt: off
+    command = [
+        ffmpeg_path(), "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "s16le", "-ar", str(frame_rate), "-ac", str(channels), "-i", pcm_path,
+        *output_args,
+    ]
+    # fmt: on
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"failed to encode {description}: {result.stderr.decode(errors='replace')}")
+
+
+def encode_rendition(pcm_path: str, frame_rate: int, channels: int, rendition: Rendition) -> bytes:
+    """16bitの生PCMのファイルをレンディションの形式にエンコードする"""
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, rendition.artifact_key)
+        _run_ffmpeg(pcm_path, frame_rate, channels, [*rendition.codec_args(), *rendition.codec.container, output], rendition.name)
+        with open(output, "rb") as f:
+            return f.read()
+
+
+def segment_hls(pcm_path: str, frame_rate: int, channels: int, rendition: Rendition, segment_seconds: float = DEFAULT_HLS_SEGMENT_SECONDS) -> dict[str, bytes]:
+    """16bitの生PCMのファイルをfMP4のHLSに分割する。ファイル名からbyte列への対応を返す。プレイリストはHLS_PREFIXに.m3u8を付けた名前"""
+    with tempfile.TemporaryDirectory() as directory:
+        # fmt: off
+        output_args = [
+            *rendition.codec_args(),
+            "-f", "hls", "-hls_time", str(segment_seconds), "-hls_playlist_type", "vod",
+            "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", f"{HLS_PREFIX}_init.mp4",
+            "-hls_segment_filename", os.path.join(directory, f"{HLS_PREFIX}_%05d.m4s"),
+            os.path.join(directory, f"{HLS_PREFIX}.m3u8"),
+        ]
+        # fmt: on
+        _run_ffmpeg(pcm_path, frame_rate, channels, output_args, f"hls ({rendition.name})")
+        files = {}
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name), "rb") as f:
+                files[name] = f.read()
+        return files
+
+
+async def encode_renditions(pcm_path: str, frame_rate: int, channels: int, renditions: list[Rendition], hls_segment_seconds: float | None = None) -> tuple[list[bytes], dict[str, bytes]]:
+    """各レンディションのエンコードとHLSの分割を並列に行う
+
+    処理はそれぞれ別のffmpegのプロセスで行うので、待つ側はスレッドで足りる。HLSは最初のAACのレンディション(無ければAAC_128K)の設定で作る。
+    """
+    jobs = [asyncio.to_thread(encode_rendition, pcm_path, frame_rate, channels, rendition) for rendition in renditions]
+    if hls_segment_seconds is not None:
+        hls_rendition = next((rendition for rendition in renditions if rendition.codec is Codec.AAC), AAC_128K)
+        jobs.append(asyncio.to_thread(segment_hls, pcm_path, frame_rate, channels, hls_rendition, hls_segment_seconds))
+    logger.info(f"encode renditions: {[rendition.name for rendition in renditions]}, hls: {hls_segment_seconds}")
+    results = await asyncio.gather(*jobs)
+    return list(results[: len(renditions)]), results[len(renditions)] if hls_segment_seconds is not None else {}
@@ -0,0 +1,200 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+from radio_station.sub_agents.mastering.mixer import Clip, LoopingSource, Timeline
+from radio_station.utils.audio import ffmpeg_path, to_float32
+from radio_station.utils.loudness import TARGET_LOUDNESS, TARGET_TRUE_PEAK
+
+logger = logging.getLogger(__name__)
+
+# 音量エンベロープを評価する粒度(フレーム数)
+ENVELOPE_BLOCK_FRAMES = 256
+# 音源を一時ファイルへ書き出す単位(フレーム数)
+WRITE_BLOCK_FRAMES = 1 << 16
+
+_CHANNEL_LAYOUTS = {1: "mono", 2: "stereo"}
+
+
+def _envelope_points(clip: Clip) -> tuple[np.ndarray, np.ndarray] | None:
+    """エンベロープとフェードをdBで合算した折れ線を (フレーム位置, dB) で返す。ゲイン変化が無い場合はNone
+
+    折れ線の和は各折れ線の頂点を合わせた折れ線になるので、頂点の位置だけで評価すればClip.gainと一致する。
+    等パワーのフェードは折れ線で近似するので、Clip.gainとの差はフェード中だけ僅かに残る。
+    """
+    curves = [list(zip(*points, strict=True)) for points in clip.envelopes + clip.fade_points()]
+    if not curves:
+        return None
+
+    xp = np.unique(np.concatenate([np.asarray(x, dtype=np.float64) for x, _ in curves]))
+    fp = sum(np.interp(xp, x, f) for x, f in curves)
+    return xp, fp
+
+
+def _gain_segments(clip: Clip, frame_rate: int) -> list[tuple[int, str]] | None:
+    """エンベロープの折れ線を頂点で区切り、(区間の開始フレーム, volumeフィルタ) の列にする。ゲイン変化が無い場合はNone
+
+    区間の中ではdBが直線なので、区間ごとのvolumeは1次式で書ける。頂点がいくつあっても式は入れ子にならない。
+    範囲外は端の値を保つ(np.interpと同じ)。頂点はフレーム位置に丸める。
+    """
+    points = _envelope_points(clip)
+    if points is None:
+        return None
+
+    xp, fp = points
+    inner = np.rint(xp).astype(np.int64)
+    bounds = np.unique(np.concatenate([[0], inner[(inner > 0) & (inner < clip.length)], [clip.length]]))
+    db = np.interp(bounds, xp, fp)
+    segments = []
+    for start, stop, begin, end in zip(bounds[:-1], bounds[1:], db[:-1], db[1:], strict=True):
+        if np.isclose(begin, end):
+            segments.append((int(start), f"volume=volume={begin:.6f}dB"))
+            continue
+        slope = (end - begin) / ((stop - start) / frame_rate)
+        segments.append((int(start), f"volume=volume='pow(10,({begin:.6f}{slope:+.6f}*(t-{start / frame_rate:.6f}))/20)':eval=frame"))
+    return segments
+
+
+def _clip_chains(clip: Clip, input_index: int, source_channels: int, timeline: Timeline, label: str) -> list[str]:
+    """1つのクリップを、先頭からclip.lengthフレームの音声にしてタイムライン上の位置へ遅らせ、[label] に出力するフィルタチェーン
+
+    ゲインが変化する場合はasegmentで折れ線の区間ごとに分け、区間ごとのvolumeを通してconcatで繋ぎ直す。
+    """
+    filters = ["asetpts=PTS-STARTPTS"]
+    if source_channels != timeline.channels:
+        # モノラル音源は全チャンネルへ同じ音量で複製する(Timelineのブロードキャストと同じ)
+        routes = "|".join(f"c{c}=c0" for c in range(timeline.channels))
+        filters.append(f"pan={_CHANNEL_LAYOUTS[timeline.channels]}|{routes}")
+    if clip.start_padding:
+        filters.append(f"adelay=delays={clip.start_padding}S:all=1")
+    filters.append(f"apad=whole_len={clip.length}")
+    filters.append(f"atrim=end_sample={clip.length}")
+    delay = [f"adelay=delays={clip.offset}S:all=1"] if clip.offset else []
+
+    segments = _gain_segments(clip, timeline.frame_rate)
+    if segments is None:
+        return [f"[{input_index}:a]{','.join(filters + delay)}[{label}]"]
+
+    # volumeの式はフレームごとに評価するので、評価する粒度を揃える
+    filters.append(f"asetnsamples=n={ENVELOPE_BLOCK_FRAMES}:p=0")
+    if len(segments) == 1:
+        return [f"[{input_index}:a]{','.join(filters + [segments[0][1]] + delay)}[{label}]"]
+
+    splits = "|".join(str(start) for start, _ in segments[1:])
+    parts = "".join(f"[{label}s{k}]" for k in range(len(segments)))
+    chains = [f"[{input_index}:a]{','.join(filters)},asegment=samples={splits}{parts}"]
+    chains += [f"[{label}s{k}]{volume}[{label}v{k}]" for k, (_, volume) in enumerate(segments)]
+    gained = "".join(f"[{label}v{k}]" for k in range(len(segments)))
+    chains.append(f"{gained}{','.join([f'concat=n={len(segments)}:v=0:a=1'] + delay)}[{label}]")
+    return chains
+
+
+def compile_filter_graph(
+    timeline: Timeline,
+    sources: list[tuple[int | None, int]],
+    loudness: float = TARGET_LOUDNESS,
+    true_peak: float = TARGET_TRUE_PEAK,
+) -> str:
+    """タイムラインをffmpegのfilter_complexにする
+
+    sourcesは各クリップの (入力番号, チャンネル数)。無音のクリップは入力番号にNoneを渡す。
+    ミックスの後にコンプレッサー・リミッター・ラウドネス正規化を通し、[out] に出力する。
+    """
+    chains = []
+    labels = []
+    for i, (clip, (input_index, channels)) in enumerate(zip(timeline.clips, sources, strict=True)):
+        if input_index is None:
+            continue
+        label = f"c{i}"
+        chains += _clip_chains(clip, input_index, channels, timeline, label)
+        labels.append(f"[{label}]")
+
+    # fmt: off
+    mastering = [
+        f"amix=inputs={len(labels)}:duration=longest:dropout_transition=0:normalize=0",
+        f"apad=whole_len={timeline.length}",
+        f"atrim=end_sample={timeline.length}",
+        "acompressor=threshold=-20dB:ratio=2.5:attack=5:release=50:detection=peak:link=maximum",
+        "alimiter=limit=-1dB:attack=5:release=50:level=disabled",
+        f"loudnorm=I={loudness}:TP={true_peak}:LRA=11",
+        f"aresample={timeline.frame_rate}",
+    ]
+    # fmt: on
+    chains.append(f"{''.join(labels)}{','.join(mastering)}[out]")
+    return ";".join(chains)
+
+
+def _write_pcm(path: str, samples: np.ndarray | LoopingSource, sample_format: str) -> None:
+    """音源をブロックごとに書き出す。ループする音源も繰り返した配列を作らずに書き出せる"""
+    with open(path, "wb") as f:
+        for start in range(0, len(samples), WRITE_BLOCK_FRAMES):
+            block = samples[start : start + WRITE_BLOCK_FRAMES]
+            if sample_format == "s16le":
+                f.write(block.astype("<i2", copy=False).tobytes())
+            else:
+                f.write(to_float32(block).astype("<f4", copy=False).tobytes())
+
+
+def render_pcm(timeline: Timeline, output: str, loudness: float = TARGET_LOUDNESS, true_peak: float = TARGET_TRUE_PEAK) -> None:
+    """タイムラインのミックス・マスタリングをffmpegで行い、16bitの生PCMをoutputに書き出す。複数の形式へエンコードする前段に使う
+
+    各音源はヘッダの無い生PCMとして一時ディレクトリに書き出してffmpegの入力にする。
+    """
+    if not any(clip.samples is not None for clip in timeline.clips):
+        raise ValueError("timeline has no audio.")
+
+    with tempfile.TemporaryDirectory() as directory:
+        _render(timeline, output, directory, loudness, true_peak)
+
+
+def _render(timeline: Timeline, output: str, directory: str, loudness: float, true_peak: float) -> None:
+    """各音源をdirectoryに書き出し、filter_complexの出力をoutputに書き出す"""
+    inputs: list[str] = []
+    sources: list[tuple[int | None, int]] = []
+    written: dict[int, int] = {}
+    for clip in timeline.clips:
+        if clip.samples is None:
+            sources.append((None, timeline.channels))
+            continue
+        if id(clip.samples) not in written:
+            # 同じ音源を複数のクリップで使う場合も書き出しは1回だけにする
+            index = len(written)
+            path = os.path.join(directory, f"{index}.pcm")
+            sample_format = "s16le" if clip.samples.dtype == np.int16 else "f32le"
+            _write_pcm(path, clip.samples, sample_format)
+            # fmt: off
+            inputs += ["-f", sample_format, "-ar", str(timeline.frame_rate), "-ac", str(clip.samples.shape[1]), "-i", path]
+            # fmt: on
+            written[id(clip.samples)] = index
+        sources.append((written[id(clip.samples)], clip.samples.shape[1]))
+
+    graph = compile_filter_graph(timeline, sources, loudness=loudness, true_peak=true_peak)
+    # fmt: off
+    command = [
+        ffmpeg_path(), "-hide_banner", "-loglevel", "error", "-y",
+        *inputs,
+        "-filter_complex", graph, "-map", "[out]",
+        "-ac", str(timeline.channels), "-f", "s16le", "-ar", str(timeline.frame_rate), output,
+    ]
+    # fmt: on
+    logger.info(f"render timeline with ffmpeg: {len(written)} inputs, {timeline.length} frames")
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"failed to render pcm: {result.stderr.decode(errors='replace')}")
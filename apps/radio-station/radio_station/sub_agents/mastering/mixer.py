@@ -0,0 +1,324 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import math
+from enum import Enum
+
+import numpy as np
+
+from radio_station.utils.audio import dbfs, to_float32
+
+logger = logging.getLogger(__name__)
+
+# pydubのfade_in/fade_outと同じく-120dBを無音として扱う
+SILENCE_DB = -120.0
+
+# 背景音楽同士のクロスフェード長
+CROSSFADE_MS = 2500
+# オープニングの背景音楽をトーク後に伸ばす長さ
+OPENING_TAIL_MS = 2500
+# 通常セグメントの背景音楽をトーク後に伸ばす長さ
+CONTENT_TAIL_MS = 5000
+# 音楽セグメントでトークと音楽の間に入れる無音
+MUSIC_GAP_MS = 100
+# オープニングで背景音楽を下げ始めてから下げきるまでの長さ
+OPENING_DUCK_MS = 1000
+# エンディングでトーク後に背景音楽を戻す長さ
+ENDING_RELEASE_MS = 10
+# トークに対する背景音楽の音量差
+MUSIC_GAIN_DB = -10
+# 背景音楽をループする継ぎ目のクロスフェード長
+LOOP_SEAM_MS = 50
+
+
+class FadeCurve(str, Enum):
+    """フェードイン・アウトの形"""
+
+    # dBで直線(pydubのfade_in/fade_outと同じ)
+    LINEAR_DB = "linear_db"
+    # 振幅をsin/cosにする。相関の無い音源同士のクロスフェードで合計のパワーが一定になる
+    EQUAL_POWER = "equal_power"
+
+
+def ms_to_frames(ms: float, frame_rate: int) -> int:
+    return int(round(ms * frame_rate / 1000))
+
+
+def db_to_gain(db: np.ndarray | float) -> np.ndarray:
+    return np.power(10.0, np.asarray(db, dtype=np.float32) / 20.0)
+
+
+class LoopingSource:
+    """音源を繰り返した長さlengthの仮想的な音源
+
+    繰り返した配列は作らず、読み出す範囲だけを剰余で組み立てる。
+    2周目以降の先頭seamフレームは、前の周の末尾seamフレームとクロスフェードして継ぎ目を目立たなくする。
+    ループの継ぎ目は似た音同士が重なることが多いので、等パワーではなく振幅の和が一定になる直線のフェードにする。
+    """
+
+    def __init__(self, samples: np.ndarray, length: int, seam: int = 0):
+        self.source = samples
+        self.length = length
+        # 音源が継ぎ目に対して短い場合はクロスフェードしない
+        self.seam = seam if len(samples) >= 2 * seam else 0
+        self.period = len(samples) - self.seam
+        self._seam_mix: np.ndarray | None = None
+        if self.seam:
+            x = (np.arange(self.seam, dtype=np.float32) + 0.5) / self.seam
+            self._seam_mix = to_float32(samples[: self.seam]) * x[:, None] + to_float32(samples[self.period :]) * (1 - x)[:, None]
+
+    def __len__(self) -> int:
+        return self.length
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.length, self.source.shape[1]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(np.float32) if self.seam else self.source.dtype
+
+    def __getitem__(self, key: slice) -> np.ndarray:
+        if not isinstance(key, slice):
+            raise TypeError("LoopingSource supports only slices")
+        start, stop, step = key.indices(self.length)
+        if step != 1:
+            raise ValueError("LoopingSource supports only contiguous slices")
+
+        pieces = []
+        position = start
+        while position < stop:
+            lap, offset = divmod(position, self.period)
+            # 2周目以降の先頭は継ぎ目のクロスフェード
+            source, end = (self._seam_mix, self.seam) if lap and offset < self.seam else (self.source, self.period)
+            piece = source[offset : min(end, offset + stop - position)]
+            pieces.append(to_float32(piece) if self.seam else piece)
+            position += len(piece)
+        if not pieces:
+            return self.source[:0]
+        if len(pieces) == 1:
+            # 1周の中に収まる範囲は音源のビューをそのまま返す
+            return pieces[0]
+        return np.concatenate(pieces)
+
+
+def loop_to_length(samples: np.ndarray, length: int, seam: int = 0) -> np.ndarray | LoopingSource:
+    """samplesを繰り返してlengthフレームにする。足りない場合は複製せずにLoopingSourceにする"""
+    if len(samples) >= length or len(samples) == 0:
+        return samples[:length]
+    return LoopingSource(samples, length, seam)
+
+
+class Clip:
+    """タイムライン上に配置する音源。位置・長さ・エンベロープはすべてフレーム単位"""
+
+    def __init__(self, offset: int, length: int, samples: np.ndarray | LoopingSource | None = None, start_padding: int = 0):
+        self.offset = offset
+        self.length = length
+        # Noneの場合は無音(長さだけを持つ)
+        self.samples = samples
+        # クリップ先頭から音源が始まるまでの無音
+        self.start_padding = start_padding
+        # (クリップ内フレーム位置, dB) の折れ線。複数ある場合はdBで加算する
+        self.envelopes: list[list[tuple[int, float]]] = []
+        self.fade_in = 0
+        self.fade_out = 0
+        self.fade_curve = FadeCurve.LINEAR_DB
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.length
+
+    def add_envelope(self, points: list[tuple[int, float]]) -> None:
+        self.envelopes.append(points)
+
+    def gain(self, start: int, stop: int) -> np.ndarray | None:
+        """クリップ内の [start, stop) のゲイン(倍率)を返す。ゲイン変化が無い場合はNone"""
+        if not self.envelopes and not self.fade_in and not self.fade_out:
+            return None
+
+        frames = np.arange(start, stop, dtype=np.float32)
+        db = np.zeros(stop - start, dtype=np.float32)
+        for points in self.envelopes:
+            xp, fp = zip(*points, strict=True)
+            db += np.interp(frames, xp, fp).astype(np.float32)
+        if self.fade_curve is FadeCurve.EQUAL_POWER:
+            gain = db_to_gain(db)
+            if self.fade_in:
+                gain *= np.sin(np.pi / 2 * np.clip(frames / self.fade_in, 0.0, 1.0))
+            if self.fade_out:
+                gain *= np.cos(np.pi / 2 * np.clip((frames - (self.length - self.fade_out)) / self.fade_out, 0.0, 1.0))
+            return gain
+        if self.fade_in:
+            db += np.interp(frames, [0, self.fade_in], [SILENCE_DB, 0.0]).astype(np.float32)
+        if self.fade_out:
+            db += np.interp(frames, [self.length - self.fade_out, self.length], [0.0, SILENCE_DB]).astype(np.float32)
+        return db_to_gain(db)
+
+    def fade_points(self, points: int = 32) -> list[list[tuple[float, float]]]:
+        """フェードを (クリップ内フレーム位置, dB) の折れ線にする。等パワーの曲線はpoints個の頂点で近似する"""
+        if self.fade_curve is FadeCurve.LINEAR_DB:
+            fades = []
+            if self.fade_in:
+                fades.append([(0, SILENCE_DB), (self.fade_in, 0.0)])
+            if self.fade_out:
+                fades.append([(self.length - self.fade_out, 0.0), (self.length, SILENCE_DB)])
+            return fades
+
+        x = np.linspace(0.0, 1.0, points + 1)
+        with np.errstate(divide="ignore"):
+            rise = np.maximum(20 * np.log10(np.sin(np.pi / 2 * x)), SILENCE_DB)
+        fades = []
+        if self.fade_in:
+            fades.append(list(zip((x * self.fade_in).tolist(), rise.tolist(), strict=True)))
+        if self.fade_out:
+            fades.append(list(zip((self.length - self.fade_out + x * self.fade_out).tolist(), rise[::-1].tolist(), strict=True)))
+        return fades
+
+
+class Timeline:
+    """クリップをフレーム位置で配置し、指定範囲を1つのバッファに描画する"""
+
+    def __init__(self, frame_rate: int, channels: int = 2):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.clips: list[Clip] = []
+
+    @property
+    def length(self) -> int:
+        return max((clip.end for clip in self.clips), default=0)
+
+    def add(self, clip: Clip) -> Clip:
+        self.clips.append(clip)
+        return clip
+
+    def render(self, start: int = 0, length: int | None = None, out: np.ndarray | None = None) -> np.ndarray:
+        """[start, start + length) を描画する。outを渡すとその配列(memmapなど)に書き込む"""
+        if out is not None:
+            length = len(out)
+            out[...] = 0
+        else:
+            if length is None:
+                length = self.length - start
+            out = np.zeros((length, self.channels), dtype=np.float32)
+        for clip in self.clips:
+            self._mix_clip(out, start, clip)
+        return out
+
+    @staticmethod
+    def _mix_clip(out: np.ndarray, start: int, clip: Clip) -> None:
+        if clip.samples is None:
+            return
+        audio_start = clip.offset + clip.start_padding
+        audio_end = min(clip.end, audio_start + len(clip.samples))
+        a = max(audio_start, start)
+        b = min(audio_end, start + len(out))
+        if a >= b:
+            return
+
+        # 音源は整数PCMのまま保持し、描画する範囲だけfloatにする
+        src = to_float32(clip.samples[a - audio_start : b - audio_start])
+        gain = clip.gain(a - clip.offset, b - clip.offset)
+        # モノラル音源は (n, 1) のままステレオへブロードキャストする
+        if gain is None:
+            out[a - start : b - start] += src
+        else:
+            out[a - start : b - start] += src * gain[:, None]
+
+
+class ProgramMixer:
+    """番組のトークと背景音楽をセグメントのルールに従ってタイムラインへ配置する
+
+    トークは隙間なく連結し、背景音楽は前の音楽とCROSSFADE_MSだけ等パワーのクロスフェードで重ねて連結する。
+    配置はクリップの位置とゲインを決めるだけなので、描画は全体で1回、各クリップを1度だけ書き込む。
+    """
+
+    def __init__(self, frame_rate: int, channels: int = 2, crossfade_ms: float = CROSSFADE_MS, music_gain_db: float = MUSIC_GAIN_DB, crossfade_curve: FadeCurve = FadeCurve.EQUAL_POWER):
+        self.timeline = Timeline(frame_rate, channels)
+        self.crossfade = ms_to_frames(crossfade_ms, frame_rate)
+        self.crossfade_curve = crossfade_curve
+        self.loop_seam = ms_to_frames(LOOP_SEAM_MS, frame_rate)
+        self.music_gain_db = music_gain_db
+        self.voice_position = 0
+        self._last_music: Clip | None = None
+
+    @property
+    def frame_rate(self) -> int:
+        return self.timeline.frame_rate
+
+    def _frames(self, ms: float) -> int:
+        return ms_to_frames(ms, self.frame_rate)
+
+    def _place_voice(self, voice: np.ndarray, lead: int = 0, tail: int = 0) -> Clip:
+        clip = self.timeline.add(Clip(offset=self.voice_position, length=lead + len(voice) + tail, samples=voice, start_padding=lead))
+        self.voice_position = clip.end
+        return clip
+
+    def _place_music(self, length: int, samples: np.ndarray | None = None, start_padding: int = 0) -> Clip:
+        clip = Clip(offset=0, length=length, samples=samples, start_padding=start_padding)
+        if self._last_music is not None:
+            crossfade = min(self.crossfade, self._last_music.length, length)
+            clip.offset = self._last_music.end - crossfade
+            clip.fade_in = crossfade
+            self._last_music.fade_out = crossfade
+            clip.fade_curve = self._last_music.fade_curve = self.crossfade_curve
+        self._last_music = self.timeline.add(clip)
+        return clip
+
+    def _music_gain(self, voice: np.ndarray, music: np.ndarray, voice_level: float | None, music_level: float | None) -> float:
+        # 音源ごとに測定済みのレベル(dBFS)があればそれを使い、無ければここで測る
+        voice_level = dbfs(voice) if voice_level is None else voice_level
+        music_level = dbfs(music) if music_level is None else music_level
+        gain = voice_level + self.music_gain_db - music_level
+        return gain if math.isfinite(gain) else self.music_gain_db
+
+    def add_voice_only(self, voice: np.ndarray) -> None:
+        # 背景音楽が無いセグメントは無音の音楽トラックを置く
+        self._place_voice(voice)
+        self._place_music(len(voice) + self._frames(CONTENT_TAIL_MS))
+
+    def add_music(self, voice: np.ndarray, music: np.ndarray) -> None:
+        # 音楽セグメント: トークの後に音楽を流す
+        gap = self._frames(MUSIC_GAP_MS)
+        self._place_voice(voice, tail=gap + len(music))
+        self._place_music(len(voice) + gap + len(music), samples=music, start_padding=len(voice) + gap)
+
+    def add_opening(self, voice: np.ndarray, music: np.ndarray, intro: int, voice_level: float | None = None, music_level: float | None = None) -> None:
+        # オープニング: introフレームだけ音楽を流した後、音楽を下げてトークを始める
+        gain = self._music_gain(voice, music, voice_level, music_level)
+        length = intro + len(voice) + self._frames(OPENING_TAIL_MS)
+        duck_start = max(0, intro - self._frames(OPENING_DUCK_MS))
+
+        self._place_voice(voice, lead=intro)
+        clip = self._place_music(length, samples=loop_to_length(music, length, self.loop_seam))
+        clip.add_envelope([(0, 0.0), (duck_start, 0.0), (intro, gain)])
+
+    def add_ending(self, voice: np.ndarray, music: np.ndarray, outro: int, voice_level: float | None = None, music_level: float | None = None) -> None:
+        # エンディング: トーク後に音楽を元の音量へ戻し、outroフレームかけてフェードアウトする
+        gain = self._music_gain(voice, music, voice_level, music_level)
+        length = len(voice) + outro
+
+        self._place_voice(voice, tail=outro)
+        clip = self._place_music(length, samples=loop_to_length(music, length, self.loop_seam))
+        clip.add_envelope([(0, gain), (len(voice), gain), (len(voice) + self._frames(ENDING_RELEASE_MS), 0.0)])
+        clip.add_envelope([(0, 0.0), (len(voice), 0.0), (length, SILENCE_DB)])
+
+    def add_content(self, voice: np.ndarray, music: np.ndarray, voice_level: float | None = None, music_level: float | None = None) -> None:
+        gain = self._music_gain(voice, music, voice_level, music_level)
+        length = len(voice) + self._frames(CONTENT_TAIL_MS)
+
+        self._place_voice(voice)
+        clip = self._place_music(length, samples=loop_to_length(music, length, self.loop_seam))
+        clip.add_envelope([(0, gain)])
@@ -0,0 +1,112 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""描画中の大きな配列を置く作業領域
+
+長い番組ではミックス・マスタリング中のfloat PCMが数百MBになる。
+メモリの予算を超える配列は一時ディレクトリのnumpy.memmapに置き、どのページをメモリに載せるかはOSのページキャッシュに任せる。
+"""
+
+import logging
+import math
+import os
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def scratch_memory_budget() -> int | None:
+    """作業用の配列をプロセスのメモリに置く上限(byte)。環境変数 MASTERING_MEMORY_BUDGET_MB で指定し、未指定なら上限なし"""
+    budget = os.environ.get("MASTERING_MEMORY_BUDGET_MB")
+    return int(float(budget) * 1024 * 1024) if budget else None
+
+
+class ScratchSpace:
+    """作業用の配列を確保する。memory_budget(byte)まではプロセスのメモリに、超えた分はmemmapのファイルに置く
+
+    memory_budgetがNoneの場合はすべてメモリに置く。withを抜けると一時ディレクトリごとファイルを削除する。
+    削除後もマップ済みの配列は読み書きできるが、ファイルの領域は配列が解放された時点で回収される。
+    """
+
+    def __init__(self, memory_budget: int | None = None, directory: str | None = None):
+        self.memory_budget = memory_budget
+        self.directory = directory
+        # メモリに置いた配列の合計(byte)。解放は追跡しないので、予算に対して保守的になる
+        self.in_memory = 0
+        self._temp: tempfile.TemporaryDirectory | None = None
+        self._count = 0
+
+    def __enter__(self) -> "ScratchSpace":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._temp is not None:
+            logger.info(f"remove scratch files: {self._count} files in {self._temp.name}")
+            self._temp.cleanup()
+            self._temp = None
+
+    def path(self, name: str) -> str:
+        """一時ディレクトリの中のファイルのパス。ファイルはwithを抜けると配列と一緒に削除される"""
+        return os.path.join(self._directory(), name)
+
+    def _directory(self) -> str:
+        if self._temp is None:
+            self._temp = tempfile.TemporaryDirectory(prefix="mastering-", dir=self.directory)
+        return self._temp.name
+
+    def _reserve(self, nbytes: int) -> bool:
+        """nbytesをメモリに置けるなら予算から差し引いてTrueを返す"""
+        if nbytes == 0 or self.memory_budget is None or self.in_memory + nbytes <= self.memory_budget:
+            self.in_memory += nbytes
+            return True
+        return False
+
+    def empty(self, shape: tuple[int, ...], dtype: np.dtype | type = np.float32) -> np.ndarray:
+        """初期化しない配列。memmapの場合はファイルを作った時点で0埋めされている"""
+        dtype = np.dtype(dtype)
+        nbytes = math.prod(shape) * dtype.itemsize
+        if self._reserve(nbytes):
+            return np.empty(shape, dtype=dtype)
+
+        self._count += 1
+        path = os.path.join(self._directory(), f"{self._count}.bin")
+        logger.info(f"scratch memmap: {path} {shape} {dtype} ({nbytes} bytes)")
+        return np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+
+    def zeros(self, shape: tuple[int, ...], dtype: np.dtype | type = np.float32) -> np.ndarray:
+        out = self.empty(shape, dtype)
+        if not isinstance(out, np.memmap):
+            out[...] = 0
+        return out
+
+    def store(self, samples: np.ndarray) -> np.ndarray:
+        """配列を作業領域に置く。予算内の配列、memmapの配列、メモリを持たない仮の音源はコピーせずにそのまま返す"""
+        if isinstance(samples, np.memmap) or 0 in samples.strides or self._reserve(samples.nbytes):
+            return samples
+        out = self.empty(samples.shape, samples.dtype)
+        out[...] = samples
+        return out
+
+    def store_bytes(self, data: bytes | memoryview) -> memoryview:
+        """byte列を作業領域に置く。予算を超える場合はmemmapにコピーする。返したmemoryviewはdecode_pcmでそのまま読める"""
+        if self._reserve(len(data)):
+            return memoryview(data)
+        out = self.empty((len(data),), np.uint8)
+        out[...] = np.frombuffer(data, dtype=np.uint8)
+        return memoryview(out)
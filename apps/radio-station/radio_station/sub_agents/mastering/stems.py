@@ -0,0 +1,96 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""セグメントごとのミックス済みステム
+
+番組のタイムラインをトークの切れ目で区切り、各区間をステムとして描画・保存する。
+ステムのキーは区間に重なるクリップの音源のハッシュと配置・ゲインから作るので、入力が変わった区間だけを描き直せばよい。
+"""
+
+import hashlib
+import json
+
+import numpy as np
+
+from radio_station.sub_agents.mastering.mixer import Clip, LoopingSource, Timeline
+from radio_station.utils.pcm import decode_pcm, encode_pcm
+
+# ステムのキーの計算方法やバイト列の形式を変えた場合に上げる
+STEM_FORMAT_VERSION = 3
+
+_PCM16_MAX = 32767
+
+
+def placeholder(frames: int, channels: int) -> np.ndarray:
+    """レイアウトの計算だけに使う、メモリを確保しない無音の音源"""
+    return np.broadcast_to(np.zeros((1, channels), dtype=np.int16), (frames, channels))
+
+
+def stem_ranges(timeline: Timeline, voice_clips: list[Clip]) -> list[tuple[int, int]]:
+    """トークのクリップの開始位置で区切った [start, stop) の一覧。最初の区間は先頭から、最後の区間はタイムラインの終わりまで"""
+    starts = [0] + [clip.offset for clip in voice_clips[1:]]
+    stops = starts[1:] + [timeline.length]
+    return list(zip(starts, stops, strict=True))
+
+
+def overlapping_clips(timeline: Timeline, start: int, stop: int) -> list[Clip]:
+    return [clip for clip in timeline.clips if clip.samples is not None and clip.offset < stop and start < clip.end]
+
+
+def stem_key(timeline: Timeline, start: int, stop: int, sources: dict[int, str]) -> str:
+    """区間の描画結果を決める要素のハッシュ。sourcesはクリップのidから音源のハッシュへの対応"""
+    clips = [
+        {
+            "source": sources[id(clip)],
+            "frames": len(clip.samples),
+            "loop_seam": clip.samples.seam if isinstance(clip.samples, LoopingSource) else 0,
+            "offset": clip.offset - start,
+            "length": clip.length,
+            "start_padding": clip.start_padding,
+            "envelopes": clip.envelopes,
+            "fade_in": clip.fade_in,
+            "fade_out": clip.fade_out,
+            "fade_curve": clip.fade_curve.value,
+        }
+        for clip in overlapping_clips(timeline, start, stop)
+    ]
+    description = {
+        "version": STEM_FORMAT_VERSION,
+        "frame_rate": timeline.frame_rate,
+        "channels": timeline.channels,
+        "length": stop - start,
+        "clips": clips,
+    }
+    return hashlib.blake2b(json.dumps(description, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def encode_stem(samples: np.ndarray, frame_rate: int) -> bytes:
+    """floatのステムを16bitの生PCMにする
+
+    ミックス直後は1.0を超えることがあるため、ピークが1.0を超える場合はスケールで割ってから量子化し、スケールをメタデータに持つ。
+    """
+    peak = float(np.max(np.abs(samples))) if samples.size else 0.0
+    scale = max(1.0, peak)
+    pcm = np.round(samples / scale * _PCM16_MAX).astype("<i2")
+    return encode_pcm(pcm, frame_rate, metadata={"scale": scale})
+
+
+def stem_clip(data: bytes | memoryview, offset: int) -> Clip:
+    """保存したステムを、コピーせずにタイムラインへ配置するクリップにする"""
+    samples, header = decode_pcm(data)
+    scale = float(header.metadata["scale"])
+    clip = Clip(offset=offset, length=len(samples), samples=samples)
+    # Timelineは16bit PCMを32768で割ってfloatにするので、量子化した時の係数との差とスケールを戻す
+    clip.add_envelope([(0, float(20 * np.log10(scale * 32768 / _PCM16_MAX)))])
+    return clip
@@ -0,0 +1,78 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from typing import Iterator, Protocol
+
+import numpy as np
+
+from radio_station.sub_agents.mastering.dsp import MasteringChain
+from radio_station.sub_agents.mastering.mixer import Timeline, ms_to_frames
+from radio_station.utils.loudness import TARGET_LOUDNESS, TARGET_TRUE_PEAK, LoudnessMeter, loudness_gain
+
+logger = logging.getLogger(__name__)
+
+# 一度に描画する長さ
+WINDOW_MS = 10000
+
+
+class BlockWriter(Protocol):
+    """マスタリングした窓を受け取る出力先(PcmFileWriterなど)"""
+
+    def write(self, samples: np.ndarray) -> None: ...
+
+
+def render_windows(timeline: Timeline, window_ms: float = WINDOW_MS) -> Iterator[np.ndarray]:
+    """タイムラインを先頭から固定長の窓ごとに描画する
+
+    窓の境界をまたぐクリップやクロスフェードは、各窓で重なる範囲だけが描画されるので継ぎ目は生じない。
+    """
+    window = ms_to_frames(window_ms, timeline.frame_rate)
+    length = timeline.length
+    for start in range(0, length, window):
+        yield timeline.render(start, min(window, length - start))
+
+
+def master_windows(timeline: Timeline, window_ms: float = WINDOW_MS, gain: float = 1.0) -> Iterator[np.ndarray]:
+    """窓ごとにマスタリングチェインを通す。コンプレッサーとリミッターの状態は窓をまたいで引き継ぐ"""
+    chain = MasteringChain(timeline.frame_rate)
+    for block in render_windows(timeline, window_ms):
+        mastered = chain.process(block)
+        if len(mastered):
+            yield mastered * np.float32(gain)
+    tail = chain.flush()
+    if len(tail):
+        yield tail * np.float32(gain)
+
+
+def stream_mastering(
+    timeline: Timeline,
+    encoder: BlockWriter,
+    window_ms: float = WINDOW_MS,
+    loudness: float = TARGET_LOUDNESS,
+    true_peak: float = TARGET_TRUE_PEAK,
+) -> None:
+    """番組全体を保持せずにマスタリングし、窓ごとにエンコーダへ書き込む
+
+    ラウドネス正規化には番組全体の統合ラウドネスが必要なため、1パス目で測定だけを行い、2パス目で正規化して書き出す。
+    """
+    meter = LoudnessMeter(timeline.frame_rate)
+    for block in master_windows(timeline, window_ms):
+        meter.process(block)
+    stats = meter.stats()
+    gain = loudness_gain(stats, loudness, true_peak)
+    logger.info(f"stream mastering: {stats}, gain {gain}")
+
+    for block in master_windows(timeline, window_ms, gain):
+        encoder.write(block)
@@ -0,0 +1,110 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""番組の波形(ピーク)と長さ・ラウドネスのメタデータ
+
+マスタリング済みの16bitの生PCMを一度だけ走査し、複数の解像度の (最小, 最大) のピークと、正確な長さ・ラウドネスを求める。
+配信側(リスナー向けアプリやRSS)は音声をダウンロード・デコードせずに、このメタデータだけで波形と長さを表示できる。
+"""
+
+import math
+import os
+
+import numpy as np
+from pydantic import BaseModel
+
+from radio_station.utils.loudness import LoudnessMeter
+
+WAVEFORM_ARTIFACT_KEY = "audio_waveform.json"
+WAVEFORM_MIME_TYPE = "application/json"
+# ピークを求める間隔(ms)。細かい順に並べ、粗い解像度は最も細かい解像度のピークから求める
+DEFAULT_PEAK_RESOLUTIONS_MS = (100, 500, 2000)
+# ファイルを読む単位(最も細かい解像度のピークの数)
+_BLOCK_PEAKS = 1024
+
+
+class WaveformLevel(BaseModel):
+    """1つの解像度のピーク"""
+
+    samples_per_peak: int
+    # (最小, 最大) を交互に並べた8bitの値(-128〜127)。全チャンネルをまとめた値
+    data: list[int]
+
+
+class Waveform(BaseModel):
+    """番組の波形と長さ・ラウドネス"""
+
+    frame_rate: int
+    channels: int
+    frames: int
+    duration_seconds: float
+    # 統合ラウドネス(LUFS)とトゥルーピーク(dBTP)。無音の場合はNone
+    integrated_loudness: float | None
+    true_peak: float | None
+    bits: int = 8
+    levels: list[WaveformLevel]
+
+    def summary(self) -> dict:
+        """セッションのstateに記録する内容。ピークは大きいのでアーティファクトにだけ保存する"""
+        return {"artifact_key": WAVEFORM_ARTIFACT_KEY, **self.model_dump(mode="json", exclude={"levels"})}
+
+
+def _finite(value: float) -> float | None:
+    return value if math.isfinite(value) else None
+
+
+def _interleave(lows: np.ndarray, highs: np.ndarray) -> list[int]:
+    # 16bitの値の上位8bitだけを残す
+    return np.stack([lows >> 8, highs >> 8], axis=1).ravel().tolist()
+
+
+def analyze_waveform(pcm_path: str, frame_rate: int, channels: int, resolutions_ms: tuple[int, ...] = DEFAULT_PEAK_RESOLUTIONS_MS) -> Waveform:
+    """16bitの生PCMのファイルから波形と長さ・ラウドネスを求める。ファイルはmemmapで少しずつ読み、全体をメモリに載せない"""
+    steps = [max(1, frame_rate * ms // 1000) for ms in resolutions_ms]
+    base = steps[0]
+    if any(step % base for step in steps):
+        raise ValueError(f"peak resolutions must be multiples of the finest one: {resolutions_ms}")
+
+    size = os.path.getsize(pcm_path) // (2 * channels) * channels
+    pcm = np.memmap(pcm_path, dtype="<i2", mode="r", shape=(size // channels, channels)) if size else np.zeros((0, channels), dtype="<i2")
+    meter = LoudnessMeter(frame_rate)
+    lows, highs = [], []
+    block = base * _BLOCK_PEAKS
+    for start in range(0, len(pcm), block):
+        samples = pcm[start : start + block]
+        meter.process(samples)
+        # 区切りの位置ごとに最小・最大を取る。端数の区間もそのまま1つのピークになる
+        indices = np.arange(0, len(samples), base)
+        lows.append(np.minimum.reduceat(samples.min(axis=1), indices))
+        highs.append(np.maximum.reduceat(samples.max(axis=1), indices))
+    low = np.concatenate(lows) if lows else np.zeros(0, dtype="<i2")
+    high = np.concatenate(highs) if highs else np.zeros(0, dtype="<i2")
+
+    levels = []
+    for step in steps:
+        indices = np.arange(0, len(low), step // base)
+        if len(low):
+            levels.append(WaveformLevel(samples_per_peak=step, data=_interleave(np.minimum.reduceat(low, indices), np.maximum.reduceat(high, indices))))
+        else:
+            levels.append(WaveformLevel(samples_per_peak=step, data=[]))
+
+    return Waveform(
+        frame_rate=frame_rate,
+        channels=channels,
+        frames=len(pcm),
+        duration_seconds=len(pcm) / frame_rate,
+        integrated_loudness=_finite(meter.integrated),
+        true_peak=_finite(meter.true_peak),
+        levels=levels,
+    )
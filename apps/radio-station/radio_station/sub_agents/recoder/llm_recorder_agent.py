@@ -13,9 +13,7 @@
 # limitations under the License.
 
 import asyncio
-import io
 import logging
-import wave
 from typing import AsyncGenerator
 
 from google.adk import Agent
@@ -24,11 +22,12 @@ from google.adk.agents.invocation_context import InvocationContext
 from google.adk.events import Event
 from google.genai import types
 from pydantic import Field
-from pydub import AudioSegment
 
 from radio_station.model.radio_cast import RadioCast
 from radio_station.model.talk_script import TalkScript
 from radio_station.utils.artifact import save_artifact
+from radio_station.utils.audio import pcm16_to_mp3
+from radio_station.utils.audio_executor import run_audio
 from radio_station.utils.instruction_provider import secret_instruction
 
 logger = logging.getLogger(__name__)
@@ -104,19 +103,7 @@ class LLMRecorderAgent(BaseAgent):
         # yield Event(author=self.name, content=types.Content(role=self.name, parts=parts), actions=EventActions(state_delta={ResearcherState.TASK_IDS: task_ids, ResearcherState.RESULTS: results}))
 
     async def save_audio(self, ctx: InvocationContext) -> None:
-        buf = io.BytesIO()
-
-        with wave.open(buf, "wb") as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)
-            wf.setframerate(24000)
-            wf.writeframes(self.audio_byte_array)
-
-        buf.seek(0)
-        audio_segment = AudioSegment.from_wav(buf)
-
-        out = io.BytesIO()
-        audio_segment.export(out, format="mp3", bitrate="192k")
-        part = types.Part.from_bytes(data=out.getvalue(), mime_type="audio/mp3")
+        data = await run_audio(pcm16_to_mp3, bytes(self.audio_byte_array), 24000, 1, "192k")
+        part = types.Part.from_bytes(data=data, mime_type="audio/mp3")
 
         await save_artifact(ctx, f"audio_{self.task_id}.mp3", part)
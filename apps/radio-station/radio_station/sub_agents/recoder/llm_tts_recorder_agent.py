@@ -13,30 +13,35 @@
 # limitations under the License.
 
 import asyncio
-import io
 import json
 import logging
 import os
 from typing import AsyncGenerator, Optional
 
 import google.genai.errors
+import numpy as np
 from google import genai
 from google.adk.agents import BaseAgent
 from google.adk.agents.invocation_context import InvocationContext
 from google.adk.events import Event
 from google.genai import types
 from pydantic import Field
-from pydub import AudioSegment, silence
 
 from radio_station.model.radio_cast import RadioCast
 from radio_station.model.talk_script import TalkScriptSegment
 from radio_station.state_keys import GlobalState, RecorderState
 from radio_station.utils.artifact import list_artifact, save_artifact
-from radio_station.utils.audio import export_wav
+from radio_station.utils.audio_executor import run_audio
 from radio_station.utils.instruction_provider import secret_instruction
+from radio_station.utils.loudness import analyze
+from radio_station.utils.pcm import PCM_MIME_TYPE, encode_pcm
+from radio_station.utils.speech_quality import analyze_speech
 
 logger = logging.getLogger(__name__)
 
+# Gemini TTSが返すPCMのフレームレート
+TTS_FRAME_RATE = 24000
+
 
 class LLMTTSSpeakerAgent(BaseAgent):
     task_id: str = Field(description="Unique identifier for this task")
@@ -127,10 +132,12 @@ Your job is narrate only the talk script that is provided below.
                     raise Exception(msg)
 
                 result = response.candidates[-1].content.parts[0].inline_data.data
-                if self.has_long_silence(AudioSegment.from_raw(io.BytesIO(result), channels=1, sample_width=2, frame_rate=24000)) and retry < 3:
-                    # 2秒以上の無音がある場合、失敗している可能性が高いのでもう一度作り直しさせる
+                report = await run_audio(analyze_speech, result, TTS_FRAME_RATE)
+                problems = report.problems()
+                if problems and retry < 3:
+                    # 2秒以上の無音・途切れ・クリッピング・途中で切れた終わり方がある場合、失敗している可能性が高いのでもう一度作り直しさせる
                     retry += 1
-                    logger.warning(f"detect long silence for task_id: {self.task_id}, retry")
+                    logger.warning(f"detect {problems} for task_id: {self.task_id}, retry: {report}")
                     await asyncio.sleep(1 * retry)
                     continue
 
@@ -168,12 +175,6 @@ Your job is narrate only the talk script that is provided below.
                     raise e
                 await asyncio.sleep(1 * retry)
 
-    def has_long_silence(self, audio: AudioSegment, silence_threshold=-50, chunk_size=2000):
-        start_trim = silence.detect_leading_silence(audio, silence_threshold, chunk_size)
-        end_trim = silence.detect_leading_silence(audio.reverse(), silence_threshold, chunk_size)
-
-        return start_trim > 0 or end_trim > 0
-
 
 class LLMTTSRecorderAgent(BaseAgent):
     task_id: str = Field(description="Unique identifier for this task")
@@ -235,7 +236,9 @@ class LLMTTSRecorderAgent(BaseAgent):
         )
 
     async def save_audio(self, ctx: InvocationContext) -> None:
-        audio_segment = AudioSegment.from_raw(io.BytesIO(self.audio_byte_array), channels=1, sample_width=2, frame_rate=24000)
-        part = types.Part.from_bytes(data=export_wav(audio_segment), mime_type="audio/wav")
+        # Gemini TTSの出力(24kHz・モノラルの16bit PCM)をリサンプルせずにそのまま生PCMとして保存する
+        samples = np.frombuffer(self.audio_byte_array, dtype="<i2", count=len(self.audio_byte_array) // 2).reshape(-1, 1)
+        stats = await run_audio(analyze, samples, TTS_FRAME_RATE)
+        part = types.Part.from_bytes(data=encode_pcm(samples, TTS_FRAME_RATE, loudness=stats), mime_type=PCM_MIME_TYPE)
 
         await save_artifact(ctx, RecorderState.task_artifact_key(self.task_id), part)
@@ -33,6 +33,8 @@ from radio_station.model.radio_cast import RadioCast
 from radio_station.model.talk_script import TalkScript
 from radio_station.state_keys import RecorderState
 from radio_station.utils.artifact import save_artifact
+from radio_station.utils.audio import convert_mp3
+from radio_station.utils.audio_executor import run_audio
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -87,9 +89,7 @@ class RecorderAgent(BaseAgent):
         for content in contents:
             audio_segment, creating = await self.tts(audio_segment, client, radio_cast, talk_script, [content])
 
-        out = io.BytesIO()
-        audio_segment.export(out, format="mp3", bitrate="192k")
-        part = types.Part.from_bytes(data=out.getvalue(), mime_type="audio/mp3")
+        part = types.Part.from_bytes(data=await run_audio(convert_mp3, audio_segment, "192k"), mime_type="audio/mp3")
 
         await save_artifact(ctx, f"audio_{self.task_id}.mp3", part)
 
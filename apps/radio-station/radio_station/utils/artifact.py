@@ -15,8 +15,14 @@
 from google.adk.agents.invocation_context import InvocationContext
 from google.genai import types
 
+from radio_station.utils.gcs_artifact import GcsArtifactWriter
+
 
 async def save_artifact(ctx: InvocationContext, filename: str, part: types.Part) -> int | None:
+    # GcsArtifactServiceは同時に保存すると同じバージョンを上書きし合うので、既存のオブジェクトを上書きしない書き込みにする
+    writer = GcsArtifactWriter.of(ctx)
+    if writer is not None and part.inline_data is not None:
+        return await writer.save_bytes(filename, part.inline_data.data, part.inline_data.mime_type)
     if ctx.artifact_service:
         return await ctx.artifact_service.save_artifact(
             app_name=ctx.session.app_name,
@@ -50,6 +56,12 @@ async def delete_artifact(ctx: InvocationContext, filename: str) -> None:
     return None
 
 
+async def list_versions(ctx: InvocationContext, filename: str) -> list[int]:
+    if ctx.artifact_service:
+        return await ctx.artifact_service.list_versions(app_name=ctx.session.app_name, user_id=ctx.session.user_id, session_id=ctx.session.id, filename=filename)
+    return []
+
+
 async def list_artifact(ctx: InvocationContext) -> list[str]:
     if ctx.artifact_service:
         return await ctx.artifact_service.list_artifact_keys(app_name=ctx.session.app_name, user_id=ctx.session.user_id, session_id=ctx.session.id)
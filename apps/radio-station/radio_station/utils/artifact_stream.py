@@ -0,0 +1,257 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""受信しながら書き出す生PCMのアーティファクト
+
+ストリーミングで受信する音声をメモリに溜めず、チャンクを受け取るたびにローカルのスプールファイルへ追記する。
+GcsArtifactServiceの場合は、chunk_bytes溜まるごとにスプールの続きをGCSの一時オブジェクトへアップロードする。
+途中でプロセスが落ちても、同じfilenameとtagで開き直せば受信済みの音声から続きを書ける。
+ローカルのスプールが無い場合(別のインスタンスで再開した場合)は、アップロード済みのチャンクから戻す。
+受信し終わったら、スプールのうち切り出した範囲だけを生PCMのアーティファクトとして保存し、スプールと一時オブジェクトを消す。
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Any
+
+import numpy as np
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.artifacts import GcsArtifactService
+from google.genai import types
+
+from radio_station.utils.artifact import load_artifact, save_artifact
+from radio_station.utils.gcs_artifact import GcsArtifactWriter
+from radio_station.utils.loudness import LoudnessStats
+from radio_station.utils.pcm import PCM_MIME_TYPE, write_pcm
+
+logger = logging.getLogger(__name__)
+
+# 1つの一時オブジェクトの大きさ。48kHz・ステレオの16bit PCMで約44秒
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+# 一時オブジェクトを置くGCSのprefix。アーティファクトのprefixの外に置き、list_artifact_keysに出てこないようにする
+PARTIAL_PREFIX = "_partial"
+
+
+def spool_directory() -> str:
+    """スプールファイルを置くディレクトリ。環境変数 ARTIFACT_SPOOL_DIR で指定する。プロセスが落ちた後に続きを書くには、再起動後も残る場所にする"""
+    return os.environ.get("ARTIFACT_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "radio-station-spool")
+
+
+class ChunkUpload:
+    """スプールのチャンクを永続化する先と、確定したファイルの保存先
+
+    既定ではスプールファイル自体が永続化の先になり、チャンクはアップロードしない。確定したファイルはsave_artifactで保存する。
+    """
+
+    def __init__(self, ctx: InvocationContext):
+        self.ctx = ctx
+
+    async def list_chunks(self) -> list[tuple[int, int]]:
+        """アップロード済みのチャンクの (開始byte, byte数) を開始位置の順に返す"""
+        return []
+
+    async def upload(self, offset: int, data: bytes) -> None:
+        pass
+
+    async def download(self, offset: int) -> bytes:
+        raise FileNotFoundError(f"no uploaded chunk at {offset}")
+
+    async def save(self, path: str, filename: str) -> int | None:
+        """確定したファイルをアーティファクトとして保存し、バージョンを返す"""
+        with open(path, "rb") as f:
+            data = await asyncio.to_thread(f.read)
+        return await save_artifact(self.ctx, filename, types.Part.from_bytes(data=data, mime_type=PCM_MIME_TYPE))
+
+    async def copy(self, source: str, filename: str) -> int | None:
+        """保存済みのアーティファクトの最新のバージョンを別のfilenameに保存する"""
+        part = await load_artifact(self.ctx, source)
+        return await save_artifact(self.ctx, filename, part) if part is not None else None
+
+    async def discard(self) -> None:
+        pass
+
+
+class GcsChunkUpload(ChunkUpload):
+    """GcsArtifactServiceのバケットにチャンクを一時オブジェクトとしてアップロードする
+
+    確定したファイルはresumable uploadで、コピーはバケットの中で、GcsArtifactWriterを通して作るので、どちらもファイル全体をメモリに読まない。
+    """
+
+    def __init__(self, ctx: InvocationContext, name: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES):
+        super().__init__(ctx)
+        self.service: GcsArtifactService = ctx.artifact_service
+        self.writer = GcsArtifactWriter.of(ctx)
+        self.prefix = f"{PARTIAL_PREFIX}/{ctx.session.app_name}/{ctx.session.user_id}/{ctx.session.id}/{name}/"
+        self.chunk_bytes = chunk_bytes
+
+    def _chunk_name(self, offset: int) -> str:
+        return f"{self.prefix}{offset:015d}"
+
+    async def list_chunks(self) -> list[tuple[int, int]]:
+        def list_blobs() -> list[tuple[int, int]]:
+            return sorted((int(blob.name.rsplit("/", 1)[1]), blob.size) for blob in self.service.storage_client.list_blobs(self.service.bucket, prefix=self.prefix))
+
+        return await asyncio.to_thread(list_blobs)
+
+    async def upload(self, offset: int, data: bytes) -> None:
+        blob = self.service.bucket.blob(self._chunk_name(offset))
+        await asyncio.to_thread(blob.upload_from_string, data, content_type="application/octet-stream")
+
+    async def download(self, offset: int) -> bytes:
+        return await asyncio.to_thread(self.service.bucket.blob(self._chunk_name(offset)).download_as_bytes)
+
+    async def save(self, path: str, filename: str) -> int | None:
+        return await self.writer.save_file(filename, path, PCM_MIME_TYPE, chunk_size=self.chunk_bytes)
+
+    async def copy(self, source: str, filename: str) -> int | None:
+        return await self.writer.copy(source, filename)
+
+    async def discard(self) -> None:
+        def delete() -> None:
+            for blob in self.service.storage_client.list_blobs(self.service.bucket, prefix=self.prefix):
+                blob.delete()
+
+        await asyncio.to_thread(delete)
+
+
+class PcmArtifactStream:
+    """受信した16bit PCMをスプールファイルへ追記し、最後に生PCMのアーティファクトとして保存する
+
+    async withで開き、writeでチャンクを追記し、finalizeで保存する。finalizeせずに抜けた場合はスプールを残し、
+    同じfilenameとtagで開き直すと受信済みの続きから書ける。tagには生成する内容の識別子(プランのハッシュなど)を渡し、別の内容の続きにならないようにする。
+    """
+
+    def __init__(
+        self,
+        ctx: InvocationContext,
+        filename: str,
+        tag: str,
+        frame_rate: int,
+        channels: int,
+        directory: str | None = None,
+        chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+        upload: ChunkUpload | None = None,
+    ):
+        self.filename = filename
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.frame_bytes = channels * 2
+        self.chunk_bytes = chunk_bytes
+        name = hashlib.blake2b(f"{ctx.session.app_name}/{ctx.session.user_id}/{ctx.session.id}/{filename}/{tag}".encode(), digest_size=16).hexdigest()
+        self.path = os.path.join(directory or spool_directory(), f"{name}.pcm")
+        if upload is None:
+            upload = GcsChunkUpload(ctx, name, chunk_bytes) if isinstance(ctx.artifact_service, GcsArtifactService) else ChunkUpload(ctx)
+        self.upload = upload
+        # スプールに書いたbyte数と、そのうちアップロード済みのbyte数
+        self.size = 0
+        self.uploaded = 0
+        self._fd: int | None = None
+        self._uploading: asyncio.Task | None = None
+
+    @property
+    def frames(self) -> int:
+        return self.size // self.frame_bytes
+
+    async def __aenter__(self) -> "PcmArtifactStream":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def open(self) -> None:
+        """スプールを開く。受信済みの音声があれば、その続きから書く"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        local = os.fstat(self._fd).st_size
+
+        # 先頭から途切れずにアップロードされている範囲
+        uploaded = []
+        for offset, size in await self.upload.list_chunks():
+            if offset != sum(s for _, s in uploaded):
+                break
+            uploaded.append((offset, size))
+        remote = sum(size for _, size in uploaded)
+        if remote > local:
+            logger.info(f"restore spool of {self.filename} from {len(uploaded)} uploaded chunks")
+            for offset, _ in uploaded:
+                os.pwrite(self._fd, await self.upload.download(offset), offset)
+            local = remote
+
+        # 途中で切れたフレームは捨てる
+        self.size = local // self.frame_bytes * self.frame_bytes
+        os.ftruncate(self._fd, self.size)
+        self.uploaded = min(remote, self.size)
+        if self.size:
+            logger.info(f"resume {self.filename} from {self.frames} frames")
+
+    def write(self, data: bytes | memoryview) -> int:
+        """チャンクを追記し、書いたbyte数を返す。アップロードしていない分がchunk_bytes以上溜まったらアップロードを始める"""
+        written = os.pwrite(self._fd, data, self.size)
+        self.size += written
+        if self.size - self.uploaded >= self.chunk_bytes and (self._uploading is None or self._uploading.done()):
+            self._uploading = asyncio.create_task(self._upload_chunks())
+        return written
+
+    async def _upload_chunks(self) -> None:
+        """溜まった分をchunk_bytesずつアップロードする。失敗した場合は次のwriteでやり直す"""
+        try:
+            while self.size - self.uploaded >= self.chunk_bytes:
+                data = await asyncio.to_thread(os.pread, self._fd, self.chunk_bytes, self.uploaded)
+                await self.upload.upload(self.uploaded, data)
+                self.uploaded += len(data)
+        except Exception:
+            logger.exception(f"failed to upload chunk of {self.filename} at {self.uploaded}")
+
+    def samples(self) -> np.ndarray:
+        """スプールの完全なフレームを (frames, channels) のint16の配列として返す。memmapなのでメモリに読まない"""
+        if self.frames == 0:
+            return np.zeros((0, self.channels), dtype=np.int16)
+        return np.memmap(self.path, dtype="<i2", mode="r", shape=(self.frames, self.channels))
+
+    async def finalize(self, samples: np.ndarray, loudness: LoudnessStats | None = None, metadata: dict[str, Any] | None = None) -> int | None:
+        """samples(samples()から切り出した範囲など)を生PCMのアーティファクトとして保存し、スプールとアップロード済みのチャンクを消す"""
+        path = f"{self.path}.final"
+        try:
+            await asyncio.to_thread(write_pcm, path, samples, self.frame_rate, loudness, metadata)
+            version = await self.upload.save(path, self.filename)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        await self.discard()
+        return version
+
+    async def copy(self, filename: str) -> int | None:
+        """保存したアーティファクトを別のfilenameにも保存する"""
+        return await self.upload.copy(self.filename, filename)
+
+    async def close(self) -> None:
+        """アップロード中のチャンクを待ってスプールを閉じる。スプールは消さない"""
+        if self._uploading is not None:
+            await self._uploading
+            self._uploading = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    async def discard(self) -> None:
+        """スプールとアップロード済みのチャンクを消す"""
+        await self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        await self.upload.discard()
+        self.size = self.uploaded = 0
@@ -13,26 +13,74 @@
 # limitations under the License.
 
 import io
+import wave
 
+import numpy as np
 from pydub import AudioSegment
 
 from radio_station.utils.env import is_run_on_agent_engine
 
+# Agent Engineに同梱しているffmpeg
+AGENT_ENGINE_FFMPEG = "radio_station/ffmpeg-7.0.2-amd64-static/ffmpeg"
+
+# PCMのサンプル幅(byte)とnumpyのdtypeの対応
+_SAMPLE_WIDTH_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+def ffmpeg_path() -> str:
+    return AGENT_ENGINE_FFMPEG if is_run_on_agent_engine() else AudioSegment.converter
+
 
 def convert_mp3(audio_segment: AudioSegment, bitrate="96k") -> bytes:
     out = io.BytesIO()
     if is_run_on_agent_engine():
-        audio_segment.converter = "radio_station/ffmpeg-7.0.2-amd64-static/ffmpeg"
+        audio_segment.converter = AGENT_ENGINE_FFMPEG
 
     audio_segment.export(out, format="mp3", bitrate=bitrate)
     return out.getvalue()
 
 
-def export_wav(audio_segment: AudioSegment) -> bytes:
-    out = io.BytesIO()
-    if is_run_on_agent_engine():
-        audio_segment.converter = "radio_station/ffmpeg-7.0.2-amd64-static/ffmpeg"
+def pcm16_to_mp3(pcm: bytes, frame_rate: int, channels: int, bitrate: str = "96k") -> bytes:
+    """16bitの生PCMをMP3にする。共有のプロセスプール(run_audio)へ渡せるよう、byte列とフォーマットだけを受け取る"""
+    return convert_mp3(AudioSegment(data=pcm, sample_width=2, frame_rate=frame_rate, channels=channels), bitrate)
 
-    audio_segment = audio_segment.set_frame_rate(22050)
-    audio_segment.export(out, format="wav")
-    return out.getvalue()
+
+def read_wav(data: bytes) -> tuple[np.ndarray, int]:
+    """WAVのbyte列を (frames, channels) の整数PCM配列とフレームレートにする。float変換はしない"""
+    with wave.open(io.BytesIO(data), "rb") as w:
+        sample_width = w.getsampwidth()
+        channels = w.getnchannels()
+        frame_rate = w.getframerate()
+        frames = w.readframes(w.getnframes())
+
+    if sample_width not in _SAMPLE_WIDTH_DTYPES:
+        raise ValueError(f"unsupported sample width: {sample_width}")
+
+    return np.frombuffer(frames, dtype=_SAMPLE_WIDTH_DTYPES[sample_width]).reshape(-1, channels), frame_rate
+
+
+def to_float32(samples: np.ndarray) -> np.ndarray:
+    """整数PCMを -1.0〜1.0 のfloat32にする。float32の場合はそのまま返す"""
+    if samples.dtype == np.float32:
+        return samples
+    if samples.dtype == np.uint8:
+        # 8bitのPCMは符号なし
+        return (samples.astype(np.float32) - 128.0) / 128.0
+    if np.issubdtype(samples.dtype, np.integer):
+        return samples.astype(np.float32) / float(np.iinfo(samples.dtype).max + 1)
+    return samples.astype(np.float32)
+
+
+def to_pcm16(samples: np.ndarray) -> np.ndarray:
+    """-1.0〜1.0 のfloat配列をリトルエンディアンの16bit PCMにする"""
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2")
+
+
+def dbfs(samples: np.ndarray) -> float:
+    """AudioSegment.dBFSと同じ定義(全チャンネルのRMS)でdBFSを計算する"""
+    if samples.size == 0:
+        return -float("inf")
+    rms = float(np.sqrt(np.mean(np.square(to_float32(samples), dtype=np.float64))))
+    if rms == 0:
+        return -float("inf")
+    return float(20 * np.log10(rms))
@@ -0,0 +1,95 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""音声処理を実行する共有のプロセスプール
+
+デコード・エンコード・解析などCPUを使う処理をエージェントのasyncメソッドで直接実行すると、
+同じ呼び出しで並行に動いている他のエージェント(TTSやLyriaのストリーミング)まで止まってしまう。
+各エージェントはrun_audioで処理をプロセスプールへ渡し、イベントループでは結果を待つだけにする。
+
+プールへ渡す関数と引数はpickleできる必要がある(モジュールの関数、numpy配列、byte列など)。
+番組全体のバッファのようにコピーしたくない配列を扱う処理はasyncio.to_threadを使う。
+"""
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_AUDIO_EXECUTOR_WORKERS = min(4, os.cpu_count() or 1)
+
+_lock = threading.Lock()
+_executor: ProcessPoolExecutor | None = None
+# configure_audio_executorで指定したワーカー数。Noneは環境変数に従う
+_configured_workers: int | None = None
+
+
+def audio_executor_workers() -> int:
+    """プロセスプールのワーカー数。環境変数 AUDIO_EXECUTOR_WORKERS で変更でき、0の場合はプロセスを使わずスレッドで実行する"""
+    if _configured_workers is not None:
+        return _configured_workers
+    return int(os.environ.get("AUDIO_EXECUTOR_WORKERS", DEFAULT_AUDIO_EXECUTOR_WORKERS))
+
+
+def audio_executor() -> ProcessPoolExecutor | None:
+    """共有のプロセスプール。最初に使う時に作る。ワーカー数が0の場合はNone"""
+    global _executor
+    with _lock:
+        if _executor is None and audio_executor_workers() > 0:
+            # ADKやgRPCのスレッドを持つプロセスをforkしないよう、ワーカーはspawnで起動する
+            _executor = ProcessPoolExecutor(max_workers=audio_executor_workers(), mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"start audio executor: {audio_executor_workers()} workers")
+        return _executor
+
+
+def shutdown_audio_executor(wait: bool = True) -> None:
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def configure_audio_executor(workers: int | None) -> None:
+    """ワーカー数を変える。Noneで環境変数の値に戻す。作成済みのプールは終了し、次に使う時に作り直す"""
+    global _configured_workers
+    shutdown_audio_executor()
+    _configured_workers = workers
+
+
+async def run_audio(func: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """funcを共有のプロセスプールで実行し、結果を待つ"""
+    global _executor
+    executor = audio_executor()
+    if executor is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args, **kwargs))
+    except BrokenProcessPool:
+        # ワーカーが異常終了(メモリ不足など)したプールは使えないので、次の呼び出しのために作り直す
+        logger.exception(f"audio executor is broken while running {getattr(func, '__name__', func)}")
+        with _lock:
+            if _executor is executor:
+                _executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
@@ -0,0 +1,56 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""パイプラインの音声フォーマットの方針
+
+音源は生成された時のフレームレート(TTSは24kHz、Lyriaは48kHz)のまま保存し、
+ミックスの直前にマスターのフレームレートへポリフェーズフィルタで1回だけ変換する。
+"""
+
+import math
+import os
+
+import numpy as np
+from scipy.signal import resample_poly
+
+from radio_station.utils.audio import to_float32
+
+# Lyriaの出力と同じにして、音楽はリサンプルせずにミックスする
+DEFAULT_MASTER_FRAME_RATE = 48000
+
+
+def master_frame_rate() -> int:
+    """番組をミックス・マスタリングするフレームレート。環境変数 MASTER_FRAME_RATE で変更できる"""
+    return int(os.environ.get("MASTER_FRAME_RATE", DEFAULT_MASTER_FRAME_RATE))
+
+
+def _ratio(src_rate: int, dst_rate: int) -> tuple[int, int]:
+    divisor = math.gcd(src_rate, dst_rate)
+    return dst_rate // divisor, src_rate // divisor
+
+
+def resampled_length(frames: int, src_rate: int, dst_rate: int) -> int:
+    """resampleした後のフレーム数"""
+    if src_rate == dst_rate:
+        return frames
+    up, down = _ratio(src_rate, dst_rate)
+    return -(-frames * up // down)
+
+
+def resample(samples: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """(frames, channels) の配列のフレームレートをポリフェーズフィルタで変換する。同じフレームレートの場合はそのまま返す"""
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    up, down = _ratio(src_rate, dst_rate)
+    return resample_poly(to_float32(samples), up, down, axis=0).astype(np.float32, copy=False)
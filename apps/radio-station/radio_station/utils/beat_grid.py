@@ -0,0 +1,155 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""生成した音楽のビートグリッド(テンポと小節の頭の位置)の推定
+
+スペクトルフラックスでオンセットの強さを求め、自己相関でテンポを、くし形の重ね合わせで拍と小節の頭の位相を推定する。
+推定結果は音源のアーティファクトに保存し、トリミングやミックスではフレーム位置だけを使う。
+"""
+
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from pydantic import BaseModel
+
+from radio_station.utils.audio import to_float32
+
+# オンセットの強さを求める間隔と窓の長さ(秒)
+_HOP_SECONDS = 0.01
+_WINDOW_HOPS = 4
+# スペクトルを計算する単位(オンセットのフレーム数)。長い音源でもメモリを使い過ぎないようにする
+_CHUNK_HOPS = 256
+# 推定するテンポの範囲
+_MIN_BPM = 60.0
+_MAX_BPM = 200.0
+# テンポの事前分布(対数2を単位とする標準偏差)。ヒントが無い場合は120BPMを中心にする
+_DEFAULT_BPM = 120.0
+_HINT_OCTAVE_SIGMA = 0.2
+_DEFAULT_OCTAVE_SIGMA = 1.0
+
+
+class BeatGrid(BaseModel):
+    """音源のビートグリッド。位置はすべて音源のフレーム単位"""
+
+    frame_rate: int
+    bpm: float
+    beats_per_bar: int = 4
+    # 最初の小節の頭
+    first_downbeat: int
+    # 1小節のフレーム数
+    bar_frames: float
+    # 音源に含まれる小節の数。トリミング済みの場合だけ持つ
+    bars: int | None = None
+
+    def downbeat(self, bar: int) -> int:
+        """bar番目の小節の頭のフレーム位置"""
+        return self.first_downbeat + int(round(bar * self.bar_frames))
+
+    def bars_to_frames(self, bars: float, frame_rate: int | None = None) -> int:
+        """bars小節分のフレーム数。frame_rateを渡すとそのフレームレートでのフレーム数にする"""
+        return int(round(bars * self.bar_frames * (frame_rate or self.frame_rate) / self.frame_rate))
+
+
+def onset_strength(samples: np.ndarray, frame_rate: int) -> tuple[np.ndarray, int]:
+    """対数振幅スペクトルの増加分(スペクトルフラックス)を (強さ, 間隔のフレーム数) で返す
+
+    モノラルへの変換もスペクトルと同じく_CHUNK_HOPSずつ行うので、memmapの音源も全体をfloatにしない。
+    """
+    hop = max(1, int(round(_HOP_SECONDS * frame_rate)))
+    window = hop * _WINDOW_HOPS
+    if len(samples) < window:
+        return np.zeros(0, dtype=np.float32), hop
+
+    count = (len(samples) - window) // hop + 1
+    taper = np.hanning(window).astype(np.float32)
+    previous = None
+    flux = []
+    for start in range(0, count, _CHUNK_HOPS):
+        hops = min(_CHUNK_HOPS, count - start)
+        mono = to_float32(samples[start * hop : (start + hops - 1) * hop + window]).mean(axis=1)
+        # 窓はコピーせずにビューで切り出す
+        frames = sliding_window_view(mono, window)[::hop]
+        spectrum = np.log1p(100 * np.abs(np.fft.rfft(frames * taper, axis=1))).astype(np.float32)
+        if previous is not None:
+            spectrum = np.concatenate([previous, spectrum])
+        flux.append(np.maximum(np.diff(spectrum, axis=0), 0).sum(axis=1))
+        previous = spectrum[-1:]
+    strength = np.concatenate([np.zeros(1, dtype=np.float32), *flux])
+    return strength - strength.mean(), hop
+
+
+def estimate_tempo(strength: np.ndarray, hop_seconds: float, bpm_hint: float | None = None) -> float:
+    """オンセットの強さの自己相関からテンポ(BPM)を推定する"""
+    lags = np.arange(max(1, int(60 / _MAX_BPM / hop_seconds)), int(60 / _MIN_BPM / hop_seconds) + 2)
+    if len(strength) <= lags[-1] + 1:
+        return bpm_hint or _DEFAULT_BPM
+
+    spectrum = np.fft.rfft(strength, 2 * len(strength))
+    autocorrelation = np.fft.irfft(np.abs(spectrum) ** 2)[: len(strength)]
+    bpms = 60 / (lags * hop_seconds)
+    center, sigma = (bpm_hint, _HINT_OCTAVE_SIGMA) if bpm_hint else (_DEFAULT_BPM, _DEFAULT_OCTAVE_SIGMA)
+    weighted = autocorrelation[lags] * np.exp(-0.5 * (np.log2(bpms / center) / sigma) ** 2)
+
+    best = int(np.argmax(weighted))
+    lag = float(lags[best])
+    if 0 < best < len(lags) - 1:
+        # 放物線補間で1フレームより細かくする
+        left, middle, right = autocorrelation[lags[best - 1 : best + 2]]
+        denominator = left - 2 * middle + right
+        if denominator < 0:
+            lag += 0.5 * (left - right) / denominator
+    return float(60 / (lag * hop_seconds))
+
+
+def _comb(strength: np.ndarray, phases: np.ndarray, period: float) -> np.ndarray:
+    """各位相から周期periodで並ぶ位置のオンセットの強さの平均"""
+    count = max(1, int((len(strength) - phases.max() - 1) // period) + 1)
+    positions = np.rint(phases[:, None] + np.arange(count)[None, :] * period).astype(int)
+    valid = positions < len(strength)
+    return np.where(valid, strength[np.minimum(positions, len(strength) - 1)], 0).sum(axis=1) / valid.sum(axis=1)
+
+
+def analyze_beats(samples: np.ndarray, frame_rate: int, bpm_hint: float | None = None, beats_per_bar: int = 4) -> BeatGrid:
+    """音源のテンポと最初の小節の頭を推定する。bpm_hintは生成時に指定したBPMなど、テンポの目安"""
+    strength, hop = onset_strength(samples, frame_rate)
+    bpm = estimate_tempo(strength, hop / frame_rate, bpm_hint)
+    period = 60 / bpm * frame_rate / hop
+    bar_frames = 60 / bpm * beats_per_bar * frame_rate
+    if len(strength) < 2 * period:
+        return BeatGrid(frame_rate=frame_rate, bpm=bpm, beats_per_bar=beats_per_bar, first_downbeat=0, bar_frames=bar_frames)
+
+    # 拍の位相: 1拍の中で、周期的にオンセットが最も強くなる位置。前後の位相との放物線補間で1フレームより細かくする
+    phases = np.arange(int(math.ceil(period)) + 2) - 1
+    scores = _comb(strength, np.maximum(phases, 0), period)
+    best = int(np.argmax(scores[1:-1])) + 1
+    left, middle, right = scores[best - 1 : best + 2]
+    denominator = left - 2 * middle + right
+    beat_phase = phases[best] + (0.5 * (left - right) / denominator if denominator < 0 else 0.0)
+    # 小節の頭: 1小節の中の拍のうち、小節の周期で見て最も強い拍
+    beats = beat_phase + np.arange(beats_per_bar) * period
+    downbeat = float(beats[np.argmax(_comb(strength, np.rint(beats).astype(int), period * beats_per_bar))])
+
+    # スペクトルフラックスは窓の中央の変化を捉えるので、窓の長さの半分だけ後ろにずらす
+    first_downbeat = int(round(max(0.0, downbeat) * hop + hop * _WINDOW_HOPS / 2))
+    return BeatGrid(frame_rate=frame_rate, bpm=bpm, beats_per_bar=beats_per_bar, first_downbeat=first_downbeat, bar_frames=bar_frames)
+
+
+def trim_to_bars(samples: np.ndarray, grid: BeatGrid) -> tuple[np.ndarray, BeatGrid]:
+    """最初の小節の頭から、収まる最後の小節の終わりまでを切り出す(コピーしない)。切り出した音源のグリッドも返す"""
+    bars = int((len(samples) - grid.first_downbeat) // grid.bar_frames)
+    if bars <= 0:
+        return samples, grid
+    trimmed = samples[grid.first_downbeat : grid.downbeat(bars)]
+    return trimmed, grid.model_copy(update={"first_downbeat": 0, "bars": bars})
@@ -0,0 +1,98 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""GcsArtifactServiceのバケットへアーティファクトを直接書き込む
+
+GcsArtifactServiceはbytesのPartしか保存できないので、大きな音声をファイルから保存したりバケットの中でコピーしたりできない。
+また、バージョンを数えてから条件無しで書き込むので、同時に保存すると同じバージョンを上書きし合う。
+オブジェクトの名前の付け方はADKの実装に合わせたもので、このモジュールだけが知っている。
+ADKが名前の付け方を変えた場合は、GcsArtifactServiceのload_artifactとlist_versionsで読み戻すテストが失敗する。
+"""
+
+import asyncio
+import logging
+from collections.abc import Callable
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.artifacts import GcsArtifactService
+from google.api_core.exceptions import PreconditionFailed
+
+logger = logging.getLogger(__name__)
+
+# 同じバージョンを別の書き込みに取られた場合に、次のバージョンでやり直す回数
+SAVE_ATTEMPTS = 5
+
+
+class GcsArtifactWriter:
+    """1つのセッションのアーティファクトを、GcsArtifactServiceが読める名前のオブジェクトとして作る
+
+    どの書き込みも、オブジェクトが無い場合だけ作る(if_generation_match=0)。同じバージョンが先に作られていた場合は、
+    バージョンを数え直して次のバージョンで作り直すので、このクラスを通した保存同士は上書きし合わない。
+    """
+
+    def __init__(self, service: GcsArtifactService, app_name: str, user_id: str, session_id: str):
+        self.service = service
+        self.app_name = app_name
+        self.user_id = user_id
+        self.session_id = session_id
+
+    @classmethod
+    def of(cls, ctx: InvocationContext) -> "GcsArtifactWriter | None":
+        """ctxのアーティファクトサービスがGcsArtifactServiceであれば、そのセッションのWriter。それ以外はNone"""
+        if not isinstance(ctx.artifact_service, GcsArtifactService):
+            return None
+        return cls(ctx.artifact_service, ctx.session.app_name, ctx.session.user_id, ctx.session.id)
+
+    def blob_name(self, filename: str, version: int) -> str:
+        """GcsArtifactServiceと同じ {app}/{user}/{session}/{filename}/{version} の名前。"user:" で始まるfilenameはsessionの代わりに "user" の下に置かれる"""
+        scope = "user" if filename.startswith("user:") else self.session_id
+        return f"{self.app_name}/{self.user_id}/{scope}/{filename}/{version}"
+
+    async def list_versions(self, filename: str) -> list[int]:
+        return await self.service.list_versions(app_name=self.app_name, user_id=self.user_id, session_id=self.session_id, filename=filename)
+
+    async def _create(self, filename: str, write: Callable[[str], None]) -> int:
+        """次のバージョンの名前でwriteを呼び、そのバージョンを返す。writeはif_generation_match=0で書き込む"""
+        for _ in range(SAVE_ATTEMPTS):
+            versions = await self.list_versions(filename)
+            version = max(versions) + 1 if versions else 0
+            try:
+                await asyncio.to_thread(write, self.blob_name(filename, version))
+                return version
+            except PreconditionFailed:
+                logger.info(f"version {version} of {filename} was created concurrently, retry with the next version")
+        raise RuntimeError(f"failed to save {filename} after {SAVE_ATTEMPTS} attempts.")
+
+    async def save_bytes(self, filename: str, data: bytes, mime_type: str) -> int:
+        def write(name: str) -> None:
+            self.service.bucket.blob(name).upload_from_string(data, content_type=mime_type, if_generation_match=0)
+
+        return await self._create(filename, write)
+
+    async def save_file(self, filename: str, path: str, mime_type: str, chunk_size: int | None = None) -> int:
+        """ファイルをメモリに読まずに保存する。chunk_sizeを指定するとchunk_sizeずつのresumable uploadになる"""
+
+        def write(name: str) -> None:
+            self.service.bucket.blob(name, chunk_size=chunk_size).upload_from_filename(path, content_type=mime_type, if_generation_match=0)
+
+        return await self._create(filename, write)
+
+    async def copy(self, source: str, filename: str) -> int | None:
+        """sourceの最新のバージョンをバケットの中でfilenameの新しいバージョンにコピーする。sourceが無い場合はNone"""
+        versions = await self.list_versions(source)
+        if not versions:
+            return None
+        bucket = self.service.bucket
+        blob = bucket.blob(self.blob_name(source, max(versions)))
+        return await self._create(filename, lambda name: bucket.copy_blob(blob, bucket, name, if_generation_match=0))
@@ -0,0 +1,230 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""ITU-R BS.1770 / EBU R128 のラウドネス測定"""
+
+import hashlib
+
+import numpy as np
+from pydantic import BaseModel, ConfigDict
+from scipy.signal import resample_poly, sosfilt
+
+from radio_station.utils.audio import to_float32
+from radio_station.utils.beat_grid import BeatGrid
+
+# ポッドキャスト配信用のラウドネスとトゥルーピークの目標値
+TARGET_LOUDNESS = -16.0
+TARGET_TRUE_PEAK = -1.0
+
+# ゲーティングの単位(100ms)。測定ブロックは400msで75%ずつ重ねる
+_STEP_SECONDS = 0.1
+_BLOCK_STEPS = 4
+_ABSOLUTE_GATE = -70.0
+_RELATIVE_GATE = -10.0
+# トゥルーピーク測定のオーバーサンプリング倍率と、ブロックの前後に付ける文脈のフレーム数
+_OVERSAMPLING = 4
+_TRUE_PEAK_CONTEXT = 32
+# analyzeで測定器へ渡す単位(フレーム数)。memmapの音源も全体をfloatにせずに測定する
+ANALYZE_BLOCK_FRAMES = 1 << 16
+
+
+def k_weighting(frame_rate: int) -> np.ndarray:
+    """任意のフレームレートのK特性フィルタ(高域シェルフ + 高域通過)を2次セクションで返す
+
+    BS.1770の48kHzの係数を再現するアナログ原型から双一次変換で求める(libebur128と同じ)。
+    """
+    f0 = 1681.974450955533
+    gain_db = 3.999843853973347
+    q = 0.7071752369554196
+    k = np.tan(np.pi * f0 / frame_rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh**0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    f0 = 38.13547087602444
+    q = 0.5003270373238773
+    k = np.tan(np.pi * f0 / frame_rate)
+    a0 = 1 + k / q + k * k
+    high_pass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, high_pass])
+
+
+def _power_to_lufs(power: np.ndarray | float) -> np.ndarray:
+    with np.errstate(divide="ignore"):
+        return -0.691 + 10 * np.log10(power)
+
+
+def _oversampled_peak(samples: np.ndarray, start: int, stop: int) -> float:
+    """samples[start:stop] のオーバーサンプリング後のピーク。前後のフレームは補間の文脈として使う"""
+    oversampled = resample_poly(samples, _OVERSAMPLING, 1, axis=0)[start * _OVERSAMPLING : stop * _OVERSAMPLING]
+    # 補間フィルタの誤差でサンプルピークを下回らないようにする
+    return max(float(np.max(np.abs(oversampled))), float(np.max(np.abs(samples[start:stop]))))
+
+
+def _to_db(value: float) -> float:
+    return float(20 * np.log10(value)) if value > 0 else -float("inf")
+
+
+class LoudnessStats(BaseModel):
+    """音源のラウドネス統計。無音の場合は -inf になる"""
+
+    model_config = ConfigDict(ser_json_inf_nan="constants")
+
+    # 統合ラウドネス(LUFS)
+    integrated: float
+    # トゥルーピーク(dBTP)
+    true_peak: float
+    # 全チャンネルのRMS(dBFS)。AudioSegment.dBFSと同じ定義
+    rms: float
+    # 測定した音源の内容のハッシュ。音源が作り直された場合に古い統計を使わないために持つ
+    source_hash: str | None = None
+    # 測定した音源のアーティファクトのバージョン。音源をダウンロードせずに統計が最新か確かめるために持つ
+    source_version: int | None = None
+    # 測定した音源の形式
+    frame_rate: int | None = None
+    frames: int | None = None
+    channels: int | None = None
+    # 音楽のビートグリッド。作曲時に推定したものを持ち回し、ミックス時には推定し直さない
+    beat_grid: BeatGrid | None = None
+
+
+class LoudnessMeter:
+    """ブロック単位で音声を受け取り、統合ラウドネス・トゥルーピーク・RMSを測定する
+
+    K特性フィルタの状態と100ms単位のエネルギーを引き継ぐので、分割して渡しても一括で渡した場合と同じ統合ラウドネスになる。
+    トゥルーピークはブロックの前後に文脈を付けてオーバーサンプリングし、末尾の文脈分は次のブロックで評価する。
+    """
+
+    def __init__(self, frame_rate: int):
+        self.frame_rate = frame_rate
+        self._sos = k_weighting(frame_rate)
+        self._step = max(1, int(round(_STEP_SECONDS * frame_rate)))
+        self._zi: np.ndarray | None = None
+        # 100ms未満の端数の2乗値
+        self._remainder: np.ndarray | None = None
+        # 100msごとのチャンネル別エネルギー(2乗和)
+        self._steps: list[np.ndarray] = []
+        self._square_sum = 0.0
+        self._sample_count = 0
+        self._frames = 0
+        self._channels: int | None = None
+        self._peak = 0.0
+        # トゥルーピークを未評価のフレーム(先頭の_peak_context分は評価済みの文脈)
+        self._peak_buffer: np.ndarray | None = None
+        self._peak_context = 0
+
+    def process(self, samples: np.ndarray) -> None:
+        if len(samples) == 0:
+            return
+        samples = to_float32(samples).astype(np.float64)
+        channels = samples.shape[1]
+
+        self._square_sum += float(np.sum(np.square(samples)))
+        self._sample_count += samples.size
+        self._frames += len(samples)
+        self._channels = channels
+
+        if self._zi is None:
+            self._zi = np.zeros((len(self._sos), 2, channels))
+        weighted, self._zi = sosfilt(self._sos, samples, axis=0, zi=self._zi)
+        squared = np.square(weighted)
+        if self._remainder is not None:
+            squared = np.concatenate([self._remainder, squared])
+        full = len(squared) // self._step * self._step
+        if full:
+            self._steps.append(squared[:full].reshape(-1, self._step, channels).sum(axis=1))
+        self._remainder = squared[full:]
+
+        buffer = samples if self._peak_buffer is None else np.concatenate([self._peak_buffer, samples])
+        # 末尾は後続のフレームが無いと正しく補間できないので、文脈分を残して評価する
+        stop = len(buffer) - _TRUE_PEAK_CONTEXT
+        if stop > self._peak_context:
+            self._peak = max(self._peak, _oversampled_peak(buffer, self._peak_context, stop))
+            keep = max(0, stop - _TRUE_PEAK_CONTEXT)
+            buffer = buffer[keep:]
+            self._peak_context = stop - keep
+        self._peak_buffer = buffer
+
+    @property
+    def integrated(self) -> float:
+        if not self._steps:
+            return -float("inf")
+        steps = np.concatenate(self._steps)
+        if len(steps) < _BLOCK_STEPS:
+            return -float("inf")
+        # 400msブロックの平均2乗値 (blocks, channels)
+        cumsum = np.concatenate([np.zeros((1, steps.shape[1])), np.cumsum(steps, axis=0)])
+        blocks = (cumsum[_BLOCK_STEPS:] - cumsum[:-_BLOCK_STEPS]) / (self._step * _BLOCK_STEPS)
+        # L/R/Cの重み付けはすべて1.0
+        power = blocks.sum(axis=1)
+        gated = power[_power_to_lufs(power) > _ABSOLUTE_GATE]
+        if len(gated) == 0:
+            return -float("inf")
+        threshold = _power_to_lufs(np.mean(gated)) + _RELATIVE_GATE
+        gated = gated[_power_to_lufs(gated) > threshold]
+        return float(_power_to_lufs(np.mean(gated)))
+
+    @property
+    def true_peak(self) -> float:
+        peak = self._peak
+        if self._peak_buffer is not None and len(self._peak_buffer) > self._peak_context:
+            # 残りは音声の終端なので、後ろを無音として評価する
+            peak = max(peak, _oversampled_peak(self._peak_buffer, self._peak_context, len(self._peak_buffer)))
+        return _to_db(peak)
+
+    @property
+    def rms(self) -> float:
+        if self._sample_count == 0:
+            return -float("inf")
+        return _to_db(float(np.sqrt(self._square_sum / self._sample_count)))
+
+    def stats(self, source_hash: str | None = None) -> LoudnessStats:
+        return LoudnessStats(
+            integrated=self.integrated,
+            true_peak=self.true_peak,
+            rms=self.rms,
+            source_hash=source_hash,
+            frame_rate=self.frame_rate,
+            frames=self._frames,
+            channels=self._channels,
+        )
+
+
+def analyze(samples: np.ndarray, frame_rate: int, source_hash: str | None = None) -> LoudnessStats:
+    """ANALYZE_BLOCK_FRAMESずつ測定器へ渡すので、作業用の配列は音源の長さによらずブロックの大きさに収まる"""
+    meter = LoudnessMeter(frame_rate)
+    for start in range(0, len(samples), ANALYZE_BLOCK_FRAMES):
+        meter.process(samples[start : start + ANALYZE_BLOCK_FRAMES])
+    return meter.stats(source_hash)
+
+
+def loudness_artifact_key(artifact_key: str) -> str:
+    """音源のアーティファクトに対応する、ラウドネス統計を保存するアーティファクトのキー"""
+    return f"{artifact_key}.loudness.json"
+
+
+def hash_source(data: bytes) -> str:
+    """音源のbyte列から統計のキャッシュの照合に使うハッシュを作る"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def loudness_gain(stats: LoudnessStats, target: float = TARGET_LOUDNESS, true_peak: float = TARGET_TRUE_PEAK) -> float:
+    """統合ラウドネスをtargetに揃えるゲイン(倍率)。トゥルーピークがtrue_peakを超える場合はそこまでに抑える"""
+    if not np.isfinite(stats.integrated):
+        return 1.0
+    gain_db = target - stats.integrated
+    if np.isfinite(stats.true_peak):
+        gain_db = min(gain_db, true_peak - stats.true_peak)
+    return float(10 ** (gain_db / 20))
@@ -0,0 +1,137 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""音源のアーティファクトに使う生PCM形式
+
+WAVへのエンコード・デコード(とffmpegの起動)を省くため、固定長のヘッダとJSONのメタデータの後にPCMをそのまま並べる。
+
+    magic(4) version(2) header_size(2) frame_rate(4) channels(2) sample_format(1) reserved(1) frames(8) metadata_size(4)
+    metadata(JSON, metadata_size) padding(header_sizeまで)
+    payload(リトルエンディアンのPCM, frames * channels)
+
+ペイロードの開始位置は16byte境界に揃えるので、np.frombufferでコピーせずに読める。
+"""
+
+import json
+import struct
+from enum import Enum
+from typing import Any
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from radio_station.utils.audio import read_wav
+from radio_station.utils.loudness import LoudnessStats
+
+PCM_MAGIC = b"RPCM"
+PCM_FORMAT_VERSION = 1
+PCM_MIME_TYPE = "audio/x-radio-station-pcm"
+
+_HEADER = struct.Struct("<4sHHIHBxQI")
+_ALIGNMENT = 16
+
+
+class SampleFormat(int, Enum):
+    S16LE = 1
+    F32LE = 2
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype("<i2") if self is SampleFormat.S16LE else np.dtype("<f4")
+
+
+class PcmHeader(BaseModel):
+    """生PCMのアーティファクトのヘッダ"""
+
+    frame_rate: int
+    channels: int
+    sample_format: SampleFormat
+    frames: int
+    # 書き込み時に測定したラウドネス統計
+    loudness: LoudnessStats | None = None
+    # 形式ごとの付加情報(ステムのスケールなど)
+    metadata: dict[str, Any] = Field(default_factory=dict)
+
+
+def _sample_format(samples: np.ndarray) -> SampleFormat:
+    if samples.dtype == np.int16:
+        return SampleFormat.S16LE
+    if samples.dtype == np.float32:
+        return SampleFormat.F32LE
+    raise ValueError(f"unsupported sample dtype: {samples.dtype}")
+
+
+def encode_pcm_header(samples: np.ndarray, frame_rate: int, loudness: LoudnessStats | None = None, metadata: dict[str, Any] | None = None) -> bytes:
+    """samplesを並べる前のヘッダ・メタデータ・パディングのbyte列"""
+    body = json.dumps(
+        {"loudness": loudness.model_dump(mode="json") if loudness is not None else None, "metadata": metadata or {}},
+        # -infの統計をそのまま書けるようにする
+        allow_nan=True,
+    ).encode()
+    header_size = -(-(_HEADER.size + len(body)) // _ALIGNMENT) * _ALIGNMENT
+    header = _HEADER.pack(PCM_MAGIC, PCM_FORMAT_VERSION, header_size, frame_rate, samples.shape[1], _sample_format(samples).value, len(samples), len(body))
+    return b"".join([header, body, bytes(header_size - _HEADER.size - len(body))])
+
+
+def encode_pcm(samples: np.ndarray, frame_rate: int, loudness: LoudnessStats | None = None, metadata: dict[str, Any] | None = None) -> bytes:
+    """(frames, channels) のint16/float32配列を生PCMのbyte列にする"""
+    payload = np.ascontiguousarray(samples, dtype=_sample_format(samples).dtype)
+    return b"".join([encode_pcm_header(samples, frame_rate, loudness, metadata), memoryview(payload).cast("B")])
+
+
+def write_pcm(path: str, samples: np.ndarray, frame_rate: int, loudness: LoudnessStats | None = None, metadata: dict[str, Any] | None = None, block_frames: int = 65536) -> int:
+    """encode_pcmと同じ内容をファイルに書き、書いたbyte数を返す。memmapの配列もblock_framesずつ書くので、全体をメモリに読まない"""
+    dtype = _sample_format(samples).dtype
+    with open(path, "wb") as f:
+        size = f.write(encode_pcm_header(samples, frame_rate, loudness, metadata))
+        for start in range(0, len(samples), block_frames):
+            size += f.write(memoryview(np.ascontiguousarray(samples[start : start + block_frames], dtype=dtype)).cast("B"))
+    return size
+
+
+def is_pcm(data: bytes | memoryview) -> bool:
+    return bytes(data[: len(PCM_MAGIC)]) == PCM_MAGIC
+
+
+def decode_pcm(data: bytes | memoryview) -> tuple[np.ndarray, PcmHeader]:
+    """生PCMのbyte列を、dataを参照する (frames, channels) の配列とヘッダにする。配列は読み取り専用"""
+    if len(data) < _HEADER.size or not is_pcm(data):
+        raise ValueError("not a raw pcm artifact")
+    magic, version, header_size, frame_rate, channels, sample_format, frames, metadata_size = _HEADER.unpack_from(data)
+    if version > PCM_FORMAT_VERSION:
+        raise ValueError(f"unsupported pcm format version: {version}")
+
+    body = json.loads(bytes(data[_HEADER.size : _HEADER.size + metadata_size]))
+    header = PcmHeader(
+        frame_rate=frame_rate,
+        channels=channels,
+        sample_format=SampleFormat(sample_format),
+        frames=frames,
+        loudness=body.get("loudness"),
+        metadata=body.get("metadata") or {},
+    )
+    samples = np.frombuffer(data, dtype=header.sample_format.dtype, count=frames * channels, offset=header_size)
+    return samples.reshape(frames, channels), header
+
+
+def read_audio(data: bytes | memoryview) -> tuple[np.ndarray, int, LoudnessStats | None]:
+    """音源のアーティファクトを (frames, channels) の配列・フレームレート・ラウドネス統計にする
+
+    生PCMの他に、以前の形式のWAVも読める。WAVには統計が無いのでNoneになる。
+    """
+    if is_pcm(data):
+        samples, header = decode_pcm(data)
+        return samples, header.frame_rate, header.loudness
+    samples, frame_rate = read_wav(bytes(data))
+    return samples, frame_rate, None
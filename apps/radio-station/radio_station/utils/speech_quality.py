@@ -0,0 +1,116 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""TTSの出力の品質チェック
+
+生PCMを短いフレームに区切ってエネルギーを一度だけ計算し、先頭・末尾・途中の無音、クリッピング、途中で切れた終わり方を調べる。
+TTSが失敗した場合(途中で黙る、発話の途中で止まるなど)に作り直すかどうかの判断に使う。
+"""
+
+import numpy as np
+from pydantic import BaseModel
+
+# エネルギーを求めるフレームの長さ
+FRAME_MS = 10
+# このレベル(dBFS)未満のフレームを無音とみなす
+SILENCE_THRESHOLD = -50.0
+# 先頭・末尾の無音と、途中の無音(発話の途切れ)の許容する長さ
+MAX_EDGE_SILENCE_MS = 2000
+MAX_PAUSE_MS = 2000
+# フルスケールに張り付いたサンプルの割合の上限
+MAX_CLIPPED_RATIO = 0.001
+# 末尾のこの長さの平均レベルがTRUNCATION_THRESHOLD(dBFS)を超えていれば、発話の途中で切れたとみなす
+TAIL_MS = 50
+TRUNCATION_THRESHOLD = -30.0
+
+_FULL_SCALE = 32767
+
+
+class SpeechQualityReport(BaseModel):
+    """音声の品質チェックの結果。時間はすべてms"""
+
+    duration_ms: int
+    leading_silence_ms: int
+    trailing_silence_ms: int
+    # 途中の無音のうちMAX_PAUSE_MS以上のもの。(開始, 終了) の一覧
+    dropouts: list[tuple[int, int]] = []
+    clipped_ratio: float = 0.0
+    # 末尾の音量が下がり切らずに終わっている
+    truncated: bool = False
+
+    def problems(self) -> list[str]:
+        """作り直しが必要な問題の一覧。問題が無ければ空"""
+        if self.duration_ms == 0:
+            return ["empty audio"]
+        problems = []
+        if self.leading_silence_ms >= MAX_EDGE_SILENCE_MS:
+            problems.append(f"leading silence {self.leading_silence_ms}ms")
+        if self.trailing_silence_ms >= MAX_EDGE_SILENCE_MS:
+            problems.append(f"trailing silence {self.trailing_silence_ms}ms")
+        if self.dropouts:
+            problems.append(f"dropouts {self.dropouts}")
+        if self.clipped_ratio > MAX_CLIPPED_RATIO:
+            problems.append(f"clipping {self.clipped_ratio:.2%}")
+        if self.truncated:
+            problems.append("truncated ending")
+        return problems
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems()
+
+
+def _frame_levels(pcm: np.ndarray, frame_rate: int) -> tuple[np.ndarray, int]:
+    """フレームごとのRMSのレベル(dBFS)と、フルスケールに張り付いたサンプルの数を返す。端数のフレームは切り捨てる"""
+    hop = max(1, frame_rate * FRAME_MS // 1000)
+    frames = pcm[: len(pcm) // hop * hop].reshape(-1, hop * pcm.shape[1])
+    power = np.square(frames, dtype=np.float32).mean(axis=1) / np.float32(_FULL_SCALE + 1) ** 2
+    with np.errstate(divide="ignore"):
+        levels = 10 * np.log10(power)
+    clipped = int(np.count_nonzero(frames >= _FULL_SCALE) + np.count_nonzero(frames <= -_FULL_SCALE))
+    return levels, clipped
+
+
+def _silent_runs(silent: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """無音のフレームが連続する区間の (開始, 終了) のフレーム番号"""
+    edges = np.diff(np.concatenate([[False], silent, [False]]).astype(np.int8))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def analyze_speech(pcm: bytes | np.ndarray, frame_rate: int, channels: int = 1) -> SpeechQualityReport:
+    """16bitの生PCM(byte列か (frames, channels) の配列)の品質を調べる。AudioSegmentや反転したコピーは作らず、フレームのエネルギーを1回だけ計算する"""
+    if not isinstance(pcm, np.ndarray):
+        pcm = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // (2 * channels) * channels).reshape(-1, channels)
+    duration_ms = len(pcm) * 1000 // frame_rate
+    levels, clipped = _frame_levels(pcm, frame_rate)
+    if len(levels) == 0:
+        return SpeechQualityReport(duration_ms=duration_ms, leading_silence_ms=duration_ms, trailing_silence_ms=duration_ms)
+
+    starts, ends = _silent_runs(levels < SILENCE_THRESHOLD)
+    leading = int(ends[0]) if len(starts) and starts[0] == 0 else 0
+    trailing = int(ends[-1] - starts[-1]) if len(ends) and ends[-1] == len(levels) else 0
+    # 先頭・末尾に接していない無音の区間
+    inner = (starts > 0) & (ends < len(levels)) & ((ends - starts) * FRAME_MS >= MAX_PAUSE_MS)
+
+    tail = levels[-max(1, TAIL_MS // FRAME_MS) :]
+    with np.errstate(divide="ignore"):
+        tail_level = 10 * np.log10(np.mean(10 ** (tail / 10)))
+    return SpeechQualityReport(
+        duration_ms=duration_ms,
+        leading_silence_ms=leading * FRAME_MS,
+        trailing_silence_ms=trailing * FRAME_MS,
+        dropouts=[(int(start) * FRAME_MS, int(end) * FRAME_MS) for start, end in zip(starts[inner], ends[inner], strict=True)],
+        clipped_ratio=clipped / pcm.size,
+        truncated=bool(trailing == 0 and tail_level > TRUNCATION_THRESHOLD),
+    )
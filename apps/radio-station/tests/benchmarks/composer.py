@@ -0,0 +1,203 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""ComposerFlowAgentとMasteringAgentの負荷テスト
+
+ローカルのLyriaのスタンドイン(lyria_server)に向けて、複数の番組の作曲を同時に動かし、続けてマスタリングする。
+音楽のプランは合成したものをstateに置くので、MusicPlanningAgent(LLM)は呼ばれない。
+共有のセッションの管理の制限(同時に開く数・開く頻度)と、作曲の並列実行の振る舞いを手元で確かめられる。
+
+    python -m tests.benchmarks.composer --programs 4 --minutes 3 --segments 4 --speed 8 --max-sessions 3
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from dataclasses import asdict, dataclass
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from radio_station.model.music_plan import LiveMusicGenerationConfig, MusicPlan, MusicStanza, WeightedPrompt
+from radio_station.state_keys import ComposerState, ProgramPlannerState, RecorderState
+from radio_station.sub_agents.composer.flow_agent import ComposerFlowAgent
+from radio_station.sub_agents.composer.lyria import LyriaSessionManager, SessionMetrics, configure_lyria_sessions
+from radio_station.sub_agents.mastering.agent import MasteringAgent
+from radio_station.sub_agents.mastering.scratch import ScratchSpace
+from radio_station.utils.audio_executor import configure_audio_executor
+from radio_station.utils.loudness import analyze
+from radio_station.utils.pcm import PCM_MIME_TYPE, encode_pcm
+from tests.benchmarks.lyria_server import StandInClient, StandInConfig, StandInLyriaServer
+from tests.benchmarks.mastering import SPEECH_FRAME_RATE, program_state, speech_like
+
+# 1つのスタンザの長さ(秒)
+_STANZA_SECONDS = 10
+
+
+@dataclass
+class LoadTestResult:
+    programs: int
+    minutes: float
+    segments: int
+    speed: float
+    max_sessions: int
+    # 番組ごとの作曲とマスタリングにかかった時間の最大値。全番組を同時に始める
+    compose_seconds: float
+    mastering_seconds: float
+    sessions: int
+    max_active_sessions: int
+    reconnects: int
+    filtered_prompts: int
+    # 作曲したセッションごとの計測値の中央値・最大値
+    time_to_first_chunk_p50: float | None
+    time_to_first_chunk_max: float | None
+    queued_max: float
+    bytes_per_second_p50: float
+
+
+def music_plan(seconds: float, bpm: int, prompt: str) -> MusicPlan:
+    """secondsの長さになるようにスタンザを並べたプラン"""
+    lengths = [_STANZA_SECONDS] * int(seconds // _STANZA_SECONDS)
+    if seconds % _STANZA_SECONDS or not lengths:
+        lengths.append(max(1, round(seconds % _STANZA_SECONDS)))
+    return MusicPlan(
+        title=prompt,
+        stanzas=[
+            MusicStanza(prompts=[WeightedPrompt(text=prompt, weight=1.0), WeightedPrompt(text=f"part {i}", weight=0.5)], seconds=s, config=LiveMusicGenerationConfig(bpm=bpm))
+            for i, s in enumerate(lengths)
+        ],
+    )
+
+
+async def program_context(agent: ComposerFlowAgent, session_service: InMemorySessionService, minutes: float, segments: int, seed: int) -> InvocationContext:
+    """トークの音声だけを置き、音楽のプランをstateに持つ番組のInvocationContext"""
+    state = program_state(minutes, segments)
+    # 作曲済みの番組として扱われないようにする
+    del state[ComposerState.TASK_IDS]
+    plan = ProgramPlannerState.get_program_structure(state)
+    for i, segment in enumerate(plan.segments):
+        state[ComposerState.task_music_plan(str(i + 1))] = music_plan(segment.segment_seconds, int(segment.music_bpm), f"program {seed} segment {i + 1}").model_dump()
+
+    session = await session_service.create_session(app_name="benchmark", user_id=f"benchmark_{seed}", state=state)
+    ctx = InvocationContext(session_service=session_service, artifact_service=InMemoryArtifactService(), invocation_id=f"benchmark_{seed}", agent=agent, session=session)
+    for i, segment in enumerate(plan.segments):
+        speech = speech_like(segment.segment_seconds, seed * 100 + i)
+        part = types.Part.from_bytes(data=encode_pcm(speech, SPEECH_FRAME_RATE, loudness=analyze(speech, SPEECH_FRAME_RATE)), mime_type=PCM_MIME_TYPE)
+        await ctx.artifact_service.save_artifact(app_name="benchmark", user_id=session.user_id, session_id=session.id, filename=RecorderState.task_artifact_key(f"tss_{i + 1}"), artifact=part)
+    return ctx
+
+
+class _RecordingSessionManager(LyriaSessionManager):
+    """renderの計測値を集める"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics: list[SessionMetrics] = []
+
+    async def render(self, *args, **kwargs) -> SessionMetrics:
+        metrics = await super().render(*args, **kwargs)
+        self.metrics.append(metrics)
+        return metrics
+
+
+async def compose_and_master(session_service: InMemorySessionService, ctx: InvocationContext) -> tuple[float, float]:
+    """作曲してからマスタリングする。(作曲, マスタリング) にかかった時間を返す"""
+    started = time.perf_counter()
+    async for event in ctx.agent.run_async(ctx):
+        await session_service.append_event(ctx.session, event)
+    composed = time.perf_counter()
+    agent = MasteringAgent()
+    with ScratchSpace() as scratch:
+        await agent.mastering(await agent.mixing(ctx, scratch), scratch)
+    return composed - started, time.perf_counter() - composed
+
+
+async def run_load_test(programs: int, minutes: float, segments: int, config: StandInConfig, max_sessions: int = 3, sessions_per_minute: float = 600, max_reconnects: int = 3) -> LoadTestResult:
+    async with StandInLyriaServer(config) as server:
+        manager = _RecordingSessionManager(max_sessions=max_sessions, sessions_per_minute=sessions_per_minute, max_reconnects=max_reconnects, client_factory=lambda: StandInClient(server.url))
+        configure_lyria_sessions(manager)
+        try:
+            session_service = InMemorySessionService()
+            contexts = [await program_context(ComposerFlowAgent(), session_service, minutes, segments, seed) for seed in range(programs)]
+            timings = await asyncio.gather(*[compose_and_master(session_service, ctx) for ctx in contexts])
+        finally:
+            configure_lyria_sessions(None)
+
+    first_chunks = [m.time_to_first_chunk for m in manager.metrics if m.time_to_first_chunk is not None]
+    return LoadTestResult(
+        programs=programs,
+        minutes=minutes,
+        segments=segments,
+        speed=config.speed,
+        max_sessions=max_sessions,
+        compose_seconds=max(compose for compose, _ in timings),
+        mastering_seconds=max(mastering for _, mastering in timings),
+        sessions=server.stats.sessions,
+        max_active_sessions=server.stats.max_active,
+        reconnects=sum(m.reconnects for m in manager.metrics),
+        filtered_prompts=server.stats.filtered_prompts,
+        time_to_first_chunk_p50=statistics.median(first_chunks) if first_chunks else None,
+        time_to_first_chunk_max=max(first_chunks) if first_chunks else None,
+        queued_max=max((m.queued for m in manager.metrics), default=0.0),
+        bytes_per_second_p50=statistics.median([m.bytes_per_second for m in manager.metrics]) if manager.metrics else 0.0,
+    )
+
+
+def format_result(r: LoadTestResult) -> str:
+    first_chunk = f"{r.time_to_first_chunk_p50:.2f}/{r.time_to_first_chunk_max:.2f}" if r.time_to_first_chunk_p50 is not None else "-"
+    return "\n".join(
+        [
+            f"programs={r.programs} minutes={r.minutes:g} segments={r.segments} speed={r.speed:g}x max_sessions={r.max_sessions}",
+            f"compose {r.compose_seconds:.2f}s, mastering {r.mastering_seconds:.2f}s",
+            f"sessions {r.sessions} (max active {r.max_active_sessions}), reconnects {r.reconnects}, filtered prompts {r.filtered_prompts}",
+            f"first chunk p50/max {first_chunk}s, queued max {r.queued_max:.2f}s, {r.bytes_per_second_p50 / 1024:.0f} KiB/s per session",
+        ]
+    )
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--programs", type=int, default=4, help="number of programs composed at once")
+    parser.add_argument("--minutes", type=float, default=3, help="length of each program")
+    parser.add_argument("--segments", type=int, default=4, help="number of segments of each program")
+    parser.add_argument("--speed", type=float, default=8.0, help="multiple of real time the stand-in server streams at")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds from PLAY to the first chunk")
+    parser.add_argument("--jitter", type=float, default=0.02, help="maximum extra delay of each chunk in seconds")
+    parser.add_argument("--filter", nargs="*", default=[], help="prompts containing these words are reported as filtered")
+    parser.add_argument("--drop-after", type=float, default=None, help="abort each connection after streaming this many seconds of audio")
+    parser.add_argument("--max-sessions", type=int, default=3, help="concurrent Lyria sessions")
+    parser.add_argument("--sessions-per-minute", type=float, default=600, help="Lyria sessions opened per minute")
+    parser.add_argument("--audio-workers", type=int, default=None, help="audio executor workers. Defaults to the AUDIO_EXECUTOR_WORKERS setting")
+    parser.add_argument("--json", help="write the result to this file")
+    args = parser.parse_args(argv)
+
+    config = StandInConfig(speed=args.speed, latency=args.latency, jitter=args.jitter, filtered_words=tuple(args.filter), drop_after=args.drop_after)
+    configure_audio_executor(args.audio_workers)
+    try:
+        result = asyncio.run(run_load_test(args.programs, args.minutes, args.segments, config, args.max_sessions, args.sessions_per_minute))
+    finally:
+        configure_audio_executor(None)
+    print(format_result(result), flush=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(asdict(result), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
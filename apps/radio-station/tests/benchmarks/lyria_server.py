@@ -0,0 +1,270 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Lyria RealTimeの代わりにローカルで動く音楽生成サーバ
+
+Lyria RealTimeと同じlive musicのプロトコル(setup, clientContent, musicGenerationConfig, playbackControl, serverContent, filteredPrompt)を話し、
+合成した48kHz・ステレオの16bit PCMを、実時間の何倍かの速さと、指定した遅延・揺らぎで送る。
+ネットワークやAPIキーが無くても、作曲からマスタリングまでの流れを手元で負荷テストできる。
+
+    python -m tests.benchmarks.lyria_server --port 8765 --speed 4 --latency 0.5 --jitter 0.05
+
+クライアントはgenaiのAsyncMusicSessionをそのまま使う(StandInClient)。
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import zlib
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import AsyncIterator
+
+import numpy as np
+from google.genai.live_music import AsyncMusicSession
+from websockets.asyncio.client import connect
+from websockets.asyncio.server import Server, ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+
+from radio_station.sub_agents.composer.lyria import LYRIA_FRAME_RATE
+from radio_station.utils.audio import to_pcm16
+
+logger = logging.getLogger(__name__)
+
+LYRIA_PATH = "/ws/google.ai.generativelanguage.v1alpha.GenerativeService.BidiGenerateMusic"
+AUDIO_MIME_TYPE = f"audio/l16;rate={LYRIA_FRAME_RATE};channels=2"
+DEFAULT_BPM = 120
+# AsyncMusicSessionはapi_clientのvertexaiしか見ない
+_API_CLIENT = SimpleNamespace(vertexai=False)
+
+
+@dataclass
+class StandInConfig:
+    """サーバの振る舞い"""
+
+    # 実時間の何倍の速さで音声を送るか
+    speed: float = 1.0
+    # PLAYから最初のチャンクを送るまでの秒数
+    latency: float = 0.0
+    # チャンクごとに加える遅れの最大値(秒)
+    jitter: float = 0.0
+    # 1つのチャンクの長さ
+    chunk_ms: int = 500
+    # このテキストを含むプロンプトはフィルタされたとしてfilteredPromptを返し、生成には使わない
+    filtered_words: tuple[str, ...] = ()
+    # この秒数の音声を送ったところで接続を異常終了させる。Noneの場合は切らない
+    drop_after: float | None = None
+    seed: int = 0
+
+
+@dataclass
+class StandInStats:
+    sessions: int = 0
+    active: int = 0
+    max_active: int = 0
+    chunks: int = 0
+    sent_bytes: int = 0
+    filtered_prompts: int = 0
+    drops: int = 0
+    # 受け取ったplaybackControlの一覧
+    controls: list[str] = field(default_factory=list)
+
+
+def synthesize(start: int, frames: int, bpm: float, chord: np.ndarray, frame_rate: int = LYRIA_FRAME_RATE) -> np.ndarray:
+    """start フレーム目から続く音楽風の音(和音と拍ごとのキック)。(frames, 2) のint16"""
+    t = np.arange(start, start + frames) / frame_rate
+    in_beat = t % (60 / bpm)
+    kick = (np.sin(2 * np.pi * 55 * in_beat) * np.exp(-in_beat * 25)).astype(np.float32)
+    out = np.empty((frames, 2), dtype=np.int16)
+    for channel, detune in enumerate([1.0, 1.003]):
+        pad = sum(np.sin(2 * np.pi * f * detune * t) for f in chord).astype(np.float32)
+        out[:, channel] = to_pcm16(0.08 * pad + 0.4 * kick)
+    return out
+
+
+def _chord(prompts: list[dict]) -> np.ndarray:
+    """プロンプトのテキストから決まる和音。同じプロンプトなら同じ音になる"""
+    key = zlib.crc32(" ".join(sorted(p.get("text", "") for p in prompts)).encode())
+    return np.array([220.0, 261.63, 329.63]) * 2 ** ((key % 12) / 12)
+
+
+class _MusicSession:
+    """1つの接続の状態。受信したメッセージで状態を変え、再生中は音声を送り続ける"""
+
+    def __init__(self, ws: ServerConnection, config: StandInConfig, stats: StandInStats, rng: np.random.Generator):
+        self.ws = ws
+        self.config = config
+        self.stats = stats
+        self.rng = rng
+        self.prompts: list[dict] = []
+        self.bpm: float = DEFAULT_BPM
+        self.position = 0
+        self.sent_frames = 0
+        self.playing = asyncio.Event()
+        self.started = False
+
+    async def handle(self, message: dict) -> None:
+        if "clientContent" in message:
+            prompts = message["clientContent"].get("weightedPrompts", [])
+            self.prompts = []
+            for prompt in prompts:
+                text = prompt.get("text", "")
+                if any(word in text for word in self.config.filtered_words):
+                    self.stats.filtered_prompts += 1
+                    await self.ws.send(json.dumps({"filteredPrompt": {"text": text, "filteredReason": "The prompt was filtered by the stand-in server."}}))
+                else:
+                    self.prompts.append(prompt)
+        elif "musicGenerationConfig" in message:
+            self.bpm = message["musicGenerationConfig"].get("bpm") or DEFAULT_BPM
+        elif "playbackControl" in message:
+            control = message["playbackControl"]
+            self.stats.controls.append(control)
+            if control == "PLAY":
+                self.playing.set()
+            elif control == "PAUSE":
+                self.playing.clear()
+            elif control == "STOP":
+                self.playing.clear()
+                self.position = 0
+            elif control == "RESET_CONTEXT":
+                self.position = 0
+
+    async def stream(self) -> None:
+        loop = asyncio.get_running_loop()
+        chunk_frames = LYRIA_FRAME_RATE * self.config.chunk_ms // 1000
+        interval = chunk_frames / LYRIA_FRAME_RATE / self.config.speed
+        while True:
+            if not self.playing.is_set():
+                await self.playing.wait()
+                if not self.started:
+                    self.started = True
+                    await asyncio.sleep(self.config.latency)
+                next_send = loop.time()
+            if self.config.drop_after is not None and self.sent_frames >= self.config.drop_after * LYRIA_FRAME_RATE:
+                self.stats.drops += 1
+                # closeフレームを送らずに切る
+                self.ws.transport.abort()
+                return
+            # 音声の分の時間に、揺らぎを加えて待つ
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - loop.time() + self.rng.uniform(0, self.config.jitter)))
+            if not self.playing.is_set():
+                continue
+            audio = synthesize(self.position, chunk_frames, self.bpm, _chord(self.prompts))
+            self.position += chunk_frames
+            self.sent_frames += chunk_frames
+            data = base64.b64encode(audio.tobytes()).decode()
+            await self.ws.send(json.dumps({"serverContent": {"audioChunks": [{"data": data, "mimeType": AUDIO_MIME_TYPE}]}}))
+            self.stats.chunks += 1
+            self.stats.sent_bytes += audio.nbytes
+
+
+class StandInLyriaServer:
+    """ローカルのLyria RealTimeのスタンドイン。async withで起動・停止する"""
+
+    def __init__(self, config: StandInConfig | None = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StandInConfig()
+        self.host = host
+        self.port = port
+        self.stats = StandInStats()
+        self._rng = np.random.default_rng(self.config.seed)
+        self._server: Server | None = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}{LYRIA_PATH}"
+
+    async def start(self) -> None:
+        self._server = await serve(self._handle, self.host, self.port, max_size=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"stand-in lyria server: {self.url}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self) -> "StandInLyriaServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    async def _handle(self, ws: ServerConnection) -> None:
+        setup = json.loads(await ws.recv())
+        if "setup" not in setup:
+            await ws.close(1007, "the first message must be setup")
+            return
+        await ws.send(json.dumps({"setupComplete": {}}))
+
+        self.stats.sessions += 1
+        self.stats.active += 1
+        self.stats.max_active = max(self.stats.max_active, self.stats.active)
+        session = _MusicSession(ws, self.config, self.stats, self._rng)
+        streamer = asyncio.create_task(session.stream())
+        try:
+            async for raw in ws:
+                await session.handle(json.loads(raw))
+        except ConnectionClosed:
+            pass
+        finally:
+            streamer.cancel()
+            self.stats.active -= 1
+
+
+class StandInClient:
+    """LyriaSessionManagerのclient_factoryに渡すクライアント。genaiのAsyncMusicSessionでスタンドインのサーバにつなぐ"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.aio = SimpleNamespace(live=SimpleNamespace(music=self))
+
+    @asynccontextmanager
+    async def connect(self, *, model: str) -> AsyncIterator[AsyncMusicSession]:
+        async with connect(self.url, max_size=None) as ws:
+            await ws.send(json.dumps({"setup": {"model": model}}))
+            await ws.recv()
+            yield AsyncMusicSession(api_client=_API_CLIENT, websocket=ws)
+
+
+async def serve_forever(config: StandInConfig, host: str, port: int) -> None:
+    async with StandInLyriaServer(config, host, port) as server:
+        print(f"listening on {server.url}", flush=True)
+        await asyncio.Future()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--speed", type=float, default=1.0, help="multiple of real time to stream audio at")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds from PLAY to the first chunk")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum extra delay of each chunk in seconds")
+    parser.add_argument("--chunk-ms", type=int, default=500, help="length of each audio chunk")
+    parser.add_argument("--filter", nargs="*", default=[], help="prompts containing these words are reported as filtered")
+    parser.add_argument("--drop-after", type=float, default=None, help="abort each connection after streaming this many seconds of audio")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = StandInConfig(speed=args.speed, latency=args.latency, jitter=args.jitter, chunk_ms=args.chunk_ms, filtered_words=tuple(args.filter), drop_after=args.drop_after)
+    asyncio.run(serve_forever(config, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""MasteringAgentのベンチマーク
+
+合成したトーク風・音楽風の生PCMをInMemoryArtifactServiceに置き、mixingとmasteringを段階ごとに計測する。
+実際の音源や外部サービスを使わないので、音声処理の性能の変化を手元で比較できる。
+
+    python -m tests.benchmarks.mastering --minutes 10 30 60 --segments 8 --json result.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import resource
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator
+
+import numpy as np
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from radio_station.model.program_plan import ProgramPlan, SegmentPlan, SegmentType
+from radio_station.model.talk_script import TalkScript, TalkScriptSegment
+from radio_station.state_keys import ComposerState, ProgramPlannerState, RecorderState, WriterState
+from radio_station.sub_agents.mastering.agent import MasteringAgent
+from radio_station.sub_agents.mastering.scratch import ScratchSpace
+from radio_station.utils.audio import to_pcm16
+from radio_station.utils.audio_executor import configure_audio_executor
+from radio_station.utils.loudness import analyze
+from radio_station.utils.pcm import PCM_MIME_TYPE, encode_pcm
+
+# Gemini TTSとLyriaの出力と同じ形式
+SPEECH_FRAME_RATE = 24000
+MUSIC_FRAME_RATE = 48000
+# 合成する単位(秒)。一時配列を小さく抑える
+_CHUNK_SECONDS = 30
+
+
+@dataclass
+class StageResult:
+    """1つの段階の計測結果"""
+
+    minutes: float
+    segments: int
+    stage: str
+    seconds: float
+    # 番組の長さ / 処理時間
+    realtime_factor: float
+    # 段階中の最大RSS(MB)。最大値をリセットできない環境では、プロセス開始からの最大値しか分からないのでNone
+    peak_rss_mb: float | None
+    # tracemallocで追跡したPythonとnumpyの確保量の最大値(MB)。追跡しない場合はNone
+    peak_allocated_mb: float | None
+
+
+def speech_like(seconds: float, seed: int = 0, frame_rate: int = SPEECH_FRAME_RATE) -> np.ndarray:
+    """トーク風の音: 揺れる基本周波数の倍音を、音節の包絡と単語の間の無音で区切る。(frames, 1) のint16"""
+    rng = np.random.default_rng(seed)
+    frames = int(seconds * frame_rate)
+    out = np.empty((frames, 1), dtype=np.int16)
+    phase = 0.0
+    # 単語(0.3〜1.2秒)と間(0.1〜0.6秒)を交互に並べたゲート
+    durations = rng.uniform([0.3, 0.1], [1.2, 0.6], size=(int(seconds / 0.4) + 2, 2)).ravel()
+    gate = np.repeat(np.tile([1.0, 0.0], len(durations) // 2).astype(np.float32), (durations * frame_rate).astype(int))
+    gate = np.pad(gate, (0, max(0, frames - len(gate))))[:frames]
+    for start in range(0, frames, _CHUNK_SECONDS * frame_rate):
+        t = np.arange(start, min(frames, start + _CHUNK_SECONDS * frame_rate)) / frame_rate
+        f0 = 140 + 30 * np.sin(2 * np.pi * 0.3 * t)
+        phases = phase + np.cumsum(2 * np.pi * f0 / frame_rate)
+        phase = float(phases[-1])
+        voiced = sum(np.sin(k * phases) / k for k in range(1, 6)).astype(np.float32)
+        envelope = (0.5 - 0.5 * np.cos(2 * np.pi * 4 * t)).astype(np.float32) ** 2 * gate[start : start + len(t)]
+        noise = rng.normal(0, 0.01, len(t)).astype(np.float32)
+        out[start : start + len(t), 0] = to_pcm16(0.25 * voiced * envelope + noise)
+    return out
+
+
+def music_like(seconds: float, bpm: float, seed: int = 0, frame_rate: int = MUSIC_FRAME_RATE) -> np.ndarray:
+    """音楽風の音: 左右で少しずらした和音に、拍ごとのキックを重ねる。(frames, 2) のint16"""
+    rng = np.random.default_rng(seed)
+    frames = int(seconds * frame_rate)
+    out = np.empty((frames, 2), dtype=np.int16)
+    chord = np.array([220.0, 261.63, 329.63]) * rng.choice([1.0, 0.89, 1.12])
+    beat = 60 / bpm
+    for start in range(0, frames, _CHUNK_SECONDS * frame_rate):
+        t = np.arange(start, min(frames, start + _CHUNK_SECONDS * frame_rate)) / frame_rate
+        in_beat = t % beat
+        kick = (np.sin(2 * np.pi * 55 * in_beat) * np.exp(-in_beat * 25)).astype(np.float32)
+        for channel, detune in enumerate([1.0, 1.003]):
+            pad = sum(np.sin(2 * np.pi * f * detune * t) for f in chord).astype(np.float32)
+            out[start : start + len(t), channel] = to_pcm16(0.08 * pad + 0.4 * kick)
+    return out
+
+
+def program_state(minutes: float, segments: int) -> dict:
+    """segments個のセグメント(オープニング・コンテンツ・エンディング)がすべて背景音楽を持つ番組のstate"""
+    seconds = minutes * 60 / segments
+    types_ = [SegmentType.OPENING, *[SegmentType.CONTENT] * max(0, segments - 2), SegmentType.ENDING][:segments]
+    plan = ProgramPlan(
+        title="benchmark",
+        description="synthetic program",
+        program_seconds=int(minutes * 60),
+        segments=[
+            SegmentPlan(
+                title=f"segment {i + 1}",
+                program_segment_ids=[],
+                segment_no=i + 1,
+                segment_seconds=seconds,
+                is_music=False,
+                description="synthetic segment",
+                segment_type=segment_type,
+                background_music="synthetic",
+                music_bpm=90.0 + 10 * (i % 4),
+            )
+            for i, segment_type in enumerate(types_)
+        ],
+    )
+    talk_script_segments = [TalkScriptSegment(id=f"tss_{i + 1}", task_id=str(i + 1), scripts=[TalkScript(radio_cast_id="1", content="benchmark")]) for i in range(segments)]
+    return {
+        RecorderState.TEMP_TASK_IDS: [tss.id for tss in talk_script_segments],
+        ComposerState.TASK_IDS: [str(i + 1) for i in range(segments)],
+        WriterState.TALK_SCRIPT_SEGMENTS: [tss.model_dump() for tss in talk_script_segments],
+        ProgramPlannerState.PROGRAM_STRUCTURE: plan.model_dump(),
+    }
+
+
+async def program_context(agent: MasteringAgent, minutes: float, segments: int, seed: int = 0) -> InvocationContext:
+    """合成した音源を保存したInMemoryArtifactServiceとセッションを持つInvocationContext
+
+    音源は録音・作曲の時と同じく、ラウドネス統計をヘッダに持つ生PCMにする。
+    """
+    state = program_state(minutes, segments)
+    session_service = InMemorySessionService()
+    session = await session_service.create_session(app_name="benchmark", user_id="benchmark", state=state)
+    ctx = InvocationContext(session_service=session_service, artifact_service=InMemoryArtifactService(), invocation_id="benchmark", agent=agent, session=session)
+
+    plan = ProgramPlannerState.get_program_structure(state)
+    for i, segment in enumerate(plan.segments):
+        speech = speech_like(segment.segment_seconds, seed + i)
+        music = music_like(segment.segment_seconds, segment.music_bpm, seed + i)
+        sources = {
+            RecorderState.task_artifact_key(f"tss_{i + 1}"): (speech, SPEECH_FRAME_RATE),
+            ComposerState.task_music_artifact_key(str(i + 1)): (music, MUSIC_FRAME_RATE),
+        }
+        for key, (samples, frame_rate) in sources.items():
+            part = types.Part.from_bytes(data=encode_pcm(samples, frame_rate, loudness=analyze(samples, frame_rate)), mime_type=PCM_MIME_TYPE)
+            await ctx.artifact_service.save_artifact(app_name="benchmark", user_id="benchmark", session_id=session.id, filename=key, artifact=part)
+    return ctx
+
+
+def _reset_peak_rss() -> bool:
+    """LinuxではVmHWMをリセットできる。できない場合はFalse"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrssはLinuxではKB単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Recorder:
+    """段階ごとに処理時間・最大RSS・確保量を記録する"""
+
+    def __init__(self, minutes: float, segments: int, trace_allocations: bool = True):
+        self.minutes = minutes
+        self.segments = segments
+        self.trace_allocations = trace_allocations
+        self.results: list[StageResult] = []
+
+    @contextlib.asynccontextmanager
+    async def stage(self, name: str) -> AsyncIterator[None]:
+        rss_reset = _reset_peak_rss()
+        if self.trace_allocations:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            allocated = None
+            if self.trace_allocations:
+                allocated = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                tracemalloc.stop()
+            self.results.append(
+                StageResult(
+                    minutes=self.minutes,
+                    segments=self.segments,
+                    stage=name,
+                    seconds=seconds,
+                    realtime_factor=self.minutes * 60 / seconds if seconds > 0 else float("inf"),
+                    peak_rss_mb=_peak_rss_mb() if rss_reset else None,
+                    peak_allocated_mb=allocated,
+                )
+            )
+
+
+async def run_benchmark(minutes: float, segments: int, memory_budget: int | None = None, stem_cache: bool = False, trace_allocations: bool = True, seed: int = 0) -> list[StageResult]:
+    """1つの長さの番組でmixingとmasteringを計測する。stem_cacheが有効な場合は、保存したステムを使う2回目のmixingも計測する"""
+    agent = MasteringAgent(stem_cache=stem_cache, memory_budget=memory_budget)
+    ctx = await program_context(agent, minutes, segments, seed)
+    recorder = Recorder(minutes, segments, trace_allocations)
+
+    with ScratchSpace(memory_budget) as scratch:
+        async with recorder.stage("mixing"):
+            mixed = await agent.mixing(ctx, scratch)
+        if stem_cache:
+            async with recorder.stage("mixing (cached stems)"):
+                mixed = await agent.mixing(ctx, scratch)
+        async with recorder.stage("mastering"):
+            await agent.mastering(mixed, scratch)
+    return recorder.results
+
+
+def format_results(results: list[StageResult]) -> str:
+    lines = [f"{'minutes':>7} {'segments':>8} {'stage':<22} {'seconds':>9} {'x realtime':>10} {'peak RSS MB':>11} {'peak alloc MB':>13}"]
+    for r in results:
+        rss = f"{r.peak_rss_mb:11.1f}" if r.peak_rss_mb is not None else f"{'-':>11}"
+        allocated = f"{r.peak_allocated_mb:13.1f}" if r.peak_allocated_mb is not None else f"{'-':>13}"
+        lines.append(f"{r.minutes:7g} {r.segments:8d} {r.stage:<22} {r.seconds:9.2f} {r.realtime_factor:10.1f} {rss} {allocated}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--minutes", type=float, nargs="+", default=[10, 30, 60], help="program lengths to benchmark")
+    parser.add_argument("--segments", type=int, default=8, help="number of segments of each program")
+    parser.add_argument("--memory-budget-mb", type=float, default=None, help="scratch memory budget. Buffers beyond it are memory-mapped")
+    parser.add_argument("--stem-cache", action="store_true", help="also measure mixing from the cached stems")
+    parser.add_argument("--audio-workers", type=int, default=0, help="audio executor workers. 0 keeps all work in this process so that RSS and allocations cover it")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="do not trace allocations (tracemalloc slows numpy-heavy stages down)")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    configure_audio_executor(args.audio_workers)
+    memory_budget = int(args.memory_budget_mb * 1024 * 1024) if args.memory_budget_mb is not None else None
+    results = []
+    try:
+        for minutes in args.minutes:
+            results += asyncio.run(run_benchmark(minutes, args.segments, memory_budget, args.stem_cache, not args.no_tracemalloc))
+            print(format_results([r for r in results if r.minutes == minutes]), flush=True)
+    finally:
+        configure_audio_executor(None)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(r) for r in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import pytest
+
+from radio_station.utils.audio_executor import configure_audio_executor
+from tests.benchmarks.composer import format_result, main, music_plan, run_load_test
+from tests.benchmarks.lyria_server import StandInConfig
+
+
+@pytest.fixture(autouse=True)
+def audio_executor_in_thread():
+    configure_audio_executor(0)
+    yield
+    configure_audio_executor(None)
+
+
+def test_music_plan_covers_seconds():
+    assert [s.seconds for s in music_plan(25.0, 100, "test").stanzas] == [10, 10, 5]
+    assert [s.seconds for s in music_plan(0.4, 100, "test").stanzas] == [1]
+
+
+@pytest.mark.asyncio
+async def test_run_load_test():
+    result = await run_load_test(2, 0.5, 3, StandInConfig(speed=50, chunk_ms=100, filtered_words=("segment 2",)), max_sessions=2)
+
+    assert result.sessions == 6 and result.max_active_sessions == 2
+    assert result.filtered_prompts == 2 and result.reconnects == 0
+    assert result.compose_seconds > 0 and result.mastering_seconds > 0 and result.bytes_per_second_p50 > 0
+    assert "max active 2" in format_result(result)
+
+
+def test_main(tmp_path, capsys):
+    output = tmp_path / "result.json"
+    main(["--programs", "1", "--minutes", "0.2", "--segments", "2", "--speed", "50", "--latency", "0", "--audio-workers", "0", "--json", str(output)])
+
+    assert json.loads(output.read_text())["sessions"] == 2
+    assert "compose" in capsys.readouterr().out
@@ -0,0 +1,79 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import numpy as np
+import pytest
+from google.genai import types
+
+from radio_station.model.music_plan import LiveMusicGenerationConfig, MusicStanza, WeightedPrompt
+from radio_station.sub_agents.composer.lyria import LYRIA_FRAME_RATE, MODEL, LyriaSessionManager
+from radio_station.sub_agents.composer.scheduler import StanzaScheduler
+from radio_station.utils.beat_grid import analyze_beats
+from tests.benchmarks.lyria_server import StandInClient, StandInConfig, StandInLyriaServer, synthesize
+
+
+def test_synthesize_is_continuous_music():
+    """チャンクに分けて合成しても続けて合成した音と同じで、指定のBPMの拍を持つことを確認"""
+    chord = np.array([220.0, 261.63, 329.63])
+    whole = synthesize(0, 10 * LYRIA_FRAME_RATE, 120, chord)
+    chunks = np.concatenate([synthesize(start, LYRIA_FRAME_RATE, 120, chord) for start in range(0, 10 * LYRIA_FRAME_RATE, LYRIA_FRAME_RATE)])
+
+    assert whole.shape == (10 * LYRIA_FRAME_RATE, 2) and whole.dtype == np.int16
+    np.testing.assert_array_equal(whole, chunks)
+    assert analyze_beats(whole, LYRIA_FRAME_RATE, 120.0).bpm == pytest.approx(120.0, abs=1.0)
+
+
+@pytest.mark.asyncio
+async def test_genai_session_protocol():
+    """genaiのAsyncMusicSessionでつなぎ、プロンプトのフィルタ・音声の受信・一時停止が動くことを確認"""
+    config = StandInConfig(speed=50, chunk_ms=100, filtered_words=("forbidden",))
+    async with StandInLyriaServer(config) as server, StandInClient(server.url).connect(model=MODEL) as session:
+        await session.set_weighted_prompts(prompts=[types.WeightedPrompt(text="deep house", weight=1.0), types.WeightedPrompt(text="forbidden noise", weight=1.0)])
+        await session.set_music_generation_config(config=types.LiveMusicGenerationConfig(bpm=100))
+        await session.reset_context()
+        await session.play()
+
+        messages = []
+        async for message in session.receive():
+            messages.append(message)
+            if len(messages) == 4:
+                break
+        await session.pause()
+        await asyncio.sleep(0.05)
+        paused_at = server.stats.chunks
+        await asyncio.sleep(0.05)
+
+    assert messages[0].filtered_prompt.text == "forbidden noise"
+    chunks = [m.server_content.audio_chunks[0] for m in messages[1:]]
+    assert all(len(chunk.data) == LYRIA_FRAME_RATE // 10 * 4 for chunk in chunks)
+    assert chunks[0].mime_type == f"audio/l16;rate={LYRIA_FRAME_RATE};channels=2"
+    assert server.stats.chunks == paused_at
+    assert server.stats.controls == ["RESET_CONTEXT", "PLAY", "PAUSE"]
+    assert server.stats.sessions == 1 and server.stats.filtered_prompts == 1 and server.stats.active == 0
+
+
+@pytest.mark.asyncio
+async def test_session_manager_resumes_after_dropped_connection():
+    """接続が異常終了しても、セッションの管理が接続し直して合計の長さまで受信することを確認"""
+    stanzas = [MusicStanza(prompts=[WeightedPrompt(text=f"stanza {i}", weight=1.0)], seconds=1, config=LiveMusicGenerationConfig(bpm=120)) for i in range(3)]
+    async with StandInLyriaServer(StandInConfig(speed=20, chunk_ms=100, drop_after=2.0)) as server:
+        manager = LyriaSessionManager(sessions_per_minute=6000, client_factory=lambda: StandInClient(server.url))
+        scheduler = StanzaScheduler(stanzas, LYRIA_FRAME_RATE)
+        received = bytearray()
+        metrics = await manager.render(stanzas, scheduler, received.extend)
+
+    assert scheduler.finished and len(received) == 3 * LYRIA_FRAME_RATE * 4
+    assert metrics.reconnects == 1 and server.stats.drops == 1 and server.stats.sessions == 2
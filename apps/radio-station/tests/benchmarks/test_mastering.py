@@ -0,0 +1,73 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from radio_station.utils.audio_executor import configure_audio_executor
+from radio_station.utils.beat_grid import analyze_beats
+from radio_station.utils.loudness import analyze
+from radio_station.utils.speech_quality import analyze_speech
+from tests.benchmarks.mastering import MUSIC_FRAME_RATE, SPEECH_FRAME_RATE, format_results, main, music_like, run_benchmark, speech_like
+
+
+@pytest.fixture(autouse=True)
+def audio_executor_in_thread():
+    configure_audio_executor(0)
+    yield
+    configure_audio_executor(None)
+
+
+def test_synthetic_sources():
+    """合成した音源がトーク・音楽らしい形式と特徴を持つことを確認"""
+    speech = speech_like(10.0)
+    assert speech.shape == (10 * SPEECH_FRAME_RATE, 1) and speech.dtype == np.int16
+    report = analyze_speech(speech, SPEECH_FRAME_RATE)
+    assert report.dropouts == [] and report.clipped_ratio == 0
+
+    music = music_like(10.0, bpm=120.0)
+    assert music.shape == (10 * MUSIC_FRAME_RATE, 2) and music.dtype == np.int16
+    assert analyze_beats(music, MUSIC_FRAME_RATE, 120.0).bpm == pytest.approx(120.0, abs=1.0)
+    assert -30 < analyze(music, MUSIC_FRAME_RATE).integrated < -5
+
+
+@pytest.mark.asyncio
+async def test_run_benchmark():
+    results = await run_benchmark(0.2, 3, stem_cache=True)
+
+    assert [r.stage for r in results] == ["mixing", "mixing (cached stems)", "mastering"]
+    assert all(r.seconds > 0 and r.peak_rss_mb > 0 and r.peak_allocated_mb > 0 for r in results)
+    assert "mixing (cached stems)" in format_results(results)
+
+
+@pytest.mark.asyncio
+async def test_run_benchmark_without_peak_rss_reset():
+    """最大RSSをリセットできない環境では、プロセス開始からの最大値を段階の値として記録しないことを確認"""
+    with patch("tests.benchmarks.mastering._reset_peak_rss", return_value=False):
+        results = await run_benchmark(0.1, 2, trace_allocations=False)
+
+    assert [r.peak_rss_mb for r in results] == [None, None]
+    assert all(line.split()[-2:] == ["-", "-"] for line in format_results(results).splitlines()[1:])
+
+
+def test_main(tmp_path, capsys):
+    output = tmp_path / "result.json"
+    main(["--minutes", "0.1", "--segments", "2", "--memory-budget-mb", "1", "--no-tracemalloc", "--json", str(output)])
+
+    results = json.loads(output.read_text())
+    assert [(r["minutes"], r["stage"], r["peak_allocated_mb"]) for r in results] == [(0.1, "mixing", None), (0.1, "mastering", None)]
+    assert "mastering" in capsys.readouterr().out
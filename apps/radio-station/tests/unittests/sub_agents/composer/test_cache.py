@@ -0,0 +1,97 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from radio_station.model.music_plan import LiveMusicGenerationConfig, MusicPlan, MusicStanza, WeightedPrompt
+from radio_station.sub_agents.composer.cache import MusicCache, music_plan_hash
+from radio_station.sub_agents.composer.library import LibraryEntry, MusicKind
+
+
+def make_plan(prompts: list[tuple[str, float]], seconds: int = 30, bpm: int = 120, title: str = "test") -> MusicPlan:
+    return MusicPlan(
+        title=title,
+        stanzas=[MusicStanza(prompts=[WeightedPrompt(text=text, weight=weight) for text, weight in prompts], seconds=seconds, config=LiveMusicGenerationConfig(bpm=bpm))],
+    )
+
+
+async def make_context(artifact_service: InMemoryArtifactService, program_id: str | None = "program") -> InvocationContext:
+    session_service = InMemorySessionService()
+    state = {"listener_program": {"id": program_id, "listener_id": "listener", "title": "title", "description": "description", "program_minutes": 5}} if program_id else {}
+    session = await session_service.create_session(app_name="test", user_id="listener", state=state)
+    return InvocationContext(session_service=session_service, artifact_service=artifact_service, invocation_id="test", agent=BaseAgent(name="test"), session=session)
+
+
+def audio(data: bytes = b"audio") -> types.Part:
+    return types.Part.from_bytes(data=data, mime_type="audio/x-radio-station-pcm")
+
+
+def test_music_plan_hash_ignores_title_order_and_weight_scale():
+    plan = make_plan([("Deep House", 1.0), ("808 Beat", 2.0)], title="a")
+
+    assert music_plan_hash(plan) == music_plan_hash(make_plan([("808 beat ", 1.0), ("deep house", 0.5)], title="b"))
+    assert music_plan_hash(plan) != music_plan_hash(make_plan([("Deep House", 1.0), ("808 Beat", 1.0)]))
+    assert music_plan_hash(plan) != music_plan_hash(make_plan([("Deep House", 1.0), ("808 Beat", 2.0)], seconds=31))
+    assert music_plan_hash(plan) != music_plan_hash(make_plan([("Deep House", 1.0), ("808 Beat", 2.0)], bpm=121))
+
+
+@pytest.mark.asyncio
+async def test_plan_cache_is_shared_across_sessions_of_the_program():
+    artifact_service = InMemoryArtifactService()
+    plan = make_plan([("Deep House", 1.0)])
+    await MusicCache.of(await make_context(artifact_service)).save(plan, audio(), seconds=30)
+
+    assert (await MusicCache.of(await make_context(artifact_service)).load_plan(make_plan([("deep house", 2.0)], title="other"))).inline_data.data == b"audio"
+    assert await MusicCache.of(await make_context(artifact_service, "other_program")).load_plan(plan) is None
+    assert MusicCache.of(await make_context(artifact_service, None)) is None
+
+
+@pytest.mark.asyncio
+async def test_role_cache_returns_recent_music_of_similar_length():
+    artifact_service = InMemoryArtifactService()
+    plan = make_plan([("Deep House", 1.0)])
+    await MusicCache.of(await make_context(artifact_service)).save(plan, audio(), seconds=30, role="opening")
+    cache = MusicCache.of(await make_context(artifact_service))
+
+    music_plan, part = await cache.load_role("opening", 31)
+    assert music_plan == plan
+    assert part.inline_data.data == b"audio"
+    assert await cache.load_role("ending", 30) is None
+    assert await cache.load_role("opening", 60) is None
+    with patch("radio_station.sub_agents.composer.cache.time.time", return_value=time.time() + timedelta(days=2).total_seconds()):
+        assert await cache.load_role("opening", 30, max_age=timedelta(days=1)) is None
+
+
+@pytest.mark.asyncio
+async def test_library_is_shared_across_sessions_of_the_program():
+    artifact_service = InMemoryArtifactService()
+    plan = make_plan([("Smooth Pianos", 1.0)])
+    cache = MusicCache.of(await make_context(artifact_service))
+    await cache.save(plan, audio(), seconds=30)
+    await cache.add_to_library(LibraryEntry.of(music_plan_hash(plan), plan, MusicKind.BED, "calm piano", 30))
+
+    library = await MusicCache.of(await make_context(artifact_service)).load_library()
+    entry = library.best("calm piano")
+    assert entry.music_plan == plan
+    assert (await cache.load_audio(entry.plan_hash)).inline_data.data == b"audio"
+    assert len(await MusicCache.of(await make_context(artifact_service, "other_program")).load_library()) == 0
@@ -0,0 +1,83 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from google.genai import types
+
+from radio_station.model.music_plan import LiveMusicGenerationConfig, MusicPlan, MusicStanza, WeightedPrompt
+from radio_station.sub_agents.composer.library import LibraryEntry, MusicKind, MusicLibrary, plan_bpm, plan_scale, tokenize
+
+
+def make_entry(plan_hash: str, description: str, prompts: list[str], bpm: int = 100, kind: MusicKind = MusicKind.BED, seconds: float = 60, scale: types.Scale | None = None) -> LibraryEntry:
+    plan = MusicPlan(
+        title=plan_hash,
+        stanzas=[MusicStanza(prompts=[WeightedPrompt(text=text, weight=1.0) for text in prompts], seconds=int(seconds), config=LiveMusicGenerationConfig(bpm=bpm, scale=scale))],
+    )
+    return LibraryEntry.of(plan_hash, plan, kind, description, seconds)
+
+
+def test_tokenize_splits_words_and_japanese_bigrams():
+    assert tokenize("Lo-Fi Hip Hop") == ["lo", "fi", "hip", "hop"]
+    assert tokenize("静かなピアノ") == ["静か", "かな", "なピ", "ピア", "アノ"]
+
+
+def test_entry_of_plan():
+    entry = make_entry("a", "calm piano", ["Smooth Pianos", "Chill"], bpm=80, scale=types.Scale.C_MAJOR_A_MINOR)
+
+    assert entry.prompts == ["Smooth Pianos", "Chill"]
+    assert entry.bpm == 80
+    assert entry.scale == types.Scale.C_MAJOR_A_MINOR.value
+
+
+def test_plan_bpm_and_scale():
+    stanzas = [
+        MusicStanza(prompts=[], seconds=10, config=LiveMusicGenerationConfig(bpm=90, scale=types.Scale.C_MAJOR_A_MINOR)),
+        MusicStanza(prompts=[], seconds=10, config=LiveMusicGenerationConfig(bpm=110, scale=types.Scale.C_MAJOR_A_MINOR)),
+    ]
+
+    assert plan_bpm(MusicPlan(title="a", stanzas=stanzas)) == 100
+    assert plan_scale(MusicPlan(title="a", stanzas=stanzas)) == types.Scale.C_MAJOR_A_MINOR.value
+    # スタンザごとにスケールが変わるプランはスケールで絞り込まない
+    changing = [*stanzas, MusicStanza(prompts=[], seconds=10, config=LiveMusicGenerationConfig(bpm=100, scale=types.Scale.F_MAJOR_D_MINOR))]
+    assert plan_scale(MusicPlan(title="a", stanzas=changing)) is None
+
+
+def test_search_ranks_by_description_and_prompts():
+    library = MusicLibrary(
+        [
+            make_entry("piano", "calm morning piano", ["Smooth Pianos", "Chill"]),
+            make_entry("house", "upbeat deep house for news", ["Deep House", "808 Hip Hop Beat"], bpm=124),
+            make_entry("jazz", "静かなジャズのピアノ", ["Acid Jazz", "Rhodes Piano"]),
+        ]
+    )
+
+    assert [entry.plan_hash for _, entry in library.search("calm piano")][:1] == ["piano"]
+    assert library.best("deep house beat").plan_hash == "house"
+    assert library.best("ジャズのピアノ").plan_hash == "jazz"
+    assert library.best("heavy metal") is None
+
+
+def test_search_filters_kind_bpm_scale_and_jingle_length():
+    library = MusicLibrary(
+        [
+            make_entry("bed", "deep house", ["Deep House"], bpm=120, seconds=30),
+            make_entry("jingle", "deep house", ["Deep House"], bpm=120, kind=MusicKind.JINGLE, seconds=30, scale=types.Scale.C_MAJOR_A_MINOR),
+        ]
+    )
+
+    assert [e.plan_hash for _, e in library.search("deep house", kind=MusicKind.BED)] == ["bed"]
+    assert library.search("deep house", bpm=90) == []
+    # BGMはループするので長さで絞り込まない
+    assert [e.plan_hash for _, e in library.search("deep house", seconds=120)] == ["bed"]
+    assert [e.plan_hash for _, e in library.search("deep house", kind=MusicKind.JINGLE, scale=types.Scale.C_MAJOR_A_MINOR.value, seconds=31)] == ["jingle"]
+    assert library.search("deep house", kind=MusicKind.JINGLE, scale=types.Scale.F_MAJOR_D_MINOR.value) == []
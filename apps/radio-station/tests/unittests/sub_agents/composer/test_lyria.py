@@ -0,0 +1,168 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from radio_station.model.music_plan import LiveMusicGenerationConfig, MusicStanza, WeightedPrompt
+from radio_station.sub_agents.composer.lyria import MODEL, LyriaSessionManager, TokenBucket, configure_lyria_sessions, lyria_sessions
+from radio_station.sub_agents.composer.scheduler import StanzaScheduler
+
+FRAME_RATE = 100
+FRAME_BYTES = 4
+
+
+def stanzas(*seconds: int) -> list[MusicStanza]:
+    return [MusicStanza(prompts=[WeightedPrompt(text=f"stanza {i}", weight=1.0)], seconds=s, config=LiveMusicGenerationConfig(bpm=120)) for i, s in enumerate(seconds)]
+
+
+class FakeSession:
+    """チャンクを送り続け、drop_after個送ったところで接続が切れるセッション"""
+
+    def __init__(self, drop_after: int | None = None, frames_per_chunk: int = 30):
+        self.drop_after = drop_after
+        self.frames_per_chunk = frames_per_chunk
+        self.prompts: list[str] = []
+        self.playing = asyncio.Event()
+        self.stopped = False
+
+    async def set_weighted_prompts(self, prompts):
+        self.prompts.append(prompts[0].text)
+
+    async def set_music_generation_config(self, config):
+        pass
+
+    async def reset_context(self):
+        pass
+
+    async def play(self):
+        self.playing.set()
+
+    async def stop(self):
+        self.stopped = True
+
+    async def receive(self):
+        await self.playing.wait()
+        sent = 0
+        while not self.stopped:
+            if self.drop_after is not None and sent >= self.drop_after:
+                raise ConnectionResetError("dropped")
+            yield SimpleNamespace(server_content=SimpleNamespace(audio_chunks=[SimpleNamespace(data=bytes(self.frames_per_chunk * FRAME_BYTES))]), filtered_prompt=None)
+            sent += 1
+            await asyncio.sleep(0)
+
+
+class FakeClient:
+    def __init__(self, sessions: list[FakeSession]):
+        self.sessions = sessions
+        self.opened: list[FakeSession] = []
+        self.models: list[str] = []
+        self.active = 0
+        self.max_active = 0
+        self.aio = SimpleNamespace(live=SimpleNamespace(music=SimpleNamespace(connect=self.connect)))
+
+    @asynccontextmanager
+    async def connect(self, model: str):
+        session = self.sessions.pop(0)
+        self.models.append(model)
+        self.opened.append(session)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            yield session
+        finally:
+            self.active -= 1
+
+
+@pytest.mark.asyncio
+async def test_render_reconnects_and_resumes_from_current_stanza():
+    """接続が途中で切れた場合、受信済みの位置のスタンザから続きを生成することを確認"""
+    client = FakeClient([FakeSession(drop_after=12), FakeSession()])
+    manager = LyriaSessionManager(sessions_per_minute=6000, client_factory=lambda: client)
+    scheduler = StanzaScheduler(stanzas(2, 3), FRAME_RATE)
+    received = bytearray()
+
+    metrics = await manager.render(stanzas(2, 3), scheduler, received.extend)
+
+    assert scheduler.finished
+    assert len(received) == 500 * FRAME_BYTES
+    assert metrics.connects == 2 and metrics.reconnects == 1
+    assert client.models == [MODEL, MODEL]
+    assert metrics.received_bytes == len(received)
+    assert metrics.time_to_first_chunk is not None and metrics.bytes_per_second > 0
+    # 360フレームで切れたので、2つ目のスタンザから再開する
+    assert client.opened[0].prompts == ["stanza 0", "stanza 1"]
+    assert client.opened[1].prompts == ["stanza 1"]
+
+
+@pytest.mark.asyncio
+async def test_render_gives_up_after_max_reconnects():
+    client = FakeClient([FakeSession(drop_after=1) for _ in range(3)])
+    manager = LyriaSessionManager(sessions_per_minute=6000, max_reconnects=2, client_factory=lambda: client)
+    scheduler = StanzaScheduler(stanzas(5), FRAME_RATE)
+    received = bytearray()
+
+    metrics = await manager.render(stanzas(5), scheduler, received.extend)
+
+    assert not scheduler.finished
+    assert metrics.connects == 3 and metrics.reconnects == 2
+    assert len(received) == 3 * 30 * FRAME_BYTES
+
+
+@pytest.mark.asyncio
+async def test_render_limits_concurrent_sessions():
+    client = FakeClient([FakeSession() for _ in range(4)])
+    manager = LyriaSessionManager(max_sessions=2, sessions_per_minute=6000, client_factory=lambda: client)
+
+    async def render():
+        return await manager.render(stanzas(3), StanzaScheduler(stanzas(3), FRAME_RATE), bytearray().extend)
+
+    results = await asyncio.gather(*[render() for _ in range(4)])
+
+    assert client.max_active == 2
+    assert all(metrics.connects == 1 for metrics in results)
+
+
+def test_lyria_sessions_across_event_loops():
+    """プロセスで1つのlyria_sessionsを、asyncio.runで作られる別々のイベントループから使えることを確認"""
+    client = FakeClient([FakeSession() for _ in range(4)])
+    configure_lyria_sessions(LyriaSessionManager(max_sessions=1, sessions_per_minute=6000, client_factory=lambda: client))
+
+    async def render_concurrently():
+        # 同時に2つ開こうとして、セマフォとトークンバケットを待たせる
+        return await asyncio.gather(*[lyria_sessions().render(stanzas(3), StanzaScheduler(stanzas(3), FRAME_RATE), bytearray().extend) for _ in range(2)])
+
+    try:
+        for _ in range(2):
+            results = asyncio.run(render_concurrently())
+            assert all(metrics.connects == 1 for metrics in results)
+    finally:
+        configure_lyria_sessions(None)
+
+    assert client.max_active == 1
+    assert len(client.opened) == 4
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_waits_for_tokens():
+    bucket = TokenBucket(rate=20, capacity=2)
+    started = time.monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+    # 2つは貯まっていた分、残りの2つは0.05秒ごとに補充される
+    assert 0.08 <= time.monotonic() - started < 0.5
@@ -0,0 +1,100 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import pytest
+
+from radio_station.model.music_plan import LiveMusicGenerationConfig, MusicStanza, WeightedPrompt
+from radio_station.sub_agents.composer.scheduler import StanzaScheduler
+
+FRAME_RATE = 100
+FRAME_BYTES = 4
+
+
+def stanzas(*seconds: int) -> list[MusicStanza]:
+    return [MusicStanza(prompts=[WeightedPrompt(text=f"stanza {i}", weight=1.0)], seconds=s, config=LiveMusicGenerationConfig(bpm=120)) for i, s in enumerate(seconds)]
+
+
+def chunk(frames: int) -> bytes:
+    return bytes(frames * FRAME_BYTES)
+
+
+@pytest.mark.asyncio
+async def test_switches_stanzas_by_received_frames():
+    """スタンザは経過時間ではなく、受信したフレーム数が境界に達した時点で切り替わることを確認"""
+    scheduler = StanzaScheduler(stanzas(2, 3, 1), FRAME_RATE)
+    assert scheduler.boundaries == [200, 500, 600]
+    switched = []
+
+    async def send():
+        for i in range(3):
+            assert await scheduler.wait_stanza(i)
+            switched.append((i, scheduler.frames))
+
+    sender = asyncio.create_task(send())
+    received = bytearray()
+    # 境界をまたぐ大きさのチャンクを送る
+    for _ in range(9):
+        received += await scheduler.feed(chunk(70))
+        await asyncio.sleep(0)
+    await sender
+
+    assert switched == [(0, 210), (1, 560), (2, 600)]
+    # 合計の長さを超えた分は捨てる
+    assert len(received) == 600 * FRAME_BYTES
+    assert scheduler.finished and scheduler.stanza_index() == 3
+    assert await scheduler.feed(chunk(10)) == b""
+
+
+@pytest.mark.asyncio
+async def test_stream_ends_early():
+    """受信が先に終わった場合、待っている送信側はFalseで戻ることを確認"""
+    scheduler = StanzaScheduler(stanzas(2, 2), FRAME_RATE)
+    waiter = asyncio.create_task(scheduler.wait_stanza(1))
+    await scheduler.feed(chunk(250))
+    await asyncio.sleep(0)
+    assert not waiter.done() and scheduler.stanza_index() == 1
+
+    await scheduler.close()
+    assert await waiter is False
+    assert not scheduler.finished
+
+
+@pytest.mark.asyncio
+async def test_stall_timeout():
+    """音声が届かない時間がstall_timeoutを超えるとTimeoutErrorになり、届いている間は待ち続けることを確認"""
+    scheduler = StanzaScheduler(stanzas(1), FRAME_RATE)
+
+    async def trickle():
+        for _ in range(5):
+            await asyncio.sleep(0.02)
+            await scheduler.feed(chunk(10))
+
+    feeder = asyncio.create_task(trickle())
+    with pytest.raises(TimeoutError):
+        await scheduler.wait_stanza(0, stall_timeout=0.05)
+    await feeder
+    assert scheduler.frames == 50
+
+
+@pytest.mark.asyncio
+async def test_resumes_from_received_frames():
+    """以前の生成で受信済みのフレーム数から続きを受信することを確認"""
+    scheduler = StanzaScheduler(stanzas(2, 3), FRAME_RATE, received_frames=250)
+
+    assert scheduler.stanza_index() == 1 and not scheduler.finished
+    assert len(await scheduler.feed(chunk(300))) == 250 * FRAME_BYTES
+    assert scheduler.finished
+    assert StanzaScheduler(stanzas(2), FRAME_RATE, received_frames=300).frames == 200
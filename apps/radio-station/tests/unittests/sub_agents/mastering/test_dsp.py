@@ -0,0 +1,80 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from radio_station.sub_agents.mastering.dsp import Compressor, LookaheadLimiter
+
+FRAME_RATE = 22050
+
+
+@pytest.fixture
+def noise():
+    """テスト用のステレオノイズ(10秒)"""
+    rng = np.random.default_rng(0)
+    samples = (rng.standard_normal((FRAME_RATE * 10, 2)) * 0.2).astype(np.float32)
+    samples[FRAME_RATE : FRAME_RATE + 10] = 0.99  # 突発的なピーク
+    return samples
+
+
+class TestCompressor:
+    """Compressorクラスのユニットテスト"""
+
+    def test_steady_state_ratio(self):
+        """しきい値を超えた定常信号がレシオ通りに圧縮されることを確認"""
+        samples = np.full((FRAME_RATE, 1), 10 ** (-8 / 20), dtype=np.float32)  # -8dBFS
+
+        out = Compressor(FRAME_RATE, threshold=-20, ratio=4).process(samples)
+
+        # 12dB超過 → 3dB超過
+        assert 20 * np.log10(out[-1, 0]) == pytest.approx(-17, abs=0.05)
+
+    def test_below_threshold_is_untouched(self):
+        """しきい値未満の信号は変化しないことを確認"""
+        samples = np.full((FRAME_RATE, 2), 0.01, dtype=np.float32)
+
+        assert np.allclose(Compressor(FRAME_RATE, threshold=-20).process(samples), samples)
+
+    def test_block_processing_matches_whole(self, noise):
+        """ブロック単位で処理しても一括処理と同じ結果になることを確認"""
+        whole = Compressor(FRAME_RATE, threshold=-20, ratio=2.5).process(noise)
+
+        compressor = Compressor(FRAME_RATE, threshold=-20, ratio=2.5)
+        blocks = np.concatenate([compressor.process(block) for block in np.array_split(noise, 7)])
+
+        assert np.allclose(blocks, whole, atol=1e-6)
+
+
+class TestLookaheadLimiter:
+    """LookaheadLimiterクラスのユニットテスト"""
+
+    def test_peaks_do_not_exceed_ceiling(self, noise):
+        """出力がシーリングを超えないことを確認"""
+        limiter = LookaheadLimiter(FRAME_RATE, ceiling=-1)
+        out = np.concatenate([limiter.process(noise * 4), limiter.flush()])
+
+        assert out.shape == noise.shape
+        assert np.max(np.abs(out)) <= 10 ** (-1 / 20) + 1e-6
+
+    def test_block_processing_matches_whole(self, noise):
+        """ブロック単位で処理しても一括処理と同じ結果になることを確認"""
+        limiter = LookaheadLimiter(FRAME_RATE)
+        whole = np.concatenate([limiter.process(noise * 4), limiter.flush()])
+
+        limiter = LookaheadLimiter(FRAME_RATE)
+        blocks = [limiter.process(block) for block in np.array_split(noise * 4, 11)]
+        blocks.append(limiter.flush())
+
+        assert np.allclose(np.concatenate(blocks), whole, atol=1e-6)
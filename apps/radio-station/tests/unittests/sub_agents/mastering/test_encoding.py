@@ -0,0 +1,119 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+from radio_station.sub_agents.mastering.encoding import (
+    AAC_128K,
+    DEFAULT_RENDITIONS,
+    MP3_96K,
+    OPUS_64K,
+    PcmFileWriter,
+    encode_rendition,
+    encode_renditions,
+    segment_hls,
+)
+
+
+def option(command: list[str], name: str) -> str:
+    return command[command.index(name) + 1]
+
+
+@patch("radio_station.sub_agents.mastering.encoding.subprocess.run")
+def test_encode_rendition(mock_run):
+    """生PCMのファイルを入力に、レンディションのコーデック・ビットレート・形式でエンコードすることを確認"""
+
+    def run(command, **_kwargs):
+        assert option(command, "-i") == "master.pcm"
+        assert (option(command, "-f"), option(command, "-ar"), option(command, "-ac")) == ("s16le", "48000", "2")
+        assert option(command, "-c:a") == "aac" and option(command, "-b:a") == "128k"
+        assert option(command, "-movflags") == "+faststart" and command[-2] == "mp4"
+        with open(command[-1], "wb") as f:
+            f.write(b"fake_aac_data")
+        return MagicMock(returncode=0)
+
+    mock_run.side_effect = run
+
+    assert encode_rendition("master.pcm", 48000, 2, AAC_128K) == b"fake_aac_data"
+
+
+@patch("radio_station.sub_agents.mastering.encoding.subprocess.run")
+def test_encode_rendition_failure(mock_run):
+    mock_run.return_value = MagicMock(returncode=1, stderr=b"Unknown encoder 'libopus'")
+
+    with pytest.raises(RuntimeError, match="failed to encode opus_64k: Unknown encoder"):
+        encode_rendition("master.pcm", 48000, 2, OPUS_64K)
+
+
+@patch("radio_station.sub_agents.mastering.encoding.subprocess.run")
+def test_segment_hls(mock_run):
+    """fMP4のHLSに分割し、プレイリスト・初期化セグメント・セグメントを返すことを確認"""
+
+    def run(command, **_kwargs):
+        assert option(command, "-hls_segment_type") == "fmp4" and option(command, "-hls_time") == "4.0"
+        directory = os.path.dirname(command[-1])
+        for name in ["audio_hls.m3u8", "audio_hls_init.mp4", "audio_hls_00000.m4s", "audio_hls_00001.m4s"]:
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(name.encode())
+        return MagicMock(returncode=0)
+
+    mock_run.side_effect = run
+
+    files = segment_hls("master.pcm", 48000, 2, AAC_128K, segment_seconds=4.0)
+
+    assert list(files) == ["audio_hls.m3u8", "audio_hls_00000.m4s", "audio_hls_00001.m4s", "audio_hls_init.mp4"]
+    assert files["audio_hls.m3u8"] == b"audio_hls.m3u8"
+
+
+@pytest.mark.asyncio
+async def test_encode_renditions_runs_in_parallel():
+    """全レンディションとHLSの処理が同時に走ることを確認"""
+    barrier = threading.Barrier(len(DEFAULT_RENDITIONS) + 1, timeout=5)
+
+    def encode(_pcm_path, _frame_rate, _channels, rendition):
+        barrier.wait()
+        return rendition.name.encode()
+
+    def hls(_pcm_path, _frame_rate, _channels, rendition, _segment_seconds):
+        barrier.wait()
+        assert rendition is AAC_128K
+        return {"audio_hls.m3u8": b"#EXTM3U"}
+
+    with (
+        patch("radio_station.sub_agents.mastering.encoding.encode_rendition", side_effect=encode),
+        patch("radio_station.sub_agents.mastering.encoding.segment_hls", side_effect=hls),
+    ):
+        encoded, files = await encode_renditions("master.pcm", 48000, 2, DEFAULT_RENDITIONS, hls_segment_seconds=6.0)
+
+    assert encoded == [b"mp3_96k", b"aac_128k", b"opus_64k"]
+    assert files == {"audio_hls.m3u8": b"#EXTM3U"}
+
+    with patch("radio_station.sub_agents.mastering.encoding.encode_rendition", return_value=b"mp3"):
+        assert await encode_renditions("master.pcm", 48000, 2, [MP3_96K]) == ([b"mp3"], {})
+
+
+def test_pcm_file_writer(tmp_path):
+    path = str(tmp_path / "master.pcm")
+    with PcmFileWriter(path) as writer:
+        writer.write(np.full((10, 2), 0.5, dtype=np.float32))
+        writer.write(np.full((5, 2), -2.0, dtype=np.float32))
+
+    pcm = np.fromfile(path, dtype="<i2").reshape(-1, 2)
+    assert pcm.shape == (15, 2)
+    assert np.all(pcm[:10] == 16383) and np.all(pcm[10:] == -32767)
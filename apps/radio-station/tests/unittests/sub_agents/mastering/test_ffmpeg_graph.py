@@ -0,0 +1,177 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+from radio_station.sub_agents.mastering.ffmpeg_graph import _clip_chains, _envelope_points, _gain_segments, compile_filter_graph, render_pcm
+from radio_station.sub_agents.mastering.mixer import Clip, FadeCurve, ProgramMixer, Timeline
+from radio_station.utils.audio import ffmpeg_path
+
+FRAME_RATE = 1000
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which(ffmpeg_path()) is None, reason="ffmpeg is not installed")
+
+
+@pytest.fixture
+def mixer():
+    mixer = ProgramMixer(frame_rate=FRAME_RATE)
+    mixer.add_opening(np.full((1000, 1), 1000, dtype=np.int16), np.full((300, 2), 0.5, dtype=np.float32), intro=2000)
+    mixer.add_voice_only(np.full((1000, 1), 1000, dtype=np.int16))
+    return mixer
+
+
+def test_envelope_points_match_clip_gain():
+    """エンベロープとフェードを合算した折れ線がClip.gainと一致することを確認"""
+    clip = Clip(offset=0, length=1000, samples=np.zeros((1000, 2), dtype=np.float32))
+    clip.add_envelope([(0, 0.0), (300, 0.0), (500, -12.0)])
+    clip.fade_in = 100
+    clip.fade_out = 200
+
+    xp, fp = _envelope_points(clip)
+    frames = np.arange(1000)
+
+    assert np.allclose(10 ** (np.interp(frames, xp, fp) / 20), clip.gain(0, 1000), rtol=1e-4, atol=1e-7)
+
+
+def test_envelope_points_approximate_equal_power_fades():
+    """等パワーのフェードは折れ線で近似され、振幅の差が小さいことを確認"""
+    clip = Clip(offset=0, length=1000, samples=np.zeros((1000, 2), dtype=np.float32))
+    clip.add_envelope([(0, -6.0)])
+    clip.fade_in = 300
+    clip.fade_out = 300
+    clip.fade_curve = FadeCurve.EQUAL_POWER
+
+    xp, fp = _envelope_points(clip)
+    frames = np.arange(1000)
+
+    assert np.allclose(10 ** (np.interp(frames, xp, fp) / 20), clip.gain(0, 1000), atol=0.02)
+
+
+def test_gain_segments():
+    """折れ線の頂点ごとに区間を分け、区間ごとに入れ子の無い1次式のvolumeになることを確認"""
+    clip = Clip(offset=0, length=1000, samples=np.zeros((1000, 2), dtype=np.float32))
+    clip.add_envelope([(0, 0.0), (300, 0.0), (500, -12.0)])
+
+    segments = _gain_segments(clip, FRAME_RATE)
+
+    assert [start for start, _ in segments] == [0, 300, 500]
+    assert segments[0][1] == "volume=volume=0.000000dB"
+    assert segments[1][1] == "volume=volume='pow(10,(0.000000-60.000000*(t-0.300000))/20)':eval=frame"
+    assert segments[2][1] == "volume=volume=-12.000000dB"
+    assert _gain_segments(Clip(offset=0, length=1000, samples=clip.samples), FRAME_RATE) is None
+
+
+def test_gain_segments_do_not_nest():
+    """頂点が多いフェードでも式が入れ子にならないことを確認"""
+    clip = Clip(offset=0, length=1000, samples=np.zeros((1000, 2), dtype=np.float32))
+    clip.fade_in = 300
+    clip.fade_out = 300
+    clip.fade_curve = FadeCurve.EQUAL_POWER
+
+    segments = _gain_segments(clip, FRAME_RATE)
+
+    assert len(segments) > 60
+    assert all("if(" not in volume for _, volume in segments)
+
+
+def test_compile_filter_graph(mixer):
+    """各クリップが位置・長さ通りに配置され、マスタリングを通って出力されることを確認"""
+    graph = compile_filter_graph(mixer.timeline, [(0, 1), (1, 2), (2, 1), (None, 2)])
+    chains = graph.split(";")
+
+    # 無音のクリップは入力にならない
+    voice, music, second_voice = (next(chain for chain in chains if chain.startswith(f"[{i}:a]")) for i in range(3))
+    master = chains[-1]
+    assert voice.startswith("[0:a]") and "pan=stereo|c0=c0|c1=c0" in voice and "adelay=delays=2000S:all=1" in voice and voice.endswith("[c0]")
+    # ゲインが変化するクリップは区間に分けてvolumeを通し、繋ぎ直す
+    assert "pan=" not in music and "asegment=samples=1000|2000|3000|" in music and music.endswith("[c1s34]")
+    assert "[c1s1]volume=volume='pow(10,(0.000000-34.288399*(t-1.000000))/20)':eval=frame[c1v1]" in chains
+    assert chains[-3].endswith("[c1v34]concat=n=35:v=0:a=1[c1]")
+    assert "adelay=delays=3000S:all=1" in second_voice and second_voice.endswith("[c2]")
+    assert "if(" not in graph
+    assert master.startswith("[c0][c1][c2]amix=inputs=3")
+    assert f"atrim=end_sample={mixer.timeline.length}" in master
+    assert master.endswith("loudnorm=I=-16.0:TP=-1.0:LRA=11,aresample=1000[out]")
+
+
+@requires_ffmpeg
+def test_clip_chains_with_ffmpeg():
+    """ffmpegで区間ごとのゲインを掛けた結果がTimelineの描画と一致することを確認"""
+    frame_rate = 48000
+    samples = np.full((frame_rate, 2), 0.5, dtype=np.float32)
+    timeline = Timeline(frame_rate)
+    clip = timeline.add(Clip(offset=4800, length=frame_rate, samples=samples, start_padding=2400))
+    clip.add_envelope([(0, 0.0), (12000, 0.0), (36000, -20.0)])
+
+    graph = ";".join(_clip_chains(clip, 0, 2, timeline, "c0"))
+    # fmt: off
+    command = [
+        ffmpeg_path(), "-hide_banner", "-loglevel", "error",
+        "-f", "f32le", "-ar", str(frame_rate), "-ac", "2", "-i", "pipe:0",
+        "-filter_complex", graph, "-map", "[c0]", "-f", "f32le", "pipe:1",
+    ]
+    # fmt: on
+    result = subprocess.run(command, input=samples.tobytes(), capture_output=True, check=True)
+    actual = np.frombuffer(result.stdout, dtype="<f4").reshape(-1, 2)
+    expected = timeline.render()
+
+    assert actual.shape == expected.shape
+    assert np.all(actual[: clip.offset + clip.start_padding] == 0)
+    # volumeの式はENVELOPE_BLOCK_FRAMESごとに評価するので、傾きの区間では1ブロック分の差が残る
+    audible = slice(clip.offset + clip.start_padding, clip.end)
+    difference = 20 * np.log10(actual[audible, 0] / expected[audible, 0])
+    assert np.max(np.abs(difference)) < 0.5
+
+
+@requires_ffmpeg
+def test_render_pcm_with_ffmpeg(mixer, tmp_path):
+    """compile_filter_graphのグラフをffmpegで描画でき、タイムラインの長さの生PCMになることを確認"""
+    output = tmp_path / "audio.pcm"
+
+    render_pcm(mixer.timeline, str(output))
+
+    assert output.stat().st_size == mixer.timeline.length * mixer.timeline.channels * 2
+
+
+@patch("radio_station.sub_agents.mastering.ffmpeg_graph.subprocess.run")
+def test_render_pcm(mock_run, mixer, tmp_path):
+    """音源を生PCMで書き出し、1つのffmpegプロセスで生PCMを出力することを確認"""
+    output = tmp_path / "audio.pcm"
+
+    def run(command, **_kwargs):
+        inputs = [command[i + 1] for i, arg in enumerate(command) if arg == "-i"]
+        # 入力は音源ごとのPCMファイル
+        assert [os.path.getsize(path) for path in inputs] == [1000 * 2, 5500 * 2 * 4, 1000 * 2]
+        assert command[-1] == str(output)
+        return MagicMock(returncode=0)
+
+    mock_run.side_effect = run
+
+    render_pcm(mixer.timeline, str(output))
+    mock_run.assert_called_once()
+
+
+@patch("radio_station.sub_agents.mastering.ffmpeg_graph.subprocess.run")
+def test_render_pcm_failure(mock_run, mixer, tmp_path):
+    """ffmpegが失敗した場合にRuntimeErrorを発生させることを確認"""
+    mock_run.return_value = MagicMock(returncode=1, stderr=b"error")
+
+    with pytest.raises(RuntimeError, match="failed to render pcm"):
+        render_pcm(mixer.timeline, str(tmp_path / "audio.pcm"))
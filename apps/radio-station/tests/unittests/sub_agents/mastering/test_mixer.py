@@ -0,0 +1,189 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from radio_station.sub_agents.mastering.mixer import Clip, FadeCurve, LoopingSource, ProgramMixer, Timeline, loop_to_length
+from radio_station.utils.audio import dbfs
+
+FRAME_RATE = 1000  # 1フレーム=1msとして計算しやすくする
+
+
+def tone(frames: int, channels: int, amplitude: float = 0.5) -> np.ndarray:
+    return np.full((frames, channels), amplitude, dtype=np.float32)
+
+
+class TestLoopingSource:
+    """LoopingSourceクラスのユニットテスト"""
+
+    def test_reads_like_repeated_array(self):
+        """継ぎ目のクロスフェードが無い場合、任意の範囲が音源を繰り返した配列と一致することを確認"""
+        samples = np.arange(70, dtype=np.int16).reshape(-1, 2)
+        source = LoopingSource(samples, 200)
+        expected = np.resize(samples, (200, 2))
+
+        assert source.shape == (200, 2) and source.dtype == np.int16
+        for start, stop in [(0, 200), (10, 30), (30, 40), (34, 36), (150, 250), (5, 5)]:
+            assert np.array_equal(source[start:stop], expected[start:stop])
+        # 1周に収まる範囲はコピーしない
+        assert np.shares_memory(source[3:20], samples)
+
+    def test_seam_is_crossfaded(self):
+        """2周目以降の先頭は前の周の末尾とクロスフェードされ、それ以外は音源のままであることを確認"""
+        samples = np.linspace(-0.5, 0.5, 100, dtype=np.float32)[:, None]
+        source = LoopingSource(samples, 300, seam=10)
+        out = source[0:300]
+
+        # 1周はseam分短くなる
+        assert source.period == 90
+        assert np.array_equal(out[:90], samples[:90])
+        x = (np.arange(10) + 0.5) / 10
+        assert np.allclose(out[90:100, 0], samples[:10, 0] * x + samples[90:, 0] * (1 - x))
+        assert np.array_equal(out[100:180], samples[10:90])
+        assert np.allclose(out[180:190], out[90:100])
+
+    def test_loop_to_length_does_not_copy(self):
+        samples = tone(300, 2)
+
+        assert np.shares_memory(loop_to_length(samples, 200), samples)
+        assert isinstance(loop_to_length(samples, 1000, seam=10), LoopingSource)
+
+
+class TestTimeline:
+    """Timelineクラスのユニットテスト"""
+
+    def test_render_sums_clips_by_offset(self):
+        """クリップがフレーム位置通りに加算されることを確認"""
+        timeline = Timeline(FRAME_RATE)
+        timeline.add(Clip(offset=0, length=100, samples=tone(100, 1, 0.25)))
+        timeline.add(Clip(offset=50, length=100, samples=tone(100, 2, 0.5)))
+
+        out = timeline.render()
+
+        assert out.shape == (150, 2)
+        assert np.allclose(out[:50], 0.25)
+        assert np.allclose(out[50:100], 0.75)
+        assert np.allclose(out[100:], 0.5)
+
+    def test_render_window(self):
+        """一部の範囲だけを描画しても全体描画と一致することを確認"""
+        timeline = Timeline(FRAME_RATE)
+        clip = timeline.add(Clip(offset=10, length=200, samples=tone(180, 2), start_padding=20))
+        clip.add_envelope([(0, 0.0), (200, -20.0)])
+
+        full = timeline.render()
+        window = timeline.render(start=60, length=70)
+
+        assert np.allclose(full[60:130], window)
+
+    def test_envelope_and_fades(self):
+        """エンベロープとフェードがdBで適用されることを確認"""
+        timeline = Timeline(FRAME_RATE)
+        clip = timeline.add(Clip(offset=0, length=100, samples=tone(100, 2, 1.0)))
+        clip.add_envelope([(0, -20.0)])
+        clip.fade_out = 10
+
+        out = timeline.render()
+
+        assert out[0, 0] == pytest.approx(0.1, rel=1e-3)
+        assert out[-1, 0] < 1e-6
+
+
+class TestProgramMixer:
+    """ProgramMixerクラスのユニットテスト"""
+
+    def test_music_is_crossfaded(self):
+        """背景音楽が前の音楽とクロスフェード分だけ重なることを確認"""
+        mixer = ProgramMixer(frame_rate=FRAME_RATE)
+        mixer.add_content(tone(1000, 1), tone(300, 2))
+        mixer.add_content(tone(1000, 1), tone(300, 2))
+
+        first, second = [clip for clip in mixer.timeline.clips if clip.start_padding == 0 and clip.samples.shape[1] == 2]
+
+        assert second.offset == first.end - 2500
+        assert first.fade_out == 2500
+        assert second.fade_in == 2500
+        # トークは隙間なく連結される
+        assert mixer.voice_position == 2000
+        assert mixer.timeline.length == (1000 + 5000) * 2 - 2500
+
+    def test_crossfade_keeps_power(self):
+        """等パワーのクロスフェードでは重なる区間のゲインの2乗和が1になり、相関の無い音楽の音量が落ち込まないことを確認"""
+        rng = np.random.default_rng(0)
+        mixer = ProgramMixer(frame_rate=FRAME_RATE)
+        for _ in range(2):
+            mixer.add_content(tone(1000, 1), (rng.standard_normal((6000, 2)) * 0.1).astype(np.float32), voice_level=-20.0, music_level=-20.0)
+
+        first, second = [clip for clip in mixer.timeline.clips if clip.samples.shape[1] == 2]
+        overlap = np.arange(second.offset, first.end)
+        power = first.gain(overlap[0] - first.offset, overlap[-1] + 1 - first.offset) ** 2 + second.gain(0, len(overlap)) ** 2
+        assert np.allclose(power / power[0], 1.0, atol=1e-4)
+
+        music = Timeline(FRAME_RATE)
+        music.add(first)
+        music.add(second)
+        out = music.render()
+        assert dbfs(out[second.offset : first.end]) == pytest.approx(dbfs(out[: second.offset]), abs=0.3)
+
+    def test_linear_db_crossfade(self):
+        """pydubと同じdBで直線のクロスフェードも選べることを確認"""
+        mixer = ProgramMixer(frame_rate=FRAME_RATE, crossfade_curve=FadeCurve.LINEAR_DB)
+        mixer.add_content(tone(1000, 1), tone(300, 2))
+        mixer.add_content(tone(1000, 1), tone(300, 2))
+
+        first, second = [clip for clip in mixer.timeline.clips if clip.samples.shape[1] == 2]
+
+        assert first.fade_curve is FadeCurve.LINEAR_DB
+        # クロスフェードの中央ではどちらも -60dB
+        assert 20 * np.log10(second.gain(1250, 1251)[0]) == pytest.approx(20 * np.log10(second.gain(2500, 2501)[0]) - 60, abs=0.1)
+
+    def test_content_music_level(self):
+        """背景音楽がトークより10dB小さくなることを確認"""
+        mixer = ProgramMixer(frame_rate=FRAME_RATE)
+        music = tone(300, 2, 0.8)
+        voice = tone(1000, 1, 0.2)
+        mixer.add_content(voice, music)
+
+        music_clip = mixer.timeline.clips[-1]
+        rendered = Timeline(FRAME_RATE)
+        rendered.add(music_clip)
+        out = rendered.render()
+
+        assert dbfs(out[:1000]) == pytest.approx(dbfs(voice) - 10, abs=0.01)
+
+    def test_opening_and_ending(self):
+        """オープニングは音楽から始まり、エンディングは無音でフェードアウトすることを確認"""
+        mixer = ProgramMixer(frame_rate=FRAME_RATE)
+        mixer.add_opening(tone(1000, 1, 0.1), tone(300, 2, 0.5), intro=2000)
+        mixer.add_ending(tone(1000, 1, 0.1), tone(300, 2, 0.5), outro=2000)
+
+        out = mixer.timeline.render()
+
+        # イントロ中は元の音量の音楽だけが流れる
+        assert np.allclose(out[:900], 0.5)
+        # トークはイントロの後から始まる
+        assert mixer.timeline.clips[0].offset + mixer.timeline.clips[0].start_padding == 2000
+        # 最後はフェードアウトで無音になる
+        assert np.abs(out[-1]).max() < 1e-4
+
+    def test_silent_segment_keeps_timing(self):
+        """背景音楽が無いセグメントでも音楽トラックの長さが確保されることを確認"""
+        mixer = ProgramMixer(frame_rate=FRAME_RATE)
+        mixer.add_voice_only(tone(1000, 1))
+
+        out = mixer.timeline.render()
+
+        assert len(out) == 1000 + 5000
+        assert np.allclose(out[1000:], 0)
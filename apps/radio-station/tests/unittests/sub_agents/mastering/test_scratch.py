@@ -0,0 +1,70 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from radio_station.sub_agents.mastering.mixer import Timeline
+from radio_station.sub_agents.mastering.scratch import ScratchSpace, scratch_memory_budget
+from radio_station.sub_agents.mastering.stems import encode_stem, placeholder, stem_clip
+
+
+def test_arrays_beyond_budget_are_memmapped(tmp_path):
+    """予算内の配列はメモリに、超えた配列はmemmapに置かれ、withを抜けるとファイルが削除されることを確認"""
+    with ScratchSpace(memory_budget=1000, directory=str(tmp_path)) as scratch:
+        small = scratch.zeros((100, 2), np.float32)
+        large = scratch.zeros((1000, 2), np.float32)
+
+        assert not isinstance(small, np.memmap)
+        assert isinstance(large, np.memmap)
+        assert np.all(large == 0)
+        assert scratch.in_memory == 800
+        assert len(list(tmp_path.iterdir())) == 1
+
+    assert not list(tmp_path.iterdir())
+
+
+def test_store_copies_only_beyond_budget(tmp_path):
+    """予算内の配列と仮の音源はコピーせず、予算を超えた配列だけをmemmapにコピーすることを確認"""
+    samples = np.arange(2000, dtype=np.int16).reshape(-1, 2)
+
+    with ScratchSpace(memory_budget=samples.nbytes, directory=str(tmp_path)) as scratch:
+        assert scratch.store(samples) is samples
+        assert scratch.store(placeholder(10**9, 2)).shape == (10**9, 2)
+
+        stored = scratch.store(samples)
+        assert isinstance(stored, np.memmap)
+        assert np.array_equal(stored, samples)
+
+
+def test_render_into_memmapped_stem(tmp_path):
+    """memmapに置いたステムを読み、memmapのバッファへ窓ごとに描画しても一括の描画と一致することを確認"""
+    samples = np.stack([np.linspace(-1, 1, 1000), np.linspace(1, -1, 1000)], axis=1).astype(np.float32)
+
+    with ScratchSpace(memory_budget=0, directory=str(tmp_path)) as scratch:
+        timeline = Timeline(1000, 2)
+        timeline.add(stem_clip(scratch.store_bytes(encode_stem(samples, 1000)), offset=100))
+        out = scratch.empty((timeline.length, 2), np.float32)
+        for start in range(0, timeline.length, 300):
+            timeline.render(start, out=out[start : start + 300])
+
+        assert isinstance(out, np.memmap)
+        assert np.array_equal(out, timeline.render())
+
+
+def test_scratch_memory_budget(monkeypatch):
+    monkeypatch.delenv("MASTERING_MEMORY_BUDGET_MB", raising=False)
+    assert scratch_memory_budget() is None
+
+    monkeypatch.setenv("MASTERING_MEMORY_BUDGET_MB", "1.5")
+    assert scratch_memory_budget() == 1536 * 1024
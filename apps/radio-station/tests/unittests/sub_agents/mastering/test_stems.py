@@ -0,0 +1,79 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from radio_station.sub_agents.mastering.mixer import ProgramMixer, Timeline
+from radio_station.sub_agents.mastering.stems import encode_stem, placeholder, stem_clip, stem_key, stem_ranges
+
+FRAME_RATE = 1000
+
+
+def build(voices: list[np.ndarray]) -> tuple[ProgramMixer, list, dict[int, str]]:
+    """トークごとにBGMを付けて並べ、トークのクリップとクリップのidから音源のハッシュへの対応を返す"""
+    mixer = ProgramMixer(frame_rate=FRAME_RATE)
+    voice_clips = []
+    sources = {}
+    for i, voice in enumerate(voices):
+        placed = len(mixer.timeline.clips)
+        # 仮の音源でも同じゲインになるよう、レベルは統計の値を渡す
+        mixer.add_content(voice, np.full((300, 2), 0.2, dtype=np.float32), voice_level=-30.0, music_level=-14.0)
+        voice_clip, music_clip = mixer.timeline.clips[placed:]
+        voice_clips.append(voice_clip)
+        sources[id(voice_clip)] = f"voice{i}:{int(voice[0, 0])}"
+        sources[id(music_clip)] = "music"
+    return mixer, voice_clips, sources
+
+
+def test_stem_round_trip():
+    """16bitに量子化したステムを配置すると、1.0を超える値も含めて元の音声に戻ることを確認"""
+    samples = np.stack([np.linspace(-1.5, 1.5, 1000), np.linspace(0.5, -0.5, 1000)], axis=1).astype(np.float32)
+
+    timeline = Timeline(FRAME_RATE, 2)
+    timeline.add(stem_clip(encode_stem(samples, FRAME_RATE), offset=200))
+
+    rendered = timeline.render()
+    assert len(rendered) == 1200
+    assert np.all(rendered[:200] == 0)
+    assert np.allclose(rendered[200:], samples, atol=1.5 / 32767)
+
+
+def test_stem_key_changes_only_for_overlapping_ranges():
+    """音源が変わると、その音源に重なる区間のキーだけが変わることを確認"""
+    voice = np.full((1000, 1), 1000, dtype=np.int16)
+    mixer, voice_clips, sources = build([voice, voice, voice])
+    ranges = stem_ranges(mixer.timeline, voice_clips)
+    keys = [stem_key(mixer.timeline, start, stop, sources) for start, stop in ranges]
+
+    changed_mixer, changed_clips, changed_sources = build([voice, voice, np.full((1000, 1), 2000, dtype=np.int16)])
+    changed = [stem_key(changed_mixer.timeline, start, stop, changed_sources) for start, stop in stem_ranges(changed_mixer.timeline, changed_clips)]
+
+    assert ranges[0][0] == 0 and ranges[-1][1] == mixer.timeline.length
+    assert len(set(keys)) == 3
+    assert changed[:2] == keys[:2]
+    assert changed[2] != keys[2]
+
+
+def test_placeholder_layout_matches_real_layout():
+    """仮の音源で計算した配置とキーが実際の音源の場合と一致することを確認"""
+    voices = [np.full((1000, 1), 1000, dtype=np.int16), np.full((700, 1), 1000, dtype=np.int16)]
+    mixer, voice_clips, sources = build(voices)
+    layout, layout_clips, layout_sources = build([placeholder(len(voice), 1) for voice in voices])
+    # 仮の音源ではハッシュを変えないようにする
+    layout_sources = dict(zip(layout_sources, sources.values(), strict=True))
+
+    assert stem_ranges(layout.timeline, layout_clips) == stem_ranges(mixer.timeline, voice_clips)
+    assert [stem_key(layout.timeline, start, stop, layout_sources) for start, stop in stem_ranges(layout.timeline, layout_clips)] == [
+        stem_key(mixer.timeline, start, stop, sources) for start, stop in stem_ranges(mixer.timeline, voice_clips)
+    ]
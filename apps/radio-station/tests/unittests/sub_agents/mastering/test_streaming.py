@@ -0,0 +1,71 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from radio_station.sub_agents.mastering.dsp import MasteringChain
+from radio_station.sub_agents.mastering.mixer import ProgramMixer
+from radio_station.sub_agents.mastering.streaming import master_windows, render_windows, stream_mastering
+from radio_station.utils.loudness import analyze, loudness_gain
+
+FRAME_RATE = 8000
+
+
+@pytest.fixture
+def mixer():
+    """クロスフェードを含む番組のタイムライン"""
+    rng = np.random.default_rng(0)
+    mixer = ProgramMixer(frame_rate=FRAME_RATE)
+    for _ in range(3):
+        voice = (rng.standard_normal((FRAME_RATE * 3, 1)) * 0.3 * 32767).astype(np.int16)
+        music = (rng.standard_normal((FRAME_RATE, 2)) * 0.5).astype(np.float32)
+        mixer.add_content(voice, music)
+    return mixer
+
+
+def test_render_windows_matches_whole(mixer):
+    """窓ごとに描画しても一括描画と一致することを確認"""
+    windows = list(render_windows(mixer.timeline, window_ms=700))
+
+    assert max(len(window) for window in windows) == 5600
+    assert np.allclose(np.concatenate(windows), mixer.timeline.render(), atol=1e-6)
+
+
+def test_master_windows_matches_whole(mixer):
+    """窓ごとのマスタリングが一括処理と一致することを確認"""
+    whole = mixer.timeline.render()
+    chain = MasteringChain(FRAME_RATE)
+    expected = np.concatenate([chain.process(whole), chain.flush()])
+
+    assert np.allclose(np.concatenate(list(master_windows(mixer.timeline, window_ms=700))), expected, atol=1e-5)
+
+
+def test_stream_mastering_normalizes_loudness(mixer):
+    """エンコーダへ書き込まれる音声が一括でのマスタリング結果と一致し、ラウドネスが揃うことを確認"""
+    encoder = MagicMock()
+
+    stream_mastering(mixer.timeline, encoder, window_ms=700)
+
+    written = np.concatenate([call.args[0] for call in encoder.write.call_args_list])
+    chain = MasteringChain(FRAME_RATE)
+    mastered = np.concatenate([chain.process(mixer.timeline.render()), chain.flush()])
+    expected = mastered * np.float32(loudness_gain(analyze(mastered, FRAME_RATE)))
+    assert len(written) == mixer.timeline.length
+    assert np.allclose(written, expected, atol=1e-5)
+    stats = analyze(written, FRAME_RATE)
+    # ラウドネスが -16LUFS に揃うか、トゥルーピークが -1dBTP で頭打ちになる
+    assert stats.integrated == pytest.approx(-16, abs=0.1) or stats.true_peak == pytest.approx(-1, abs=0.1)
@@ -0,0 +1,80 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from radio_station.sub_agents.mastering.waveform import WAVEFORM_ARTIFACT_KEY, Waveform, analyze_waveform
+from radio_station.utils.audio import to_pcm16
+from radio_station.utils.loudness import analyze
+
+FRAME_RATE = 48000
+
+
+def write_pcm(path, samples: np.ndarray) -> str:
+    to_pcm16(samples).tofile(path)
+    return str(path)
+
+
+def test_analyze_waveform(tmp_path):
+    """複数の解像度のピークと、正確な長さ・ラウドネスを求めることを確認"""
+    t = np.arange(int(2.05 * FRAME_RATE)) / FRAME_RATE
+    left = 0.5 * np.sin(2 * np.pi * 440 * t)
+    # 1秒目からの右チャンネルだけ大きくする
+    right = np.where(t >= 1.0, 0.9, 0.25) * np.sin(2 * np.pi * 440 * t)
+    samples = np.stack([left, right], axis=1).astype(np.float32)
+    path = write_pcm(tmp_path / "master.pcm", samples)
+
+    waveform = analyze_waveform(path, FRAME_RATE, 2)
+
+    assert (waveform.frames, waveform.channels, waveform.duration_seconds) == (len(samples), 2, len(samples) / FRAME_RATE)
+    stats = analyze(to_pcm16(samples), FRAME_RATE)
+    assert waveform.integrated_loudness == pytest.approx(stats.integrated, abs=1e-6)
+    assert waveform.true_peak == pytest.approx(stats.true_peak, abs=1e-6)
+
+    assert [level.samples_per_peak for level in waveform.levels] == [4800, 24000, 96000]
+    # 端数の区間も1つのピークになる
+    assert [len(level.data) // 2 for level in waveform.levels] == [21, 5, 2]
+    fine = np.array(waveform.levels[0].data).reshape(-1, 2)
+    # 全チャンネルの最小・最大を8bitにしたもの
+    assert np.all(fine[:10, 1] == 63) and np.all(fine[:10, 0] == -64)
+    assert np.all(fine[10:, 1] == 115) and np.all(fine[10:, 0] == -116)
+    coarse = np.array(waveform.levels[2].data).reshape(-1, 2)
+    assert coarse.tolist() == [[-116, 115], [-116, 115]]
+
+
+def test_analyze_waveform_block_boundaries(tmp_path):
+    """読み込みの単位をまたいでも、ピークが一括で求めた場合と同じになることを確認"""
+    rng = np.random.default_rng(0)
+    samples = rng.uniform(-1, 1, size=(4800 * 1024 + 12345, 1)).astype(np.float32)
+    path = write_pcm(tmp_path / "master.pcm", samples)
+
+    waveform = analyze_waveform(path, FRAME_RATE, 1, resolutions_ms=(100,))
+
+    pcm = to_pcm16(samples)[:, 0]
+    expected = [(int(chunk.min()) >> 8, int(chunk.max()) >> 8) for chunk in np.split(pcm, np.arange(4800, len(pcm), 4800))]
+    assert np.array(waveform.levels[0].data).reshape(-1, 2).tolist() == [list(pair) for pair in expected]
+
+
+def test_analyze_waveform_silence_and_empty(tmp_path):
+    waveform = analyze_waveform(write_pcm(tmp_path / "silence.pcm", np.zeros((FRAME_RATE, 2), dtype=np.float32)), FRAME_RATE, 2)
+    assert waveform.integrated_loudness is None and waveform.true_peak is None
+    assert waveform.summary() == {"artifact_key": WAVEFORM_ARTIFACT_KEY, **waveform.model_dump(mode="json", exclude={"levels"})}
+    assert Waveform.model_validate_json(waveform.model_dump_json()) == waveform
+
+    empty = analyze_waveform(write_pcm(tmp_path / "empty.pcm", np.zeros((0, 2), dtype=np.float32)), FRAME_RATE, 2)
+    assert empty.frames == 0 and all(level.data == [] for level in empty.levels)
+
+    with pytest.raises(ValueError, match="multiples"):
+        analyze_waveform(str(tmp_path / "empty.pcm"), FRAME_RATE, 2, resolutions_ms=(100, 250))
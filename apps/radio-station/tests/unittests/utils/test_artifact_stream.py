@@ -0,0 +1,122 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+
+import numpy as np
+import pytest
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.sessions import InMemorySessionService
+
+from radio_station.utils.artifact import load_artifact
+from radio_station.utils.artifact_stream import ChunkUpload, PcmArtifactStream
+from radio_station.utils.pcm import decode_pcm
+
+FRAME_RATE = 100
+
+
+async def make_context() -> InvocationContext:
+    session_service = InMemorySessionService()
+    session = await session_service.create_session(app_name="test", user_id="listener")
+    return InvocationContext(session_service=session_service, artifact_service=InMemoryArtifactService(), invocation_id="test", agent=BaseAgent(name="test"), session=session)
+
+
+def audio(start: int, frames: int) -> np.ndarray:
+    return np.arange(start * 2, (start + frames) * 2, dtype=np.int16).reshape(-1, 2)
+
+
+class RecordingUpload(ChunkUpload):
+    """アップロードしたチャンクを保持する。ローカルのスプールが消えた別のインスタンスで開き直すのに使う"""
+
+    def __init__(self, ctx: InvocationContext):
+        super().__init__(ctx)
+        self.chunks: dict[int, bytes] = {}
+
+    async def list_chunks(self) -> list[tuple[int, int]]:
+        return sorted((offset, len(data)) for offset, data in self.chunks.items())
+
+    async def upload(self, offset: int, data: bytes) -> None:
+        self.chunks[offset] = data
+
+    async def download(self, offset: int) -> bytes:
+        return self.chunks[offset]
+
+    async def discard(self) -> None:
+        self.chunks.clear()
+
+
+@pytest.mark.asyncio
+async def test_finalize_saves_trimmed_samples_and_removes_spool(tmp_path):
+    """チャンクを追記したスプールから切り出した範囲をアーティファクトとして保存し、スプールを消すことを確認"""
+    ctx = await make_context()
+    async with PcmArtifactStream(ctx, "music.pcm", "plan", FRAME_RATE, channels=2, directory=str(tmp_path)) as stream:
+        for i in range(5):
+            stream.write(audio(i * 30, 30).tobytes())
+        samples = stream.samples()
+        assert isinstance(samples, np.memmap)
+        assert np.array_equal(samples, audio(0, 150))
+
+        assert await stream.finalize(samples[10:130]) == 0
+        assert not os.path.exists(stream.path)
+        assert await stream.copy("user:cache.pcm") == 0
+
+    decoded, header = decode_pcm((await load_artifact(ctx, "music.pcm")).inline_data.data)
+    assert np.array_equal(decoded, audio(10, 120))
+    assert header.frame_rate == FRAME_RATE and header.frames == 120
+    assert (await load_artifact(ctx, "user:cache.pcm")).inline_data.data == (await load_artifact(ctx, "music.pcm")).inline_data.data
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.asyncio
+async def test_reopen_resumes_from_spool_of_same_tag(tmp_path):
+    """finalizeせずに閉じたスプールは、同じtagで開き直すと続きから書けることを確認"""
+    ctx = await make_context()
+    async with PcmArtifactStream(ctx, "music.pcm", "plan", FRAME_RATE, channels=2, directory=str(tmp_path)) as stream:
+        stream.write(audio(0, 40).tobytes())
+        # 途中で切れたフレーム
+        stream.write(b"\x01\x02")
+
+    async with PcmArtifactStream(ctx, "music.pcm", "other plan", FRAME_RATE, channels=2, directory=str(tmp_path)) as other:
+        assert other.frames == 0
+
+    async with PcmArtifactStream(ctx, "music.pcm", "plan", FRAME_RATE, channels=2, directory=str(tmp_path)) as stream:
+        assert stream.frames == 40
+        stream.write(audio(40, 20).tobytes())
+        assert np.array_equal(stream.samples(), audio(0, 60))
+
+
+@pytest.mark.asyncio
+async def test_uploads_chunks_and_restores_without_local_spool(tmp_path):
+    """chunk_bytesごとにアップロードし、ローカルのスプールが無い場合はアップロード済みのチャンクから戻すことを確認"""
+    ctx = await make_context()
+    upload = RecordingUpload(ctx)
+    async with PcmArtifactStream(ctx, "music.pcm", "plan", FRAME_RATE, channels=2, directory=str(tmp_path / "a"), chunk_bytes=100, upload=upload) as stream:
+        for i in range(7):
+            stream.write(audio(i * 10, 10).tobytes())
+            await asyncio.sleep(0.01)
+    # 280byteのうち、100byteずつのチャンクだけをアップロードする
+    assert await upload.list_chunks() == [(0, 100), (100, 100)]
+
+    async with PcmArtifactStream(ctx, "music.pcm", "plan", FRAME_RATE, channels=2, directory=str(tmp_path / "b"), chunk_bytes=100, upload=upload) as stream:
+        assert stream.frames == 50 and stream.uploaded == 200
+        assert np.array_equal(stream.samples(), audio(0, 50))
+        stream.write(audio(50, 20).tobytes())
+        await stream.finalize(stream.samples())
+
+    assert upload.chunks == {}
+    decoded, _ = decode_pcm((await load_artifact(ctx, "music.pcm")).inline_data.data)
+    assert np.array_equal(decoded, audio(0, 70))
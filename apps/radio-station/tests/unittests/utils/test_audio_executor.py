@@ -0,0 +1,65 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from radio_station.utils.audio_executor import audio_executor, audio_executor_workers, configure_audio_executor, run_audio
+from radio_station.utils.loudness import analyze
+
+
+@pytest.fixture(autouse=True)
+def reset_audio_executor():
+    yield
+    configure_audio_executor(None)
+
+
+def sine(seconds: float, frame_rate: int = 24000) -> np.ndarray:
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    return (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32).reshape(-1, 1)
+
+
+@pytest.mark.asyncio
+async def test_run_audio_in_process_pool():
+    """関数と配列をワーカープロセスへ渡し、スレッドで実行した場合と同じ結果を返すことを確認"""
+    configure_audio_executor(2)
+    samples = sine(1.0)
+
+    pid, stats = await asyncio.gather(run_audio(os.getpid), run_audio(analyze, samples, 24000))
+
+    assert pid != os.getpid()
+    assert audio_executor() is not None
+    assert stats == analyze(samples, 24000)
+
+
+@pytest.mark.asyncio
+async def test_run_audio_in_thread():
+    """ワーカー数が0の場合はプロセスを使わず、スレッドで実行することを確認"""
+    configure_audio_executor(0)
+
+    assert audio_executor() is None
+    assert await run_audio(threading.get_ident) != threading.get_ident()
+    assert await run_audio(os.getpid) == os.getpid()
+
+
+def test_audio_executor_workers(monkeypatch):
+    monkeypatch.setenv("AUDIO_EXECUTOR_WORKERS", "3")
+    assert audio_executor_workers() == 3
+
+    configure_audio_executor(0)
+    assert audio_executor_workers() == 0
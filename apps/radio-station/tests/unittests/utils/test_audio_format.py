@@ -0,0 +1,53 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from radio_station.utils.audio_format import DEFAULT_MASTER_FRAME_RATE, master_frame_rate, resample, resampled_length
+
+
+@pytest.mark.parametrize(("src_rate", "frames"), [(22050, 22050), (24000, 12345), (44100, 7), (48000, 1000)])
+def test_resampled_length_matches_resample(src_rate, frames):
+    """レイアウトの計算に使うフレーム数が実際にリサンプルした長さと一致することを確認"""
+    samples = np.zeros((frames, 2), dtype=np.int16)
+
+    assert len(resample(samples, src_rate, 48000)) == resampled_length(frames, src_rate, 48000)
+
+
+def test_resample_keeps_tone_without_aliasing():
+    """24kHzの正弦波を48kHzに変換しても振幅と周波数が保たれることを確認"""
+    t = np.arange(24000) / 24000
+    samples = (np.sin(2 * np.pi * 1000 * t) * 0.5 * 32767).astype(np.int16)[:, None]
+
+    resampled = resample(samples, 24000, 48000)
+
+    assert resampled.dtype == np.float32
+    expected = np.sin(2 * np.pi * 1000 * np.arange(48000) / 48000) * 0.5
+    # フィルタの過渡応答がある両端を除いて比較する
+    assert np.allclose(resampled[1000:-1000, 0], expected[1000:-1000], atol=1e-3)
+
+
+def test_resample_same_rate_returns_input():
+    samples = np.zeros((10, 1), dtype=np.int16)
+
+    assert resample(samples, 24000, 24000) is samples
+
+
+def test_master_frame_rate(monkeypatch):
+    monkeypatch.delenv("MASTER_FRAME_RATE", raising=False)
+    assert master_frame_rate() == DEFAULT_MASTER_FRAME_RATE
+
+    monkeypatch.setenv("MASTER_FRAME_RATE", "44100")
+    assert master_frame_rate() == 44100
@@ -0,0 +1,92 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from radio_station.utils.beat_grid import BeatGrid, analyze_beats, trim_to_bars
+from radio_station.utils.loudness import analyze
+
+FRAME_RATE = 48000
+
+
+def click_track(bpm: float, offset: float, seconds: float = 20) -> np.ndarray:
+    """小節の頭を強くしたクリックの列。offset秒から始まる"""
+    rng = np.random.default_rng(0)
+    track = rng.standard_normal(int(seconds * FRAME_RATE)).astype(np.float32) * 0.05
+    t = np.arange(2000) / FRAME_RATE
+    beat = 60 / bpm * FRAME_RATE
+    for i in range(int((len(track) - 2000 - offset * FRAME_RATE) // beat) + 1):
+        start = int(round(offset * FRAME_RATE + i * beat))
+        downbeat = i % 4 == 0
+        track[start : start + 2000] += (1.0 if downbeat else 0.4) * np.sin(2 * np.pi * (1000 if downbeat else 600) * t) * np.exp(-t * 40)
+    return np.repeat(track[:, None] * 0.5, 2, axis=1)
+
+
+@pytest.mark.parametrize(("bpm", "offset", "hint"), [(120, 0.3, None), (95, 0.1, None), (140, 0.77, 140)])
+def test_analyze_beats(bpm, offset, hint):
+    """テンポと最初の小節の頭を推定できることを確認"""
+    grid = analyze_beats(click_track(bpm, offset), FRAME_RATE, bpm_hint=hint)
+
+    assert grid.bpm == pytest.approx(bpm, abs=0.5)
+    assert grid.bar_frames == pytest.approx(60 / bpm * 4 * FRAME_RATE, rel=0.005)
+    # オンセットの間隔(10ms)の2倍程度の精度で小節の頭に合う
+    assert grid.first_downbeat / FRAME_RATE == pytest.approx(offset, abs=0.025)
+
+
+def test_trim_to_bars():
+    """最初の小節の頭から小節単位で、コピーせずに切り出すことを確認"""
+    samples = np.zeros((FRAME_RATE * 10, 2), dtype=np.int16)
+    grid = BeatGrid(frame_rate=FRAME_RATE, bpm=100, first_downbeat=1000, bar_frames=60 / 100 * 4 * FRAME_RATE)
+
+    trimmed, trimmed_grid = trim_to_bars(samples, grid)
+
+    assert trimmed_grid.bars == 4
+    assert trimmed_grid.first_downbeat == 0
+    assert len(trimmed) == 4 * 115200
+    assert np.shares_memory(trimmed, samples)
+
+
+def test_bars_to_frames():
+    grid = BeatGrid(frame_rate=FRAME_RATE, bpm=120, first_downbeat=0, bar_frames=96000)
+
+    assert grid.bars_to_frames(4) == 384000
+    assert grid.bars_to_frames(4, frame_rate=24000) == 192000
+    assert grid.downbeat(3) == 288000
+
+
+def test_analyze_long_spool_with_bounded_memory(tmp_path):
+    """memmapの長い音源でも、ビートグリッドとラウドネスの解析が音源全体をfloatにしないことを確認"""
+    clip = (click_track(120, 0.3) * 32767).astype(np.int16)
+    # 4分のスプール(約46MB)。全体をfloat64にすると4倍になる
+    spool = np.memmap(tmp_path / "spool.pcm", dtype="<i2", mode="w+", shape=(len(clip) * 12, 2))
+    for i in range(12):
+        spool[i * len(clip) : (i + 1) * len(clip)] = clip
+    spool.flush()
+
+    tracemalloc.start()
+    try:
+        grid = analyze_beats(spool, FRAME_RATE, bpm_hint=120)
+        trimmed, grid = trim_to_bars(spool, grid)
+        stats = analyze(trimmed, FRAME_RATE)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert grid.bpm == pytest.approx(120, abs=0.5)
+    assert stats.frames == len(trimmed)
+    # 作業用の配列はブロックの大きさで決まり、スプールの半分にも満たない
+    assert peak < spool.nbytes / 2
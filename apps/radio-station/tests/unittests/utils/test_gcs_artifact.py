@@ -0,0 +1,165 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections.abc import Callable
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.artifacts import GcsArtifactService
+from google.adk.sessions import InMemorySessionService
+from google.api_core.exceptions import PreconditionFailed
+from google.genai import types
+
+from radio_station.utils.artifact import save_artifact
+from radio_station.utils.artifact_stream import PcmArtifactStream
+from radio_station.utils.gcs_artifact import GcsArtifactWriter
+from radio_station.utils.pcm import PCM_MIME_TYPE, decode_pcm
+
+FRAME_RATE = 100
+
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def content_type(self) -> str:
+        return self.bucket.objects[self.name][1]
+
+    @property
+    def size(self) -> int:
+        return len(self.bucket.objects[self.name][0])
+
+    def upload_from_string(self, data: bytes, content_type: str, if_generation_match: int | None = None) -> None:
+        self.bucket.create(self.name, data, content_type, if_generation_match)
+
+    def upload_from_filename(self, path: str, content_type: str, if_generation_match: int | None = None) -> None:
+        with open(path, "rb") as f:
+            self.bucket.create(self.name, f.read(), content_type, if_generation_match)
+
+    def download_as_bytes(self) -> bytes:
+        return self.bucket.objects[self.name][0]
+
+    def delete(self) -> None:
+        del self.bucket.objects[self.name]
+
+
+class FakeBucket:
+    """オブジェクトを (内容, content_type) で持つバケット。before_createで書き込みの直前に別の書き込みを割り込ませる"""
+
+    def __init__(self):
+        self.objects: dict[str, tuple[bytes, str]] = {}
+        self.before_create: Callable[[str], None] | None = None
+
+    def blob(self, name: str, **_kwargs) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def create(self, name: str, data: bytes, content_type: str, if_generation_match: int | None) -> None:
+        if self.before_create is not None:
+            before_create, self.before_create = self.before_create, None
+            before_create(name)
+        if if_generation_match == 0 and name in self.objects:
+            raise PreconditionFailed(f"{name} already exists")
+        self.objects[name] = (data, content_type)
+
+    def copy_blob(self, blob: FakeBlob, destination: "FakeBucket", name: str, if_generation_match: int | None = None) -> None:
+        destination.create(name, *self.objects[blob.name], if_generation_match)
+
+
+class FakeClient:
+    def __init__(self, **_kwargs):
+        self.fake_bucket = FakeBucket()
+
+    def bucket(self, _name: str) -> FakeBucket:
+        return self.fake_bucket
+
+    def list_blobs(self, bucket: FakeBucket, prefix: str) -> list[FakeBlob]:
+        return [FakeBlob(bucket, name) for name in sorted(bucket.objects) if name.startswith(prefix)]
+
+
+async def make_context() -> InvocationContext:
+    """本物のGcsArtifactServiceを、バケットだけを置き換えて使うInvocationContext"""
+    with patch("google.adk.artifacts.gcs_artifact_service.storage.Client", FakeClient):
+        service = GcsArtifactService("bucket")
+    session_service = InMemorySessionService()
+    session = await session_service.create_session(app_name="test", user_id="listener")
+    return InvocationContext(session_service=session_service, artifact_service=service, invocation_id="test", agent=BaseAgent(name="test"), session=session)
+
+
+async def load(ctx: InvocationContext, filename: str, version: int | None = None) -> types.Part | None:
+    return await ctx.artifact_service.load_artifact(app_name="test", user_id="listener", session_id=ctx.session.id, filename=filename, version=version)
+
+
+async def list_versions(ctx: InvocationContext, filename: str) -> list[int]:
+    return await ctx.artifact_service.list_versions(app_name="test", user_id="listener", session_id=ctx.session.id, filename=filename)
+
+
+@pytest.mark.asyncio
+async def test_stream_artifacts_are_readable_through_gcs_artifact_service(tmp_path):
+    """GcsChunkUploadで保存・コピーしたアーティファクトを、GcsArtifactServiceのload_artifactとlist_versionsで読めることを確認"""
+    ctx = await make_context()
+    samples = np.arange(200, dtype=np.int16).reshape(-1, 2)
+
+    async with PcmArtifactStream(ctx, "music.pcm", "plan", FRAME_RATE, channels=2, directory=str(tmp_path), chunk_bytes=64) as stream:
+        stream.write(samples.tobytes())
+        assert await stream.finalize(stream.samples()) == 0
+        assert await stream.copy("user:music.pcm") == 0
+        assert await stream.copy("user:music.pcm") == 1
+
+    assert await list_versions(ctx, "music.pcm") == [0]
+    assert sorted(await list_versions(ctx, "user:music.pcm")) == [0, 1]
+    for filename in ["music.pcm", "user:music.pcm"]:
+        part = await load(ctx, filename)
+        assert part.inline_data.mime_type == PCM_MIME_TYPE
+        decoded, _ = decode_pcm(part.inline_data.data)
+        assert np.array_equal(decoded, samples)
+    # チャンクの一時オブジェクトはアーティファクトとして見えず、保存後に消える
+    assert await ctx.artifact_service.list_artifact_keys(app_name="test", user_id="listener", session_id=ctx.session.id) == ["music.pcm", "user:music.pcm"]
+    assert not [name for name in ctx.artifact_service.bucket.objects if name.startswith("_partial/")]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_save_creates_next_version():
+    """書き込む直前に同じバージョンが保存された場合は、上書きせずに次のバージョンとして保存することを確認"""
+    ctx = await make_context()
+    writer = GcsArtifactWriter.of(ctx)
+    bucket = ctx.artifact_service.bucket
+
+    def save_concurrently(_name: str) -> None:
+        # 条件無しで書き込むGcsArtifactService.save_artifactと同じ書き込み
+        bucket.blob(writer.blob_name("script.txt", 0)).upload_from_string(b"other", content_type="text/plain")
+
+    bucket.before_create = save_concurrently
+    version = await save_artifact(ctx, "script.txt", types.Part.from_bytes(data=b"mine", mime_type="text/plain"))
+
+    assert version == 1
+    assert sorted(await list_versions(ctx, "script.txt")) == [0, 1]
+    assert (await load(ctx, "script.txt", 0)).inline_data.data == b"other"
+    assert (await load(ctx, "script.txt")).inline_data.data == b"mine"
+
+
+@pytest.mark.asyncio
+async def test_save_gives_up_after_attempts():
+    """同じバージョンを取られ続けた場合はRuntimeErrorになることを確認"""
+    ctx = await make_context()
+    writer = GcsArtifactWriter.of(ctx)
+    # list_versionsに出てこないが、書き込み先の名前を塞ぐオブジェクト
+    with patch.object(GcsArtifactWriter, "list_versions", return_value=[]):
+        ctx.artifact_service.bucket.objects[writer.blob_name("script.txt", 0)] = (b"other", "text/plain")
+        with pytest.raises(RuntimeError, match="failed to save script.txt"):
+            await writer.save_bytes("script.txt", b"mine", "text/plain")
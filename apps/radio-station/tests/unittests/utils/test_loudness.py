@@ -0,0 +1,77 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from radio_station.utils.loudness import LoudnessMeter, LoudnessStats, analyze, k_weighting, loudness_gain
+
+
+def sine(seconds: float, frame_rate: int, dbfs: float, frequency: float = 997, channels: int = 2) -> np.ndarray:
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    return np.repeat((10 ** (dbfs / 20) * np.sin(2 * np.pi * frequency * t))[:, None], channels, axis=1).astype(np.float32)
+
+
+def test_k_weighting_matches_bs1770_coefficients():
+    """48kHzではBS.1770の係数と一致することを確認"""
+    sos = k_weighting(48000)
+
+    assert np.allclose(sos[0], [1.53512485958697, -2.69169618940638, 1.19839281085285, 1.0, -1.69065929318241, 0.73248077421585])
+    assert np.allclose(sos[1], [1.0, -2.0, 1.0, 1.0, -1.99004745483398, 0.99007225036621])
+
+
+@pytest.mark.parametrize("frame_rate", [22050, 24000, 48000])
+def test_integrated_loudness_of_reference_tone(frame_rate):
+    """-23dBFSの1kHzステレオ正弦波が -23LUFS になることを確認(EBU Tech 3341)"""
+    stats = analyze(sine(10, frame_rate, -23), frame_rate)
+
+    assert stats.integrated == pytest.approx(-23, abs=0.1)
+    assert stats.true_peak == pytest.approx(-23, abs=0.1)
+    assert stats.rms == pytest.approx(-26.01, abs=0.01)
+
+
+def test_gating_ignores_silence():
+    """無音区間はゲートで除外されることを確認(境界をまたぐブロックの分だけわずかに下がる)"""
+    frame_rate = 24000
+    samples = np.concatenate([sine(5, frame_rate, -23), np.zeros((frame_rate * 20, 2), dtype=np.float32)])
+
+    assert analyze(samples, frame_rate).integrated == pytest.approx(-23, abs=0.2)
+
+
+def test_block_processing_matches_whole():
+    """分割して測定しても一括測定と同じ結果になることを確認"""
+    frame_rate = 22050
+    rng = np.random.default_rng(0)
+    samples = (rng.standard_normal((frame_rate * 5, 2)) * 0.1).astype(np.float32)
+
+    meter = LoudnessMeter(frame_rate)
+    for block in np.array_split(samples, 17):
+        meter.process(block)
+
+    assert meter.stats() == analyze(samples, frame_rate)
+
+
+def test_silence_round_trips_as_json():
+    """無音の統計(-inf)をJSONで保存・復元できることを確認"""
+    stats = analyze(np.zeros((1000, 1), dtype=np.int16), 24000)
+
+    assert stats.integrated == -float("inf")
+    assert LoudnessStats.model_validate_json(stats.model_dump_json()) == stats
+
+
+def test_loudness_gain_is_capped_by_true_peak():
+    """目標ラウドネスまで上げるとトゥルーピークを超える場合はシーリングで止まることを確認"""
+    assert loudness_gain(LoudnessStats(integrated=-20, true_peak=-10, rms=-20)) == pytest.approx(10 ** (4 / 20))
+    assert loudness_gain(LoudnessStats(integrated=-20, true_peak=-3, rms=-20)) == pytest.approx(10 ** (2 / 20))
+    assert loudness_gain(LoudnessStats(integrated=-float("inf"), true_peak=-float("inf"), rms=-float("inf"))) == 1.0
@@ -0,0 +1,87 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import wave
+
+import numpy as np
+import pytest
+
+from radio_station.utils.loudness import analyze
+from radio_station.utils.pcm import PcmHeader, SampleFormat, decode_pcm, encode_pcm, is_pcm, read_audio, write_pcm
+
+
+def test_round_trip_is_zero_copy():
+    """書き込んだ配列とヘッダがそのまま読め、ペイロードはコピーされないことを確認"""
+    samples = (np.sin(np.arange(4800 * 2).reshape(-1, 2) / 10) * 10000).astype(np.int16)
+    stats = analyze(samples, 48000)
+
+    data = encode_pcm(samples, 48000, loudness=stats, metadata={"scale": 1.5})
+    decoded, header = decode_pcm(data)
+
+    assert is_pcm(data)
+    assert np.array_equal(decoded, samples)
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    assert np.shares_memory(decoded, buffer)
+    # ペイロードは16byte境界から始まる
+    assert (decoded.ctypes.data - buffer.ctypes.data) % 16 == 0
+    assert header == PcmHeader(frame_rate=48000, channels=2, sample_format=SampleFormat.S16LE, frames=4800, loudness=stats, metadata={"scale": 1.5})
+
+
+def test_round_trip_float_and_silence():
+    """float32のPCMと、無音(-inf)のラウドネス統計を書き込めることを確認"""
+    samples = np.zeros((100, 1), dtype=np.float32)
+
+    decoded, header = decode_pcm(memoryview(encode_pcm(samples, 24000, loudness=analyze(samples, 24000))))
+
+    assert decoded.dtype == np.float32 and decoded.shape == (100, 1)
+    assert header.sample_format is SampleFormat.F32LE
+    assert header.loudness.integrated == -float("inf")
+
+
+def test_write_pcm_matches_encode_pcm(tmp_path):
+    """ブロックごとにファイルへ書いた内容がencode_pcmと同じになることを確認"""
+    samples = np.arange(-1000, 1000, dtype=np.int16).reshape(-1, 2)
+    stats = analyze(samples, 24000)
+    path = str(tmp_path / "audio.pcm")
+
+    size = write_pcm(path, samples[100:], 24000, loudness=stats, block_frames=64)
+
+    with open(path, "rb") as f:
+        assert f.read() == encode_pcm(samples[100:], 24000, loudness=stats)
+    assert size == len(encode_pcm(samples[100:], 24000, loudness=stats))
+
+
+def test_read_audio_reads_legacy_wav():
+    """以前の形式のWAVも読めることを確認"""
+    samples = np.arange(-50, 50, dtype=np.int16).reshape(-1, 2)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(22050)
+        w.writeframes(samples.tobytes())
+
+    decoded, frame_rate, stats = read_audio(buf.getvalue())
+
+    assert np.array_equal(decoded, samples)
+    assert frame_rate == 22050
+    assert stats is None
+
+
+def test_decode_rejects_other_data():
+    with pytest.raises(ValueError, match="not a raw pcm artifact"):
+        decode_pcm(b"RIFF0000WAVE")
+    with pytest.raises(ValueError, match="unsupported sample dtype"):
+        encode_pcm(np.zeros((10, 1), dtype=np.int32), 24000)
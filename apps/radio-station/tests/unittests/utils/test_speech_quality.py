@@ -0,0 +1,88 @@
+# Copyright 2025 Keisuke Tominaga a.k.a soundTricker
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from radio_station.utils.audio import to_pcm16
+from radio_station.utils.speech_quality import analyze_speech
+
+FRAME_RATE = 24000
+
+
+def speech(seconds: float, amplitude: float = 0.5) -> np.ndarray:
+    """音量が立ち上がって自然に減衰する発話の代わりの音"""
+    t = np.arange(int(seconds * FRAME_RATE)) / FRAME_RATE
+    envelope = np.minimum(1.0, np.minimum(t, seconds - t) / 0.1)
+    return (amplitude * envelope * np.sin(2 * np.pi * 220 * t)).astype(np.float32).reshape(-1, 1)
+
+
+def silence(seconds: float) -> np.ndarray:
+    return np.zeros((int(seconds * FRAME_RATE), 1), dtype=np.float32)
+
+
+def pcm(*parts: np.ndarray) -> bytes:
+    return to_pcm16(np.concatenate(parts)).tobytes()
+
+
+def test_clean_speech():
+    report = analyze_speech(pcm(silence(0.3), speech(3.0), silence(0.5)), FRAME_RATE)
+
+    assert report.ok
+    assert report.duration_ms == 3800
+    assert report.leading_silence_ms == 300
+    assert 500 <= report.trailing_silence_ms <= 520
+    assert report.dropouts == [] and report.clipped_ratio == 0 and not report.truncated
+
+
+def test_leading_and_trailing_silence():
+    report = analyze_speech(pcm(silence(2.5), speech(2.0), silence(2.0)), FRAME_RATE)
+
+    assert report.leading_silence_ms >= 2500
+    assert report.trailing_silence_ms >= 2000
+    assert report.problems() == [f"leading silence {report.leading_silence_ms}ms", f"trailing silence {report.trailing_silence_ms}ms"]
+
+
+def test_internal_dropout():
+    """発話の途中の長い無音を検出し、短い間は問題にしないことを確認"""
+    report = analyze_speech(pcm(speech(1.0), silence(2.5), speech(1.0), silence(0.5), speech(1.0), silence(0.2)), FRAME_RATE)
+
+    assert len(report.dropouts) == 1
+    start, end = report.dropouts[0]
+    assert 980 <= start <= 1000 and 3500 <= end <= 3520
+    assert not report.ok
+
+
+def test_clipping():
+    report = analyze_speech(pcm(speech(2.0, amplitude=2.0), silence(0.2)), FRAME_RATE)
+
+    assert report.clipped_ratio > 0.1
+    assert report.problems() == [f"clipping {report.clipped_ratio:.2%}"]
+
+
+def test_truncated_ending():
+    """音量が下がり切らないまま終わっている場合に検出することを確認"""
+    cut = speech(3.0)[: int(2.0 * FRAME_RATE)]
+    report = analyze_speech(pcm(cut), FRAME_RATE)
+
+    assert report.truncated
+    assert report.trailing_silence_ms == 0
+    assert report.problems() == ["truncated ending"]
+
+
+def test_stereo_array_and_empty():
+    samples = to_pcm16(np.concatenate([speech(1.0), silence(0.2)]))
+    report = analyze_speech(np.repeat(samples, 2, axis=1), FRAME_RATE, channels=2)
+    assert report.ok and report.duration_ms == 1200
+
+    assert analyze_speech(b"", FRAME_RATE).problems() == ["empty audio"]